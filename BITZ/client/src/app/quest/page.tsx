@@ -36,24 +36,24 @@ export default function QuestPage() {
     setGpsCoordinates(newCoordinates);
   };
 
-  async function processImage(imageData: string, flavorValue: string | null) {
+  async function processImage(imageFile: File, flavorValue: string | null) {
     try {
-        // Prepare the request body with all needed parameters including flavor
-        const requestBody = {
-          conversation_id: getConversationId(),
-          user_id: getUserId(),
-          image_data: imageData,
-          image_location: location,
-          image_coordinates: gpsCoordinates,
-          flavor: flavorValue
-        };
+        // Send the image as a binary multipart upload (no base64 round-trip)
+        const requestBody = new FormData();
+        requestBody.append('image', imageFile);
+        requestBody.append('conversation_id', getConversationId() ?? '');
+        requestBody.append('user_id', getUserId() ?? '');
+        requestBody.append('image_location', location);
+        requestBody.append('image_coordinates', gpsCoordinates);
+        if (flavorValue) {
+          requestBody.append('flavor', flavorValue);
+        }
         
         console.log('Request body flavor:', flavorValue);
         
         const response = await fetch(API_URL + '/analyze', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(requestBody)
+            body: requestBody
         });
         
         return response.json();
@@ -91,7 +91,6 @@ export default function QuestPage() {
   
         if (typeof imageData === 'string') {
           try {
-            const base64Data = imageData.split(',')[1];
             setUploadedFile(imageData); // Use original image for display
             
             console.log('Starting image processing...');
@@ -99,7 +98,7 @@ export default function QuestPage() {
             
             setProcessingStatus('Analyzing image...');
 
-            const result = await processImage(base64Data, currentFlavor);
+            const result = await processImage(file, currentFlavor);
             console.log('Result:', result);
             setResultDict(result);
             setIsLoading(false);
@@ -2,16 +2,23 @@ import concurrent.futures
 import threading
 import markdown
 import mimetypes
-import hashlib
 import os
 import json
 from dotenv import load_dotenv
 from image_analyzer import ImageAnalyzer
+from session_store import SessionStore, create_state_backend
 from flask import Flask, send_from_directory, abort, request, jsonify, url_for, render_template, make_response, redirect, Response, stream_with_context
 from flask_cors import CORS
 import oaak
 import db
-from openai import OpenAI
+import image_handler
+import indexes
+import job_queue
+import llm_clients
+import map_data
+import metrics
+import rate_limiter
+import storage_stats
 from datetime import datetime
 # Counter no longer needed — species groups are aggregated in MongoDB
 import time
@@ -21,13 +28,22 @@ import zipfile
 import io
 
 BASE_DIR = os.path.abspath("history")  # Base directory
-analyzers = {}
 species_link_cache = {}
 species_link_cache_lock = threading.Lock()
 
 load_dotenv()
 
 app = Flask(__name__)
+metrics.init_app(app)
+indexes.ensure_indexes_background()
+
+def rebuild_analyzer(conversation_id):
+    """Recreate an evicted analyzer session from the observations stored in MongoDB."""
+    conversation = oaak.load_conversation(conversation_id, structured=True)
+    history = conversation.get('history', []) if conversation else []
+    return ImageAnalyzer.from_history(history)
+
+analyzers = SessionStore(rebuild_analyzer, ImageAnalyzer.from_state, create_state_backend())
 
 def human_readable_size(size, decimal_places=1):
     """Convert bytes to human-readable format (KB, MB, GB, etc.)"""
@@ -37,6 +53,64 @@ def human_readable_size(size, decimal_places=1):
         size /= 1024.0
     return f"{size:.{decimal_places}f} PB"
 
+def format_timestamp(timestamp):
+    """'%Y-%m-%d %H:%M' of an epoch-seconds string or a datetime ('' if missing)."""
+    if not timestamp:
+        return ''
+    try:
+        if not isinstance(timestamp, datetime):
+            timestamp = datetime.fromtimestamp(int(float(timestamp)))
+        return timestamp.strftime('%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        return ''
+
+def quest_listing(default_sort="date", default_per_page=50):
+    """
+    One page of quests with their disk usage, from the query params:
+    page, per_page (max 200), sort (date, name, size, updated), order
+    (asc, desc), q (quest id prefix) and user_id.
+    """
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = min(200, max(1, request.args.get("per_page", default_per_page, type=int)))
+    sort = request.args.get("sort", default_sort)
+    if sort not in db.QUEST_LISTING_SORTS:
+        sort = default_sort
+    order = request.args.get("order", "asc" if sort == "name" else "desc")
+    search = request.args.get("q", "").strip()
+    user_id = request.args.get("user_id", "").strip()
+
+    result = db.list_quests_with_storage(
+        page=page,
+        per_page=per_page,
+        sort=sort,
+        sort_order=1 if order == "asc" else -1,
+        search=search or None,
+        user_id=user_id or None,
+    )
+    result.update(sort=sort, order=order, q=search, user_id=user_id)
+    return result
+
+def quest_row(quest):
+    """Dashboard/explorer row of a quest returned by quest_listing()."""
+    storage = quest.get('storage') or {}
+    return {
+        'name': quest['quest_id'],
+        'full_path': quest['quest_id'],
+        'is_dir': True,
+        'size': human_readable_size(storage.get('total_bytes', 0)),
+        'files': storage.get('total_files', 0),
+        'created': format_timestamp(quest.get('timestamp')),
+        'mod_time': format_timestamp(storage.get('updated_at') or quest.get('timestamp')),
+        'icon': "📁"
+    }
+
+@app.template_global()
+def page_url(page):
+    """The current URL with another ?page=, keeping the other query params."""
+    args = request.args.to_dict(flat=False)
+    args['page'] = [page]
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
 def get_quest_ids():
     """Get all quest IDs from MongoDB"""
     try:
@@ -365,29 +439,26 @@ def explore_images(image_path=""):
         return send_from_directory(os.path.join(BASE_DIR, 'images'), image_path)
     
     # Set up cache
-    cache_dir = os.path.join(BASE_DIR, 'cache', res)
+    cached_image_path = storage_stats.rendition_path(BASE_DIR, res, image_path)
+    cache_dir, cached_filename = os.path.split(cached_image_path)
     os.makedirs(cache_dir, exist_ok=True)
     
-    # Create cached filename
-    image_hash = hashlib.md5(image_path.encode()).hexdigest()
-    file_ext = os.path.splitext(image_path)[1].lower()
-    cached_filename = f"{image_hash}{file_ext}"
-    cached_image_path = os.path.join(cache_dir, cached_filename)
-    
     # Create resized version if it doesn't exist
     if not os.path.exists(cached_image_path):
         try:
-            img = Image.open(abs_image_path)
-            img = ImageOps.exif_transpose(img)
-            
-            # Get target size and resize
-            target_size = sizes[res]
-            if target_size:
-                img.thumbnail(target_size, Image.LANCZOS)
-            
-            # Save cached version
-            img.save(cached_image_path, quality=85, optimize=True)
-            img.close()
+            with metrics.span("pil", f"resize_{res}"):
+                img = Image.open(abs_image_path)
+                img = ImageOps.exif_transpose(img)
+                
+                # Get target size and resize
+                target_size = sizes[res]
+                if target_size:
+                    img.thumbnail(target_size, Image.LANCZOS)
+                
+                # Save cached version
+                img.save(cached_image_path, quality=85, optimize=True)
+                img.close()
+            storage_stats.file_written(image_path.split('/')[0], storage_stats.RENDITIONS, cached_image_path)
             
         except Exception as e:
             app.logger.error(f"Image processing error ({res}): {image_path}: {str(e)}")
@@ -404,6 +475,53 @@ def explore_images(image_path=""):
         app.logger.error(f"Error serving cached image: {cached_image_path}: {str(e)}")
         abort(500)
 
+def explore_quest_listing(subpath):
+    """
+    Explorer rows for data/, images/ (a page of quests) and data/<id>/,
+    images/<id>/ (the files of one quest) built from MongoDB; None for any
+    other path, which is listed from disk.
+    """
+    parts = [part for part in subpath.split("/") if part]
+    if not parts or parts[0] not in ("data", "images") or len(parts) > 2:
+        return None
+
+    if len(parts) == 1:
+        listing = quest_listing(default_sort="name")
+        items = []
+        for quest in listing['quests']:
+            row = quest_row(quest)
+            row['full_path'] = f"{parts[0]}/{row['name']}"
+            if parts[0] == "data":
+                row['size'] = "-"
+            items.append(row)
+        return items, listing
+
+    quest_id = parts[1]
+    quest = db.load_quest(quest_id)
+    if not quest:
+        return None  # legacy quest only on disk
+
+    mod_time = format_timestamp(quest.get('timestamp'))
+    if parts[0] == "data":
+        # Served from MongoDB by explore()
+        names = ["history.json", "species_data_english.csv"]
+        items = [{'name': name, 'full_path': f"data/{quest_id}/{name}", 'is_dir': False,
+                  'size': "-", 'mod_time': mod_time, 'icon': "📄"} for name in names]
+        return items, None
+
+    items = []
+    for obs in db.load_observations(quest_id):
+        name = obs.get('image_filename')
+        if not name:
+            continue
+        size = storage_stats.file_size(os.path.join(BASE_DIR, "images", quest_id, name))
+        if size is None:
+            continue
+        items.append({'name': name, 'full_path': f"images/{quest_id}/{name}", 'is_dir': False,
+                      'size': human_readable_size(size),
+                      'mod_time': format_timestamp(obs.get('timestamp')) or mod_time, 'icon': "📄"})
+    return items, None
+
 @app.route("/explore/", methods=["GET"])
 @app.route("/explore/<path:subpath>", methods=["GET"])
 def explore(subpath=""):
@@ -430,6 +548,17 @@ def explore(subpath=""):
             else:
                 abort(404)
 
+    # Quest directories are listed from MongoDB, one page at a time
+    listing = explore_quest_listing(subpath)
+    if listing is not None:
+        items, pagination = listing
+        parent_path = "/".join(subpath.rstrip("/").split("/")[:-1])
+        return render_template('explorer.html',
+                              items=items,
+                              current_path=subpath,
+                              parent_path=parent_path,
+                              pagination=pagination)
+
     abs_path = os.path.join(BASE_DIR, subpath)
     
     # Prevent directory traversal attacks
@@ -474,6 +603,22 @@ def explore(subpath=""):
     
     abort(404)
 
+def remove_renditions(quest_id, image_names):
+    """Delete the cached resizes and vision renditions of a quest's images."""
+    cache_root = os.path.join(BASE_DIR, 'cache')
+    resolutions = os.listdir(cache_root) if os.path.isdir(cache_root) else []
+    for name in image_names:
+        paths = [storage_stats.rendition_path(BASE_DIR, res, f"{quest_id}/{name}") for res in resolutions]
+        try:
+            paths.append(image_handler.vision_cache_path(os.path.join(BASE_DIR, 'images', quest_id, name)))
+        except OSError:
+            pass
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
 @app.route("/delete/<id>", methods=["GET", "POST"])
 def delete(id=""):
     """
@@ -493,8 +638,8 @@ def delete(id=""):
     images_path = os.path.join(BASE_DIR, "images", id)
     data_path = os.path.join(BASE_DIR, "data", id)
     
-    # Check if the main record exists
-    if not os.path.exists(data_path):
+    # Check if the record exists (legacy quests only have their data directory)
+    if not db.load_quest(id) and not os.path.exists(images_path) and not os.path.exists(data_path):
         return render_template('delete_error.html', message=f"Record with ID {id} not found"), 404
     
     # Handle POST request (password submission)
@@ -508,19 +653,22 @@ def delete(id=""):
         if password == correct_password:
             import shutil
             try:
-                # Delete from MongoDB (quest + observations + species)
+                # Delete from MongoDB (quest + observations + species + storage counters)
                 db.delete_quest(id)
 
-                # Delete the images directory if it exists
+                # Delete the cached renditions, then the images directory if it exists
                 if os.path.exists(images_path):
+                    remove_renditions(id, os.listdir(images_path))
                     shutil.rmtree(images_path)
                 
                 # Delete the data directory if it exists
                 if os.path.exists(data_path):
                     shutil.rmtree(data_path)
 
-                # Clear from metadata cache
+                # Clear from metadata and map caches
                 quest_metadata_cache.pop(id, None)
+                map_data.forget(id)
+                analyzers.discard(id)
 
                 return render_template('delete_success.html', 
                                        message=f"Record {id} and all associated data successfully deleted",
@@ -593,82 +741,28 @@ def dashboard():
     """
     Display a dashboard with all quests and associated actions.
     """
-    # Get all top-level folders in the history directory
-    abs_path = os.path.join(BASE_DIR, "data")
-    
-    # Check if the directory exists
-    if not os.path.isdir(abs_path):
-        return render_template('delete_error.html', message="History directory not found"), 404
-    
-    # Get list of top-level folders (quests)
-    items = os.listdir(abs_path)
-    items.sort()  # Sort alphabetically by default
+    # Quest metadata and disk usage come from MongoDB one page at a time
+    # (disk usage is updated as files are written, see storage_stats.py)
+    listing = quest_listing()
+    quests = [quest_row(quest) for quest in listing['quests']]
     
-    quests = []
-    for item in items:
-        item_path = os.path.join(abs_path, item)
-        
-        # Skip if not a directory or if it's a special directory
-        if not os.path.isdir(item_path) or item.startswith('.'):
-            continue
-        
-        # Calculate directory size
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(item_path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                if os.path.isfile(fp):
-                    total_size += os.path.getsize(fp)
-        
-        # Create quest info dictionary
-        quest_info = {
-            'name': item,
-            'full_path': item,
-            'is_dir': True,
-            'size': human_readable_size(total_size),
-            'mod_time': datetime.fromtimestamp(os.path.getmtime(item_path)).strftime('%Y-%m-%d %H:%M'),
-            'icon': "📁"
-        }
-        
-        quests.append(quest_info)
-    
-    return render_template('dashboard.html', quests=quests)
+    return render_template('dashboard.html', quests=quests, pagination=listing)
 
 @app.route("/map")
 def map_view():
-    quest_ids = get_quest_ids()
-
-    if not quest_ids:
-        return "Error: No quest IDs provided. Use ?ids=quest1&ids=quest2", 400
-    
-    # Prepare data for all quests
-    all_quests_data = []
-    
-    for quest_id in quest_ids:
-        imgs_path = os.path.join(BASE_DIR, "images", quest_id)
-
-        # Check quest exists in MongoDB and images exist on disk
-        quest = db.load_quest(quest_id)
-        if not quest or not os.path.isdir(imgs_path):
-            continue
-
-        # Relative paths for frontend (CSV & history served via /explore/ from MongoDB)
-        relative_csv_path = f"/explore/data/{quest_id}/species_data_english.csv"
-        relative_history_path = f"/explore/data/{quest_id}/history.json"
-        relative_imgs_path = f"/explore/images/{quest_id}/"
-
-        all_quests_data.append({
-            "id": quest_id,
-            "csv_path": relative_csv_path,
-            "history_path": relative_history_path,
-            "images_path": relative_imgs_path
-        })
-    
-    if not all_quests_data:
-        return "Error: None of the provided quest IDs exist or have valid data", 404
-    
-    # Render the quests overview template
-    return render_template('map_view.html', quests=all_quests_data)
+    # The page fetches every point at once from /map/data
+    return render_template('map_view.html')
+
+@app.route("/map/data")
+def map_data_view():
+    """All map points: {"quests": [{"id", "center", "points": [...]}]} (see map_data.py)."""
+    body, etag = map_data.get()
+    if etag in request.if_none_match:
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 @app.route("/recap/<id>")
 def recap(id):
@@ -734,130 +828,99 @@ def load_history():
         return conversation_data.get('history', [])
     return []
 
+def image_tiles(observation):
+    """Grid tiles of an image observation: one per identified species, or one if none."""
+    image_filename = observation['image_filename']
+    base = {
+        'quest_id': observation['quest_id'],
+        'image_path': f"/explore/images/{observation['quest_id']}/{image_filename}?res=thumb",
+        'image_filename': image_filename,
+        'timestamp': format_timestamp(observation.get('ts')),
+        'location': observation.get('image_location'),
+    }
+    species = observation.get('species') or [{}]
+    tiles = []
+    for entry_id, sp in enumerate(species):
+        tile = dict(base)
+        tile.update({
+            'unique_id': f"{observation['quest_id']}_{image_filename}_{entry_id}",
+            'taxonomic_group': sp.get('taxonomic_group', ''),
+            'scientific_name': sp.get('scientific_name', ''),
+            'common_name': sp.get('common_name', ''),
+        })
+        tiles.append(tile)
+    return tiles
+
+def image_grid_page():
+    """
+    One page of grid tiles from the query params: id or ids (quests to
+    show, default all), limit (observations per page, max 200) and cursor
+    (next_cursor of the previous page).
+    """
+    quest_id = request.args.get('id', None)
+    quest_ids = [quest_id] if quest_id else request.args.getlist('ids')
+    limit = min(200, max(1, request.args.get('limit', 60, type=int)))
+    page = db.get_image_observations_page(limit=limit,
+                                          cursor=request.args.get('cursor') or None,
+                                          quest_ids=quest_ids or None)
+    images = [tile for observation in page['observations'] for tile in image_tiles(observation)]
+    return images, page['next_cursor']
+
 @app.route("/images/")
 def image_grid(quest_id=None):
     quest_id = request.args.get('id', None)
 
-    # If quest_id is not provided, get all quest IDs from query params or use all available
-    if not quest_id:
-        quest_ids = request.args.getlist('ids')
-        if not quest_ids:
-            # If no IDs are provided, try to find all available quests
-            try:
-                data_dir = os.path.join(BASE_DIR, "data")
-                quest_ids = [d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d))]
-            except Exception as e:
-                return f"Error finding quests: {str(e)}", 500
-    else:
-        quest_ids = [quest_id]
-    
-    # Collect all image data
-    all_images = []
-    
-    for qid in quest_ids:
-        imgs_path = os.path.join(BASE_DIR, "images", qid)
-
-        # Skip if images don't exist on disk
-        if not os.path.isdir(imgs_path):
-            continue
-
-        relative_imgs_path = f"/explore/images/{qid}/"
-
-        try:
-            # Load species data from MongoDB
-            species_rows = db.load_species(qid)
-            species_data = {}
-            for sp in species_rows:
-                image_name = sp.get("observation_image", "")
-                if image_name not in species_data:
-                    species_data[image_name] = []
-                species_data[image_name].append({
-                    'image_name': image_name,
-                    'taxonomic_group': sp.get('taxonomic_group', ''),
-                    'scientific_name': sp.get('scientific_name', ''),
-                    'common_name': sp.get('common_name', ''),
-                    'entry_id': len(species_data[image_name])
-                })
+    # The first page is rendered here, the next ones are fetched from
+    # /images/page as the user scrolls
+    try:
+        images, next_cursor = image_grid_page()
+    except ValueError as e:
+        return str(e), 400
 
-            # Load history data from MongoDB
-            history_json = db.load_conversation(qid)
-            if not history_json:
-                continue
-            
-            # Get center location
-            center_location = None
-            if history_json.get('location') and history_json['location'].get('coordinates'):
-                center_location = {
-                    'latitude': history_json['location']['coordinates'].get('latitude'),
-                    'longitude': history_json['location']['coordinates'].get('longitude')
-                }
-            
-            # Extract image data from history
-            for entry in history_json.get('history', []):
-                if entry.get('image_filename'):
-                    image_filename = entry['image_filename']
-                    
-                    # If this image has species data
-                    if image_filename in species_data:
-                        # For each entry in the species data, create a separate image entry
-                        for species_entry in species_data[image_filename]:
-                            image_info = {
-                                'quest_id': qid,
-                                'image_path': f"{relative_imgs_path}{image_filename}?res=thumb",
-                                'image_filename': image_filename,
-                                'timestamp': datetime.fromtimestamp(int(entry.get('timestamp'))).strftime('%Y-%m-%d %H:%M'),
-                                'location': entry.get('image_location'),
-                                # Add a unique ID combining filename and entry ID for proper randomization
-                                'unique_id': f"{image_filename}_{species_entry['entry_id']}"
-                            }
-                            
-                            # Add species data
-                            image_info.update(species_entry)
-                            
-                            all_images.append(image_info)
-                    else:
-                        # If no species data, still add the image once
-                        image_info = {
-                            'quest_id': qid,
-                            'image_path': f"{relative_imgs_path}{image_filename}?res=thumb",
-                            'image_filename': image_filename,
-                            'timestamp': datetime.fromtimestamp(int(entry.get('timestamp'))).strftime('%Y-%m-%d %H:%M'),
-                            'location': entry.get('image_location'),
-                            'unique_id': f"{image_filename}_0"
-                        }
-                        
-                        all_images.append(image_info)
-        
-        except Exception as e:
-            print(f"Error processing quest {qid}: {str(e)}")
-            continue
-    
-    # Sort images by timestamp (newest first)
-    all_images.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-    
-    # Render the template
-    return render_template('image_grid.html', 
-                          images=all_images,
+    return render_template('image_grid.html',
+                          images=images,
                           filtered_quest_id=quest_id,
-                          total_quests=len(set(img['quest_id'] for img in all_images)),
-                          total_images=len(all_images))
+                          next_cursor=next_cursor,
+                          # Counts of what is loaded so far; the page updates them as it scrolls
+                          loaded_quests=len(set(img['quest_id'] for img in images)))
+
+@app.route("/images/page")
+def image_grid_api():
+    """Next page of the image grid as JSON: {"images": [...], "next_cursor": ...}."""
+    try:
+        images, next_cursor = image_grid_page()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"images": images, "next_cursor": next_cursor})
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    data = request.json
-    
+    """
+    Analyze a quest image. Accepts either
+      - multipart/form-data with the image as the `image` file field and the
+        other parameters as form fields (streamed to disk, no base64), or
+      - a JSON body with the image as base64 in `image_data`.
+    """
+    upload = request.files.get("image")
+    if upload:
+        data = request.form
+        image = upload.stream
+    else:
+        data = request.get_json(silent=True) or {}
+        image = data.get("image_data")
+
     conversation_id = data.get("conversation_id")
     user_id = data.get("user_id")
-    image_b64 = data['image_data']
     image_location = data.get("image_location", None)
     image_coordinates = data.get("image_coordinates", None)
     flavor = data.get("flavor", None)
 
     # Check if the image data is provided
-    if not image_b64:
+    if not image:
         return jsonify({"error": "No image data provided"}), 400
 
-    conversation = oaak.load_conversation(conversation_id)
+    # Analyses come back as dicts: read by the analyzer and saved back as is
+    conversation = oaak.load_conversation(conversation_id, structured=True)
 
     # If this is not the first message on this conversation, get the coordinates and location from history
     if conversation:
@@ -869,16 +932,23 @@ def analyze():
         conversation_location = image_location
         history = []
 
-    analyzer = analyzers.setdefault(conversation_id, ImageAnalyzer())
-    image_path = oaak.process_image(image_b64, conversation_id, len(history), image_coordinates)
+    analyzer = analyzers.get(conversation_id, lambda: ImageAnalyzer.from_history(history))
+    image_path, vision_b64 = oaak.process_image(image, conversation_id, len(history), image_coordinates)
     
     last_result = history[-1] if history else None
-    result = analyzer.analyze_image(image_path, flavor, history)
+    try:
+        result = analyzer.analyze_image(image_path, flavor, history, image_b64=vision_b64)
+    except rate_limiter.LimitExceeded as e:
+        # Nothing is added to the history: drop the upload and its pending
+        # identification so the retry, which reuses the same file name, is identified
+        oaak.discard_image(image_path, conversation_id)
+        return limit_response(analyzer.limit_response_body(e))
+    analyzers.save(conversation_id, analyzer)
 
     # Create user message entry
     timestamp = str(int(time.time()))
     image_filename = os.path.basename(image_path)
-    user_message = oaak.create_user_message("", timestamp, image_filename, image_coordinates, str(result))
+    user_message = oaak.create_user_message("", timestamp, image_filename, image_coordinates, result)
     
     history.append(user_message)
 
@@ -886,18 +956,50 @@ def analyze():
 
     return jsonify(result)
 
+@app.route('/identification_status/<quest_id>', methods=['GET'])
+def identification_status(quest_id):
+    """
+    Progress of the background species identification of a quest's images.
+    `complete` is true once no job is pending or running; species are then
+    available from /quest_info.
+    """
+    return jsonify(job_queue.quest_status(quest_id))
+
 @app.route('/answer', methods=['POST'])
 def answer():
     try:
         data = request.json
         conversation_id = data.get("conversation_id")
 
-        analyzer = analyzers.setdefault(conversation_id, ImageAnalyzer())
+        analyzer = analyzers.get(conversation_id)
 
         result = analyzer.process_user_response(
             answer=data['answer']
         )
+        analyzers.save(conversation_id, analyzer)
         return jsonify(result)
+    except rate_limiter.LimitExceeded as e:
+        return limit_response(rate_limiter.error_body(e))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/analyzer_sessions', methods=['GET'])
+def analyzer_sessions():
+    """Occupancy, memory, eviction and shared-state counters of this worker's session store."""
+    return jsonify(analyzers.stats())
+
+def limit_response(body):
+    """429 with Retry-After for a call refused by the rate limiter or the daily budget."""
+    response = jsonify(body)
+    response.status_code = 429
+    response.headers["Retry-After"] = str(body["retry_after"])
+    return response
+
+@app.route('/llm_budget', methods=['GET'])
+def llm_budget():
+    """Shared LLM token bucket level and today's call budget usage, per endpoint."""
+    try:
+        return jsonify(rate_limiter.stats())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -907,7 +1009,7 @@ def question():
     Route for asking additional questions about an already analyzed image.
     Uses standard (non-streaming) response with GPT-4o Mini.
     """
-    openai_client = OpenAI()
+    openai_client = llm_clients.get_openai_client()
     try:
         data = request.json
         user_message = data.get('question')
@@ -934,14 +1036,17 @@ def question():
         messages.append({"role": "user", "content": user_message})
         
         # Create the API call without streaming
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",  # Using GPT-4o Mini as requested
-            messages=messages
-        )
+        with rate_limiter.limit("question"), metrics.span("llm", "question"):
+            response = openai_client.chat.completions.create(
+                model="gpt-4o-mini",  # Using GPT-4o Mini as requested
+                messages=messages
+            )
         
         # Return the response content
         return response.choices[0].message.content
         
+    except rate_limiter.LimitExceeded as e:
+        return limit_response(rate_limiter.error_body(e))
     except Exception as e:
         app.logger.error(f"Error in question route: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -951,6 +1056,9 @@ def get_species_link_single(openai_client, species_pair):
     """
     Helper function to get a link for a single species pair.
     This is the core logic extracted from your existing link_species route.
+    Links are precomputed for the network view, so uncached pairs go through
+    the rate limiter at background priority; a refused pair is reported with
+    `retry_after` and is not cached.
     """
     # Validate species input
     if not isinstance(species_pair, list):
@@ -983,10 +1091,11 @@ def get_species_link_single(openai_client, species_pair):
     
     try:
         # Create the API call without streaming
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages
-        )
+        with rate_limiter.limit("link_species", rate_limiter.BACKGROUND), metrics.span("llm", "link_species"):
+            response = openai_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages
+            )
         
         # Get the response content
         link_response = response.choices[0].message.content.strip()
@@ -998,6 +1107,8 @@ def get_species_link_single(openai_client, species_pair):
         
         return {"link": link_response, "cached": False}
         
+    except rate_limiter.LimitExceeded as e:
+        return rate_limiter.error_body(e)
     except Exception as e:
         app.logger.error(f"Error linking species {species_pair}: {str(e)}")
         return {"error": str(e)}
@@ -1026,7 +1137,7 @@ def link_species_batch():
         ]
     }
     """
-    openai_client = OpenAI()
+    openai_client = llm_clients.get_openai_client()
     
     data = request.json
     species_pairs = data.get('species_pairs', [])
@@ -1093,13 +1204,16 @@ def link_species():
     Original single species pair linking endpoint.
     Kept for backward compatibility.
     """
-    openai_client = OpenAI()
+    openai_client = llm_clients.get_openai_client()
     
     data = request.json
     species = data.get('species')
     
     result = get_species_link_single(openai_client, species)
     
+    if "retry_after" in result:
+        return limit_response(result)
+
     if "error" in result:
         return jsonify(result), 400
     
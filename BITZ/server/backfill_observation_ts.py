@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Backfill the numeric `ts` field of observations saved before it existed.
+
+The image grid sorts and pages observations on `ts` (epoch seconds, see
+db.timestamp_seconds) and only shows observations with a numeric ts
+(db.IMAGE_GRID_FILTER). Older documents only have the `timestamp` string
+and are left out of the grid until they are backfilled; those whose
+timestamp cannot be parsed get ts: null and stay out of it.
+
+Usage:
+    python backfill_observation_ts.py              # dry-run (default)
+    python backfill_observation_ts.py --apply      # actually write
+"""
+
+import argparse
+import sys
+
+from pymongo import UpdateOne
+
+import db
+
+
+def backfill(apply: bool = False, batch_size: int = 1000):
+    col = db.get_observations_collection()
+    query = {"ts": {"$exists": False}}
+    total = col.count_documents(query)
+    print(f"{total} observations without ts …\n")
+
+    updated = 0
+    unparsable = 0
+    batch = []
+    for doc in col.find(query, {"timestamp": 1}, batch_size=batch_size):
+        ts = db.timestamp_seconds(doc.get("timestamp"))
+        if ts is None:
+            unparsable += 1
+        # Unparsable timestamps get ts: null so they are not scanned again
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"ts": ts}}))
+        if len(batch) >= batch_size:
+            if apply:
+                updated += col.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch and apply:
+        updated += col.bulk_write(batch, ordered=False).modified_count
+
+    print(f"{'=' * 60}")
+    print(f"Observations without ts : {total}")
+    print(f"Unparsable timestamps   : {unparsable}")
+    if apply:
+        print(f"Updated                 : {updated}")
+    elif total:
+        print("\nThis was a dry-run. Re-run with --apply to write changes.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the numeric ts of MongoDB observations")
+    parser.add_argument("--apply", action="store_true", help="Actually write (default is dry-run)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Updates per bulk write (default: 1000)")
+    args = parser.parse_args()
+
+    try:
+        db.get_client()
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+
+    backfill(apply=args.apply, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
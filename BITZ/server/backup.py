@@ -1,118 +1,237 @@
 #!/usr/bin/env python3
 """
-Script to backup the 'history' folder to a GCP bucket.
-Usage: ./backup.py [bucket_name] [backup_prefix]
+Incremental, content-addressed backup of the 'history' folder.
+
+Every file is stored once, under the SHA-256 of its content
+(objects/<2 hex>/<sha256>), as is: JPEGs are not recompressed. A run
+uploads only the objects the target does not have yet, in parallel, then
+writes a manifest (manifests/<timestamp>.json, to the microsecond) mapping
+each relative path to its hash, size and mtime (plus the stat fields
+below). A manifest fully describes one backup; restore.py rebuilds the
+folder from it. An existing manifest is never overwritten.
+
+Hashes of the previous run are kept in .backup_manifest.json and reused for
+files whose size, mtime (in nanoseconds), ctime and inode did not change, so
+an unchanged corpus is neither re-read nor re-uploaded. ctime and inode
+catch a file rewritten within the same mtime tick or replaced by one with
+a restored mtime. Rendition caches (history/cache) are skipped by default:
+the server regenerates them.
+
+Targets (see backup_storage.py): gs://bucket[/prefix] or a local directory.
+
+Usage:
+    ./backup.py gs://my-bucket/history_backup [--workers 16] [--dry-run]
+    ./backup.py /mnt/backups/bitz --source history
+    ./backup.py my-bucket [backup_prefix]      # same as gs://my-bucket/<prefix>
 """
 
+import argparse
+import datetime
+import hashlib
+import json
 import os
 import sys
 import time
-import zipfile
-import datetime
-from google.cloud import storage
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Tuple
+
+import backup_storage
+
+MANIFEST_VERSION = 1
+OBJECTS = "objects"
+MANIFESTS = "manifests"
+HASH_CACHE = ".backup_manifest.json"
+LAST_BACKUP_FILE = ".last_backup.txt"
+DEFAULT_EXCLUDES = ["cache"]
+# Stat fields that must all match the previous run to reuse its hash
+UNCHANGED_FIELDS = ("size", "mtime_ns", "ctime_ns", "inode")
+
+
+def object_key(sha256: str) -> str:
+    return f"{OBJECTS}/{sha256[:2]}/{sha256}"
+
 
-def create_zip_archive(source_dir, output_filename):
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def scan(source_dir: str, excludes: List[str]) -> Dict[str, Dict[str, Any]]:
     """
-    Create a zip archive of the specified directory
-    
-    Args:
-        source_dir (str): Directory to zip
-        output_filename (str): Output zip file path
-    
-    Returns:
-        str: Path to the created zip file
+    Relative path → {"size", "mtime", "mtime_ns", "ctime_ns", "inode"} of
+    every file under `source_dir`. "mtime" (seconds) is what restore.py sets.
     """
-    print(f"Creating zip archive of {source_dir}...")
-    
-    if not os.path.exists(source_dir):
-        print(f"Error: Source directory '{source_dir}' does not exist")
-        sys.exit(1)
-        
+    files = {}
+    excluded = {os.path.normpath(e) for e in excludes}
+    for root, dirs, names in os.walk(source_dir):
+        rel_root = os.path.relpath(root, source_dir)
+        dirs[:] = [d for d in dirs if os.path.normpath(os.path.join(rel_root, d)) not in excluded]
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # deleted while scanning
+            rel = os.path.relpath(path, source_dir).replace(os.sep, "/")
+            files[rel] = {
+                "size": st.st_size,
+                "mtime": int(st.st_mtime),
+                "mtime_ns": st.st_mtime_ns,
+                "ctime_ns": st.st_ctime_ns,
+                "inode": st.st_ino,
+            }
+    return files
+
+
+def load_hash_cache() -> Dict[str, Dict[str, Any]]:
     try:
-        with zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(source_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, os.path.dirname(source_dir))
-                    print(f"Adding {arcname}")
-                    zipf.write(file_path, arcname)
-        
-        print(f"Zip archive created: {output_filename}")
-        return output_filename
-    except Exception as e:
-        print(f"Error creating zip archive: {e}")
-        sys.exit(1)
+        with open(HASH_CACHE, "r", encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
 
-def upload_to_gcp(bucket_name, source_file, destination_blob_name):
+def hash_files(source_dir: str, files: Dict[str, Dict[str, Any]], workers: int,
+               rehash: bool = False) -> Tuple[int, int]:
     """
-    Upload a file to a GCP bucket
-    
-    Args:
-        bucket_name (str): Name of the GCP bucket
-        source_file (str): Local file to upload
-        destination_blob_name (str): Destination blob name in the bucket
-    
-    Returns:
-        str: Public URL of the uploaded file
+    Add "sha256" to every entry of `files`, reusing the previous run's hash
+    when all of UNCHANGED_FIELDS match. Entries of older runs lack some of
+    them and are hashed again. Returns (hashed, reused).
     """
-    print(f"Uploading {source_file} to GCP bucket {bucket_name}...")
-    
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob_name)
-        
-        # Upload the file
-        blob.upload_from_filename(source_file)
-        
-        print(f"File {source_file} uploaded to {destination_blob_name}")
-        return blob.public_url
-    except Exception as e:
-        print(f"Error uploading to GCP: {e}")
-        sys.exit(1)
+    previous = {} if rehash else load_hash_cache()
+    todo = []
+    for rel, entry in files.items():
+        old = previous.get(rel)
+        if old and old.get("sha256") and all(old.get(field) == entry[field] for field in UNCHANGED_FIELDS):
+            entry["sha256"] = old["sha256"]
+        else:
+            todo.append(rel)
 
-def main():
-    # Check for command-line arguments
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} [bucket_name] [backup_prefix]")
-        print("If backup_prefix is not provided, 'history_backup' will be used")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(file_sha256, os.path.join(source_dir, rel)): rel for rel in todo}
+        for future in as_completed(futures):
+            rel = futures[future]
+            try:
+                files[rel]["sha256"] = future.result()
+            except OSError as e:
+                print(f"Warning: skipping {rel}: {e}")
+                del files[rel]
+    return len(todo), len(files) - len(todo)
+
+
+def upload_missing(storage, source_dir: str, files: Dict[str, Dict[str, Any]], workers: int,
+                   dry_run: bool = False, verbose: bool = False) -> Tuple[int, int]:
+    """Upload the objects the target lacks. Returns (objects uploaded, bytes uploaded)."""
+    existing = storage.list(f"{OBJECTS}/")
+    to_upload: Dict[str, Tuple[str, int]] = {}
+    for rel, entry in files.items():
+        key = object_key(entry["sha256"])
+        if key not in existing and key not in to_upload:
+            to_upload[key] = (rel, entry["size"])
+
+    total_bytes = sum(size for _rel, size in to_upload.values())
+    print(f"{len(to_upload)} new object(s), {total_bytes / 1e6:.1f} MB to upload "
+          f"({len(existing)} already in the target)")
+    if dry_run or not to_upload:
+        return len(to_upload), total_bytes
+
+    started = time.monotonic()
+    done_bytes = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(storage.upload_file, os.path.join(source_dir, rel), key): (rel, size)
+            for key, (rel, size) in to_upload.items()
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            rel, size = futures[future]
+            future.result()  # an upload error aborts the backup before any manifest is written
+            done_bytes += size
+            if verbose:
+                print(f"  uploaded {rel}")
+            if i % 100 == 0 or i == len(futures):
+                elapsed = time.monotonic() - started
+                print(f"  {i}/{len(futures)} objects, {done_bytes / 1e6:.1f} MB "
+                      f"({done_bytes / 1e6 / elapsed if elapsed else 0:.1f} MB/s)")
+    return len(to_upload), total_bytes
+
+
+def backup(target: str, source_dir: str = "history", workers: int = 8, excludes: List[str] = None,
+           dry_run: bool = False, rehash: bool = False, verbose: bool = False) -> str:
+    """Back up `source_dir` to `target`; returns the key of the manifest written."""
+    if not os.path.isdir(source_dir):
+        print(f"Error: Source directory '{source_dir}' does not exist")
         sys.exit(1)
-    
-    # Get parameters
-    bucket_name = sys.argv[1]
-    backup_prefix = sys.argv[2] if len(sys.argv) > 2 else "history_backup"
-    
-    # Set paths
-    history_dir = "history"
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    zip_filename = f"{backup_prefix}_{timestamp}.zip"
-    
-    # Create the zip archive
-    zip_path = create_zip_archive(history_dir, zip_filename)
-    
-    # Upload to GCP
-    destination_blob = f"backups/{zip_filename}"
-    public_url = upload_to_gcp(bucket_name, zip_path, destination_blob)
-    
-    # Save the last backup info to a local file for restore purposes
-    with open(".last_backup.txt", "w") as f:
-        f.write(f"{bucket_name}|{destination_blob}|{timestamp}")
-    
+    storage = backup_storage.open_target(target)
+    # Microseconds, so two runs within the same second get their own manifest
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+    print(f"Scanning {source_dir} ...")
+    files = scan(source_dir, DEFAULT_EXCLUDES if excludes is None else excludes)
+    hashed, reused = hash_files(source_dir, files, workers, rehash)
+    size = sum(entry["size"] for entry in files.values())
+    print(f"{len(files)} file(s), {size / 1e6:.1f} MB ({hashed} hashed, {reused} unchanged since the last run)")
+
+    uploaded, uploaded_bytes = upload_missing(storage, source_dir, files, workers, dry_run, verbose)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "created_at": timestamp,
+        "source": os.path.abspath(source_dir),
+        "files": files,
+    }
+    manifest_key = f"{MANIFESTS}/{timestamp}.json"
+    if dry_run:
+        print("\nDry run — nothing was uploaded.")
+        return manifest_key
+
+    # Written last: a manifest only ever refers to objects already stored
+    if storage.exists(manifest_key):
+        raise RuntimeError(f"{manifest_key} already exists in {storage.url}, not overwriting it")
+    storage.upload_bytes(json.dumps(manifest, separators=(",", ":")).encode("utf-8"), manifest_key)
+    with open(HASH_CACHE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    with open(LAST_BACKUP_FILE, "w") as f:
+        f.write(f"{storage.url}|{manifest_key}|{timestamp}")
+
     print("\nBackup Summary:")
-    print(f"- Source: {history_dir}")
-    print(f"- Backup file: {zip_filename}")
-    print(f"- GCP bucket: {bucket_name}")
-    print(f"- GCP path: {destination_blob}")
-    print(f"- Timestamp: {timestamp}")
+    print(f"- Source: {source_dir}")
+    print(f"- Target: {storage.url}")
+    print(f"- Manifest: {manifest_key}")
+    print(f"- Files: {len(files)} ({size / 1e6:.1f} MB)")
+    print(f"- Uploaded: {uploaded} object(s), {uploaded_bytes / 1e6:.1f} MB")
     print("\nBackup completed successfully!")
-    print(f"Backup info saved to .last_backup.txt for restore purposes")
-    
-    # Cleanup the local zip file
+    print(f"Backup info saved to {LAST_BACKUP_FILE} for restore purposes")
+    return manifest_key
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental backup of the history folder")
+    parser.add_argument("target", help="gs://bucket[/prefix], a local directory, or a bucket name")
+    parser.add_argument("backup_prefix", nargs="?", default="history_backup",
+                        help="Prefix in the bucket when TARGET is a bare bucket name (default: history_backup)")
+    parser.add_argument("--source", default="history", help="Folder to back up (default: history)")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel hashes and uploads (default: 8)")
+    parser.add_argument("--exclude", action="append",
+                        help="Subfolder of the source to skip (repeatable, default: cache)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be uploaded")
+    parser.add_argument("--rehash", action="store_true", help="Hash every file again")
+    parser.add_argument("--verbose", action="store_true", help="List uploaded files")
+    args = parser.parse_args()
+
+    target = args.target
+    if "://" not in target and not target.startswith(("/", ".")) and os.sep not in target:
+        # Bare bucket name, as in the zip-based backups
+        target = f"gs://{target}/{args.backup_prefix}"
+
     try:
-        os.remove(zip_path)
-        print(f"Temporary zip file {zip_path} removed")
+        backup(target, args.source, max(1, args.workers), args.exclude, args.dry_run, args.rehash, args.verbose)
     except Exception as e:
-        print(f"Warning: Could not remove temporary zip file: {e}")
+        print(f"Error during backup: {e}")
+        sys.exit(1)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
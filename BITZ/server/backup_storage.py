@@ -0,0 +1,136 @@
+"""
+Storage targets of backup.py and restore.py.
+
+A target holds opaque objects under string keys ("objects/ab/abcd…",
+"manifests/20260101_120000_000000.json"). Two implementations:
+
+  GCSStorage    a GCS bucket, optionally under a prefix (gs://bucket/prefix).
+                Files above BACKUP_MULTIPART_THRESHOLD bytes are uploaded
+                in BACKUP_CHUNK_SIZE parts in parallel (XML multipart
+                upload through google.cloud.storage.transfer_manager).
+  LocalStorage  a directory (file:///path, or any path), for tests and
+                local copies. Objects are written to a temporary name and
+                renamed, so an interrupted backup never leaves a partial
+                object behind.
+
+open_target() picks one from a URL. Objects are immutable: a key is never
+rewritten with different content.
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Set
+
+BACKUP_MULTIPART_THRESHOLD = int(os.getenv("BACKUP_MULTIPART_THRESHOLD", str(32 * 1024 * 1024)))
+BACKUP_CHUNK_SIZE = int(os.getenv("BACKUP_CHUNK_SIZE", str(8 * 1024 * 1024)))
+BACKUP_CHUNK_WORKERS = int(os.getenv("BACKUP_CHUNK_WORKERS", "4"))
+
+
+class LocalStorage:
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.url = f"file://{self.root}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def list(self, prefix: str = "") -> Set[str]:
+        keys = set()
+        base = self._path(prefix) if prefix else self.root
+        for root, _dirs, files in os.walk(base):
+            for name in files:
+                if name.startswith(".tmp-"):
+                    continue
+                rel = os.path.relpath(os.path.join(root, name), self.root)
+                keys.add(rel.replace(os.sep, "/"))
+        return keys
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def _write(self, key: str, write) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def upload_file(self, path: str, key: str) -> None:
+        def write(dst):
+            with open(path, "rb") as src:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        self._write(key, write)
+
+    def upload_bytes(self, data: bytes, key: str) -> None:
+        self._write(key, lambda dst: dst.write(data))
+
+    def download_file(self, key: str, path: str) -> None:
+        shutil.copyfile(self._path(key), path)
+
+    def download_bytes(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+
+class GCSStorage:
+    def __init__(self, bucket_name: str, prefix: str = ""):
+        from google.cloud import storage
+
+        self.client = storage.Client()
+        self.bucket = self.client.bucket(bucket_name)
+        self.prefix = prefix.strip("/")
+        self.url = f"gs://{bucket_name}" + (f"/{self.prefix}" if self.prefix else "")
+
+    def _name(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def list(self, prefix: str = "") -> Set[str]:
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        return {blob.name[strip:] for blob in self.client.list_blobs(self.bucket, prefix=self._name(prefix))}
+
+    def exists(self, key: str) -> bool:
+        return self.bucket.blob(self._name(key)).exists()
+
+    def upload_file(self, path: str, key: str) -> None:
+        blob = self.bucket.blob(self._name(key))
+        if os.path.getsize(path) <= BACKUP_MULTIPART_THRESHOLD:
+            blob.upload_from_filename(path)
+            return
+        from google.cloud.storage import transfer_manager
+
+        transfer_manager.upload_chunks_concurrently(
+            path, blob,
+            chunk_size=BACKUP_CHUNK_SIZE,
+            max_workers=BACKUP_CHUNK_WORKERS,
+            worker_type=transfer_manager.THREAD,
+        )
+
+    def upload_bytes(self, data: bytes, key: str) -> None:
+        self.bucket.blob(self._name(key)).upload_from_string(data)
+
+    def download_file(self, key: str, path: str) -> None:
+        self.bucket.blob(self._name(key)).download_to_filename(path)
+
+    def download_bytes(self, key: str) -> bytes:
+        return self.bucket.blob(self._name(key)).download_as_bytes()
+
+
+def open_target(url: str):
+    """
+    Storage for a target URL: gs://bucket[/prefix], file:///path, or a
+    filesystem path (absolute, or starting with ".").
+    """
+    if url.startswith("gs://"):
+        bucket, _, prefix = url[len("gs://"):].partition("/")
+        return GCSStorage(bucket, prefix)
+    if url.startswith("file://"):
+        return LocalStorage(url[len("file://"):])
+    if url.startswith(("/", ".")) or os.sep in url:
+        return LocalStorage(url)
+    raise ValueError(f"Unsupported backup target {url!r} (use gs://bucket/prefix or file:///path)")
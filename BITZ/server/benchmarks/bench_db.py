@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the db.py query paths at growing data sizes.
+
+Seeds a dedicated MongoDB database with synthetic quests (several
+observations and species rows each, skewed across users like real traffic)
+up to each requested scale, then times the read and write paths the routes
+depend on:
+
+    load_conversation          /quest_info, /analyze
+    get_quest_metadata         /quest_list*, /quest_info (app.py, cache bypassed)
+    get_species_groups         quest metadata
+    get_species_csv_string     /quest_info
+    get_quests_paginated       /quest_list_paginated, first to last page
+    get_image_observations_page  /images/ grid, first page and a page deep in the history
+    save_conversation          /analyze on quests with long histories
+
+Seeding is incremental: a run with --scales 1000,10000 followed by one with
+--scales 100000 only inserts the missing quests. Results go to stdout and,
+with --json, to a file for regression tracking (one record per scale and
+case, plus the git revision and server version).
+
+Usage (from BITZ/server, needs a local MongoDB):
+    python -m benchmarks.bench_db --scales 1000,10000,100000 --json db_bench.json
+    python -m benchmarks.bench_db --scales 10000 --repeat 200 --cases load_conversation,get_quests_paginated
+    python -m benchmarks.bench_db --drop     # remove the benchmark database
+
+The database is MONGO_DATABASE if set, otherwise `bitz_bench`; seeding into a
+database whose name does not end in `bench` requires --force.
+"""
+
+import os
+
+# Before importing db, which reads it at import time
+os.environ.setdefault("MONGO_DATABASE", "bitz_bench")
+
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+import db
+import indexes
+
+TAXONOMIC_GROUPS = ["birds", "insects", "plants", "fungi", "mammals", "arachnids", "mollusks", "other"]
+FLAVORS = ["basic", "kids", "expert"]
+USERS = 1000
+OBSERVATIONS_PER_QUEST = (1, 12)
+SPECIES_PER_OBSERVATION = (0, 5)
+BATCH_SIZE = 5000
+QUEST_PREFIX = "bench-"
+
+# An /analyze result, stored as the observation's analysis subdocument, ~1.2 KB
+ANALYSIS = {
+    "species_identification": {
+        "name": "Common dandelion (Taraxacum officinale)",
+        "what_is_it": "A perennial flowering plant of the daisy family, common in lawns, meadows and roadsides.",
+        "ecological_importance": "Flowers early in spring and is an important nectar and pollen source for pollinators.",
+        "species_interactions": ["Visited by honey bees and bumblebees", "Seeds eaten by goldfinches",
+                                 "Leaves grazed by rabbits"],
+    },
+    "sampling_guidance": {
+        "question": "Can you see any insects visiting the flowers?",
+        "yes_action": "Take a close-up photo of the insect on the flower head.",
+        "no_action": "Look at the underside of the leaves for signs of grazing or eggs.",
+    },
+    "next_target": {
+        "focus": "Pollinators",
+        "location": "Flower heads in full sun, around midday.",
+        "importance": "Pollinator diversity is a good indicator of habitat health in transition zones.",
+    },
+}
+
+
+# -----------------------------------------------------------------------
+# Seeding
+# -----------------------------------------------------------------------
+
+def quest_id(i: int) -> str:
+    return f"{QUEST_PREFIX}{i:07d}"
+
+
+def user_id(rng: random.Random) -> str:
+    # A few heavy users, a long tail of occasional ones
+    return f"user-{min(USERS - 1, int(rng.paretovariate(1.2)) - 1)}"
+
+
+def synthetic_quest(i: int, rng: random.Random):
+    qid = quest_id(i)
+    start = 1_600_000_000 + i * 600
+    lat, lon = rng.uniform(43, 51), rng.uniform(-1, 7)
+    quest = {
+        "quest_id": qid,
+        "user_id": user_id(rng),
+        "flavor": rng.choice(FLAVORS),
+        "coordinates": f"{lat:.5f},{lon:.5f}",
+        "location": f"Site {i % 500}",
+        "timestamp": str(start),
+    }
+    observations, species = [], []
+    for position in range(rng.randint(*OBSERVATIONS_PER_QUEST)):
+        image = f"{position}_image.jpg"
+        observations.append({
+            "quest_id": qid,
+            "position": position,
+            "timestamp": str(start + position * 90),
+            "ts": start + position * 90,
+            "user_message": "",
+            "analysis": ANALYSIS,
+            "analysis_version": db.ANALYSIS_SCHEMA_VERSION,
+            "image_filename": image,
+            "image_location": f"{lat:.5f},{lon:.5f}",
+        })
+        for s in range(rng.randint(*SPECIES_PER_OBSERVATION)):
+            n = rng.randint(0, 4999)
+            species.append({
+                "quest_id": qid,
+                "observation_image": image,
+                "taxonomic_group": TAXONOMIC_GROUPS[n % len(TAXONOMIC_GROUPS)],
+                "scientific_name": f"Genus{n // 10} species{n % 10}",
+                "common_name": f"Common name {n}",
+                "confidence": rng.choice(["high", "medium", "low"]),
+                "notes": "",
+                "latitude": f"{lat:.5f}",
+                "longitude": f"{lon:.5f}",
+            })
+    return quest, observations, species
+
+
+def seed(target: int) -> int:
+    """Insert synthetic quests until `target` exist. Returns the number inserted."""
+    quests_col = db.get_quests_collection()
+    observations_col = db.get_observations_collection()
+    species_col = db.get_species_collection()
+
+    existing = quests_col.count_documents({"quest_id": {"$regex": f"^{QUEST_PREFIX}"}})
+    if existing >= target:
+        return 0
+
+    start = time.perf_counter()
+    quests, observations, species = [], [], []
+
+    def flush():
+        if quests:
+            quests_col.insert_many(quests, ordered=False)
+        if observations:
+            observations_col.insert_many(observations, ordered=False)
+        if species:
+            species_col.insert_many(species, ordered=False)
+        quests.clear()
+        observations.clear()
+        species.clear()
+
+    for i in range(existing, target):
+        # Deterministic per quest, so every run seeds the same data
+        q, o, s = synthetic_quest(i, random.Random(i))
+        quests.append(q)
+        observations.extend(o)
+        species.extend(s)
+        if len(quests) >= BATCH_SIZE:
+            flush()
+            print(f"  seeded {i + 1}/{target} quests", end="\r")
+    flush()
+    print(f"  seeded {target - existing} quests in {time.perf_counter() - start:.1f}s" + " " * 20)
+    return target - existing
+
+
+# -----------------------------------------------------------------------
+# Timing
+# -----------------------------------------------------------------------
+
+def measure(fn: Callable[[int], object], repeat: int, warmup: int) -> Dict[str, float]:
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "n": repeat,
+        "min_ms": samples[0],
+        "p50_ms": statistics.median(samples),
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "mean_ms": statistics.mean(samples),
+        "max_ms": samples[-1],
+        "ops_per_s": 1000 / statistics.mean(samples) if statistics.mean(samples) else 0,
+    }
+
+
+def long_history(length: int) -> List[Dict[str, str]]:
+    return [
+        {"user": "", "timestamp": str(1_700_000_000 + i * 60), "assistant": ANALYSIS,
+         "image_filename": f"{i}_image.jpg", "image_location": "48.85000,2.35000"}
+        for i in range(length)
+    ]
+
+
+def build_cases(scale: int, rng: random.Random, long_quests: List[int]) -> Dict[str, Callable[[int], object]]:
+    picks = [quest_id(rng.randrange(scale)) for _ in range(1000)]
+
+    def pick(i: int) -> str:
+        return picks[i % len(picks)]
+
+    cases: Dict[str, Callable[[int], object]] = {
+        "load_conversation": lambda i: db.load_conversation(pick(i)),
+        "get_species_groups": lambda i: db.get_species_groups(pick(i)),
+        "get_species_csv_string": lambda i: db.get_species_csv_string(pick(i)),
+    }
+
+    try:
+        # Lives in app.py; importing it builds the Flask app
+        from app import get_quest_metadata
+        cases["get_quest_metadata"] = lambda i: get_quest_metadata(pick(i), force_reload=True)
+    except ImportError as e:
+        print(f"Skipping get_quest_metadata: {e}")
+
+    per_page = 20
+    last_page = max(1, -(-scale // per_page))
+    for label, page in (("1", 1), ("10%", last_page // 10 or 1), ("50%", last_page // 2 or 1), ("last", last_page)):
+        cases[f"get_quests_paginated[page={label}]"] = (
+            lambda i, page=page: db.get_quests_paginated(page=page, per_page=per_page)
+        )
+
+    # Cursor in the middle of the history (quest i starts at 1_600_000_000 + i * 600)
+    middle = scale // 2
+    for label, cursor in (("first", None), ("50%", f"{1_600_000_000 + middle * 600}:0:{quest_id(middle)}")):
+        cases[f"get_image_observations_page[{label}]"] = (
+            lambda i, cursor=cursor: db.get_image_observations_page(limit=60, cursor=cursor)
+        )
+
+    for length in long_quests:
+        history = long_history(length)
+        qid = f"long-quest-{length}"
+
+        def save(i, qid=qid, history=history):
+            # /analyze re-saves the whole conversation after appending a turn
+            db.save_conversation("basic", "48.85,2.35", "Bench", qid, "bench-writer", history, timestamp="1700000000")
+
+        cases[f"save_conversation[{length} obs]"] = save
+
+    return cases
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_table(results: List[Dict]) -> None:
+    print()
+    print(f"{'scale':>8} {'case':<36} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'ops/s':>9}")
+    print("-" * 84)
+    for row in results:
+        print(f"{row['scale']:>8} {row['case']:<36} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+              f"{row['mean_ms']:>9.2f} {row['ops_per_s']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark db.py query paths on synthetic data")
+    parser.add_argument("--scales", type=lambda s: sorted(int(x) for x in s.split(",")), default=[1000, 10000],
+                        help="Quest counts to benchmark at, seeded incrementally (default: 1000,10000)")
+    parser.add_argument("--repeat", type=int, default=100, help="Timed calls per case (default: 100)")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed calls per case (default: 10)")
+    parser.add_argument("--cases", type=lambda s: s.split(","), default=None,
+                        help="Only run cases whose name starts with one of these")
+    parser.add_argument("--long-quests", type=lambda s: [int(x) for x in s.split(",")], default=[50, 200],
+                        help="History lengths for save_conversation (default: 50,200)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for quest picks")
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    parser.add_argument("--drop", action="store_true", help="Drop the benchmark database and exit")
+    parser.add_argument("--force", action="store_true", help="Allow a database not named *bench")
+    args = parser.parse_args()
+
+    if not db.DATABASE_NAME.endswith("bench") and not args.force:
+        print(f"Refusing to use database '{db.DATABASE_NAME}' (not a *bench database); pass --force")
+        sys.exit(1)
+
+    try:
+        server_version = db.get_client().server_info()["version"]
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+
+    if args.drop:
+        db.get_client().drop_database(db.DATABASE_NAME)
+        print(f"Dropped {db.DATABASE_NAME}")
+        return
+
+    # Seed and query with the same indexes as production
+    indexes.ensure_indexes()
+
+    results = []
+    for scale in args.scales:
+        print(f"Scale {scale} quests")
+        seed(scale)
+        cases = build_cases(scale, random.Random(args.seed), args.long_quests)
+        for name, fn in cases.items():
+            if args.cases and not any(name.startswith(prefix) for prefix in args.cases):
+                continue
+            row = {"scale": scale, "case": name, **measure(fn, args.repeat, args.warmup)}
+            print(f"  {name:<36} p50 {row['p50_ms']:8.2f} ms   p95 {row['p95_ms']:8.2f} ms")
+            results.append(row)
+
+    print_table(results)
+
+    if args.json:
+        report = {
+            "meta": {
+                "revision": git_revision(),
+                "mongodb": server_version,
+                "database": db.DATABASE_NAME,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "repeat": args.repeat,
+                "warmup": args.warmup,
+            },
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
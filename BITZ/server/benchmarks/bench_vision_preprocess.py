@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Accuracy-versus-size benchmark for the vision preprocessing stage.
+
+For every image of a sample set, the original upload (what was sent before
+preprocessing) and each candidate rendition (short side x JPEG quality) are
+sent to the species identification model. The report compares payload size,
+preprocessing time, call latency, and agreement of the identified scientific
+names with the original (Jaccard index).
+
+Usage (from BITZ/server):
+    python -m benchmarks.bench_vision_preprocess SAMPLE_DIR
+    python -m benchmarks.bench_vision_preprocess SAMPLE_DIR --sizes 512,768,1024 --qualities 70,85
+    python -m benchmarks.bench_vision_preprocess SAMPLE_DIR --no-llm      # sizes only, free
+    OPENAI_BASE_URL=http://localhost:8001/v1 python -m benchmarks.bench_vision_preprocess SAMPLE_DIR
+"""
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, Set
+
+import image_handler
+import oaak_classify
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def find_images(sample_dir: str, limit: Optional[int]) -> List[str]:
+    images = []
+    for root, _dirs, files in os.walk(sample_dir):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(os.path.join(root, name))
+    images.sort()
+    return images[:limit] if limit else images
+
+
+def species_names(raw_reply: str) -> Set[str]:
+    """Scientific names in a raw identification reply."""
+    names = set()
+    for block in oaak_classify.extract_json(raw_reply):
+        for species_list in block.values():
+            if isinstance(species_list, list):
+                for sp in species_list:
+                    name = (sp.get("scientific_name") or "").strip().lower()
+                    if name:
+                        names.add(name)
+    return names
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def identify(image_path: str, image_b64: str) -> Dict:
+    start = time.perf_counter()
+    raw = oaak_classify.identify_chatgpt_raw(image_path, oaak_classify.IDENTIFY_LANGUAGE, image_b64=image_b64, use_cache=False)
+    return {"latency": time.perf_counter() - start, "species": species_names(raw)}
+
+
+def run(args) -> Dict:
+    images = find_images(args.sample_dir, args.limit)
+    if not images:
+        print(f"No images found in {args.sample_dir}")
+        sys.exit(1)
+
+    variants = [("original", None, None)] + [
+        (f"{size}px_q{quality}", size, quality)
+        for size in args.sizes for quality in args.qualities
+    ]
+    rows: Dict[str, Dict[str, List[float]]] = {
+        name: {"bytes": [], "prep_ms": [], "latency": [], "jaccard": []} for name, _, _ in variants
+    }
+
+    for i, image_path in enumerate(images, 1):
+        print(f"[{i}/{len(images)}] {image_path}")
+        baseline = None
+        for name, size, quality in variants:
+            start = time.perf_counter()
+            if size is None:
+                with open(image_path, "rb") as f:
+                    data = f.read()
+            else:
+                data = image_handler.preprocess_for_vision(
+                    image_path, max_side=max(size, args.max_side), short_side=size, quality=quality
+                )
+            prep_ms = (time.perf_counter() - start) * 1000
+            rows[name]["bytes"].append(len(data))
+            rows[name]["prep_ms"].append(prep_ms)
+
+            if args.no_llm:
+                continue
+            result = identify(image_path, base64.b64encode(data).decode("utf-8"))
+            rows[name]["latency"].append(result["latency"])
+            if baseline is None:
+                baseline = result["species"]
+            rows[name]["jaccard"].append(jaccard(baseline, result["species"]))
+
+    summary = {}
+    for name, values in rows.items():
+        summary[name] = {
+            "images": len(values["bytes"]),
+            "mean_kb": statistics.mean(values["bytes"]) / 1024,
+            "mean_prep_ms": statistics.mean(values["prep_ms"]),
+            "mean_latency_s": statistics.mean(values["latency"]) if values["latency"] else None,
+            "mean_jaccard": statistics.mean(values["jaccard"]) if values["jaccard"] else None,
+        }
+    return summary
+
+
+def print_table(summary: Dict) -> None:
+    print()
+    print(f"{'variant':<16} {'KB':>9} {'prep ms':>9} {'latency s':>10} {'jaccard':>8}")
+    print("-" * 56)
+    for name, row in summary.items():
+        latency = f"{row['mean_latency_s']:.2f}" if row["mean_latency_s"] is not None else "-"
+        agreement = f"{row['mean_jaccard']:.3f}" if row["mean_jaccard"] is not None else "-"
+        print(f"{name:<16} {row['mean_kb']:>9.1f} {row['mean_prep_ms']:>9.1f} {latency:>10} {agreement:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vision preprocessing: payload size vs identification agreement")
+    parser.add_argument("sample_dir", help="Directory with sample images (searched recursively)")
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[512, 768, 1024],
+                        help="Short-side sizes to test (default: 512,768,1024)")
+    parser.add_argument("--qualities", type=lambda s: [int(x) for x in s.split(",")], default=[70, 85],
+                        help="JPEG qualities to test (default: 70,85)")
+    parser.add_argument("--max-side", type=int, default=image_handler.VISION_MAX_SIDE,
+                        help="Long-side cap (default: VISION_MAX_SIDE)")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N images")
+    parser.add_argument("--no-llm", action="store_true", help="Measure sizes and preprocessing time only")
+    parser.add_argument("--json", type=str, default=None, help="Also write the summary to this JSON file")
+    args = parser.parse_args()
+
+    summary = run(args)
+    print_table(summary)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nSummary written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Check that the background identification job reuses the result of /analyze.
+
+/analyze identifies the uploaded image synchronously and stores the reply in
+the identification cache; the IDENTIFY_SPECIES job runs IDENTIFY_JOB_DELAY
+seconds later on the same file and must find it there instead of paying a
+second vision call. This runs both paths on a fresh synthetic image against
+MongoDB and the stub LLM server, and fails unless /analyze made exactly one
+identify call and the job none.
+
+    python -m benchmarks.stub_llm_server &
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub MONGO_URI=mongodb://localhost:27017/ \\
+        python -m benchmarks.check_identify_cache --stub-url http://localhost:8001
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+import httpx
+from PIL import Image
+
+import db
+import identification_cache
+import image_handler
+import job_queue
+import job_worker
+from image_analyzer import ImageAnalyzer
+
+QUEST_PREFIX = "identify-cache-check-"
+
+
+def identify_calls(stub_url: str) -> int:
+    return httpx.get(f"{stub_url.rstrip('/')}/stub/stats").json().get("identify", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the identify job hits the cache filled by /analyze")
+    parser.add_argument("--stub-url", default="http://localhost:8001", help="Stub LLM server (default: %(default)s)")
+    args = parser.parse_args()
+
+    if not identification_cache.IDENT_CACHE_ENABLED:
+        print("IDENT_CACHE_ENABLED is off, nothing to check")
+        sys.exit(1)
+    try:
+        db.get_client()
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+
+    quest_id = f"{QUEST_PREFIX}{uuid.uuid4().hex[:12]}"
+    history_directory = tempfile.mkdtemp(prefix="bitz-check-")
+    image_path = os.path.join(history_directory, "images", quest_id, "0_image.jpg")
+    os.makedirs(os.path.dirname(image_path))
+    # Random pixels, so no earlier run left this image in the cache
+    Image.frombytes("RGB", (640, 480), os.urandom(640 * 480 * 3)).save(image_path, "JPEG")
+
+    try:
+        # As the /analyze route does after oaak.process_image
+        vision_b64 = image_handler.get_vision_base64_from_path(image_path)
+        before = identify_calls(args.stub_url)
+        ImageAnalyzer().analyze_image(image_path, "basic", [], image_b64=vision_b64)
+        after_analyze = identify_calls(args.stub_url)
+
+        # The job oaak.extract_species_from_images enqueues for the same upload
+        job_worker.run_identify_species({
+            "type": job_queue.IDENTIFY_SPECIES,
+            "quest_id": quest_id,
+            "payload": {
+                "image_path": image_path,
+                "history_directory": history_directory,
+                "image_coordinates": "",
+            },
+        })
+        after_job = identify_calls(args.stub_url)
+    finally:
+        db.delete_quest(quest_id)
+        shutil.rmtree(history_directory, ignore_errors=True)
+
+    analyze_calls, job_calls = after_analyze - before, after_job - after_analyze
+    print(f"identify calls: /analyze {analyze_calls}, job {job_calls}")
+    if analyze_calls != 1 or job_calls != 0:
+        print("FAIL: the job should reuse the identification /analyze stored")
+        sys.exit(1)
+    print("OK: the job was served from the identification cache")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of a running BITZ server.
+
+Virtual users replay realistic quest sessions against the HTTP API:
+
+    for each image of a new quest:
+        POST /analyze (multipart upload of a sample image)
+        POST /answer
+        GET  /explore/images/<quest>/<n>_image.jpg?res=thumb
+    GET  /quest_list_paginated?page=<random>
+    POST /link_species_batch (random pairs of the species seen)
+
+and the report gives, per endpoint, the request count, errors, throughput
+and p50/p95/p99 latency. Run it against gunicorn, a local MongoDB and the
+stub LLM server so nothing is billed:
+
+    docker compose -f BITZ/server/docker-compose.yml up -d mongodb
+    python -m benchmarks.stub_llm_server --latency-ms 600 --vision-latency-ms 2500 --jitter-ms 300 &
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub MONGO_URI=mongodb://localhost:27017/ \\
+        gunicorn --bind 127.0.0.1:5000 --workers 4 --threads 2 --timeout 120 app:app &
+    python -m benchmarks.load_test --users 8 --duration 120 --sample-dir SAMPLE_DIR --json load.json
+
+Quests are created for users named `loadtest-<n>`; `--cleanup` deletes them
+(MongoDB documents and image directories) afterwards.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+USER_PREFIX = "loadtest-"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SPECIES_NAMES = [
+    "Erithacus rubecula", "Apis mellifera", "Taraxacum officinale", "Trifolium repens",
+    "Bombus terrestris", "Quercus robur", "Lumbricus terrestris", "Parus major",
+]
+
+
+def load_images(sample_dir: Optional[str], count: int) -> List[Tuple[str, bytes]]:
+    """Sample images as (filename, bytes); synthetic noise photos if no directory is given."""
+    images = []
+    if sample_dir:
+        for root, _dirs, files in os.walk(sample_dir):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    with open(os.path.join(root, name), "rb") as f:
+                        images.append((name, f.read()))
+        if not images:
+            raise SystemExit(f"No images found in {sample_dir}")
+        return images
+
+    for i in range(count):
+        buf = io.BytesIO()
+        # Noise compresses badly, like a real photo of foliage
+        Image.effect_noise((1600, 1200), 64 + i).convert("RGB").save(buf, "JPEG", quality=85)
+        images.append((f"synthetic_{i}.jpg", buf.getvalue()))
+    return images
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class Recorder:
+    """Thread-safe per-endpoint latency, status and size samples."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.bytes: Dict[str, int] = defaultdict(int)
+
+    def request(self, client: httpx.Client, endpoint: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            with self.lock:
+                self.latencies[endpoint].append(time.perf_counter() - start)
+                self.errors[endpoint] += 1
+                self.statuses[endpoint][0] += 1
+            print(f"{endpoint}: {type(e).__name__}: {e}")
+            return None
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            self.statuses[endpoint][response.status_code] += 1
+            self.bytes[endpoint] += len(response.content)
+            if response.status_code >= 400:
+                self.errors[endpoint] += 1
+        return response
+
+    def summary(self, wall_seconds: float) -> Dict[str, Dict]:
+        result = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            result[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors[endpoint],
+                "throughput_rps": len(values) / wall_seconds if wall_seconds else 0,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000,
+                "mean_kb": self.bytes[endpoint] / len(values) / 1024,
+                "statuses": {str(code): n for code, n in sorted(self.statuses[endpoint].items())},
+            }
+        return result
+
+
+def run_session(client: httpx.Client, recorder: Recorder, user_id: str,
+                images: List[Tuple[str, bytes]], args) -> None:
+    quest_id = f"{USER_PREFIX}{uuid.uuid4().hex[:12]}"
+    coordinates = f"{random.uniform(43, 51):.5f},{random.uniform(-1, 7):.5f}"
+    seen = list(SPECIES_NAMES)
+
+    for n in range(args.images_per_quest):
+        name, data = random.choice(images)
+        response = recorder.request(
+            client, "/analyze", "POST", "/analyze",
+            files={"image": (name, data, "image/jpeg")},
+            data={
+                "conversation_id": quest_id,
+                "user_id": user_id,
+                "image_location": "Load test",
+                "image_coordinates": coordinates,
+            },
+        )
+        if response is not None and response.status_code == 200:
+            species = response.json().get("species_identification", {}).get("name")
+            if species:
+                seen.append(species)
+
+        for _ in range(args.answers):
+            recorder.request(client, "/answer", "POST", "/answer",
+                             json={"conversation_id": quest_id, "answer": random.choice(["yes", "no"])})
+
+        recorder.request(client, "/explore/images?res=thumb", "GET",
+                         f"/explore/images/{quest_id}/{n}_image.jpg", params={"res": "thumb"})
+        time.sleep(args.think_ms / 1000)
+
+    recorder.request(client, "/quest_list_paginated", "GET", "/quest_list_paginated",
+                     params={"page": random.randint(1, args.max_page), "per_page": 20})
+
+    pairs = [random.sample(seen, 2) for _ in range(args.link_pairs)]
+    if pairs:
+        recorder.request(client, "/link_species_batch", "POST", "/link_species_batch",
+                         json={"species_pairs": pairs})
+
+
+def virtual_user(index: int, recorder: Recorder, images, deadline: float, args) -> None:
+    user_id = f"{USER_PREFIX}{index}"
+    sessions = 0
+    with httpx.Client(base_url=args.base_url, timeout=args.timeout) as client:
+        while time.monotonic() < deadline and (not args.sessions or sessions < args.sessions):
+            run_session(client, recorder, user_id, images, args)
+            sessions += 1
+
+
+def cleanup(history_dir: str) -> None:
+    """Delete every quest created by a load test."""
+    import db
+
+    quest_ids = [
+        doc["quest_id"]
+        for doc in db.get_quests_collection().find({"user_id": {"$regex": f"^{USER_PREFIX}"}}, {"quest_id": 1})
+    ]
+    for quest_id in quest_ids:
+        db.delete_quest(quest_id)
+        shutil.rmtree(os.path.join(history_dir, "images", quest_id), ignore_errors=True)
+    print(f"Deleted {len(quest_ids)} load test quests")
+
+
+def print_table(summary: Dict[str, Dict]) -> None:
+    print()
+    print(f"{'endpoint':<28} {'reqs':>6} {'err':>5} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'KB':>8}")
+    print("-" * 84)
+    for endpoint, row in summary.items():
+        print(f"{endpoint:<28} {row['requests']:>6} {row['errors']:>5} {row['throughput_rps']:>7.2f} "
+              f"{row['p50_ms']:>8.0f} {row['p95_ms']:>8.0f} {row['p99_ms']:>8.0f} {row['mean_kb']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive realistic quest sessions against a BITZ server")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--users", type=int, default=4, help="Concurrent virtual users (default: 4)")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run (default: 60)")
+    parser.add_argument("--sessions", type=int, default=0, help="Stop each user after N quests (default: no limit)")
+    parser.add_argument("--images-per-quest", type=int, default=3)
+    parser.add_argument("--answers", type=int, default=1, help="/answer calls after each image")
+    parser.add_argument("--link-pairs", type=int, default=5, help="Pairs per /link_species_batch call (max 10)")
+    parser.add_argument("--max-page", type=int, default=5, help="Highest /quest_list_paginated page requested")
+    parser.add_argument("--think-ms", type=float, default=0, help="Pause between images")
+    parser.add_argument("--timeout", type=float, default=180)
+    parser.add_argument("--sample-dir", default=None, help="Sample images (default: synthetic 1600x1200 JPEGs)")
+    parser.add_argument("--stub-url", default=None, help="Stub LLM server, to report its call counts")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    parser.add_argument("--cleanup", action="store_true", help="Delete load test quests and exit")
+    parser.add_argument("--history-dir", default="history", help="Server history directory, for --cleanup")
+    args = parser.parse_args()
+    args.link_pairs = min(10, args.link_pairs)
+
+    if args.cleanup:
+        cleanup(args.history_dir)
+        return
+
+    images = load_images(args.sample_dir, count=8)
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=virtual_user, args=(i, recorder, images, deadline, args), daemon=True)
+        for i in range(args.users)
+    ]
+
+    print(f"{args.users} users against {args.base_url} for up to {args.duration:.0f}s …")
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    summary = recorder.summary(wall)
+    print_table(summary)
+    total = sum(row["requests"] for row in summary.values())
+    print(f"\n{total} requests in {wall:.1f}s ({total / wall:.2f} req/s)")
+
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("cleanup", "json")},
+        "wall_seconds": wall,
+        "endpoints": summary,
+    }
+    if args.stub_url:
+        try:
+            results["llm_calls"] = httpx.get(f"{args.stub_url.rstrip('/')}/stub/stats").json()
+            print(f"LLM calls: {results['llm_calls']}")
+        except httpx.HTTPError as e:
+            print(f"Could not read stub stats: {e}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for the OpenAI chat completions API.
+
+Serves POST /v1/chat/completions with canned replies shaped like the real
+ones, so the server, the job worker and the benchmarks run without spending
+anything. Point the SDKs at it with OPENAI_BASE_URL:
+
+    python -m benchmarks.stub_llm_server --port 8001 --latency-ms 800 --jitter-ms 300
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub gunicorn ... app:app
+
+Requests are classified by what BITZ sends:
+    identify  – a vision message (species identification, oaak_classify)
+    analyze   – JSON mode (ImageAnalyzer: /analyze and /answer)
+    link      – the species linking prompt (/link_species*)
+    chat      – anything else (/question)
+
+Replay mode serves recorded replies instead of the canned ones:
+
+    # record: forward to the real API and append every reply to a JSONL file
+    python -m benchmarks.stub_llm_server --record replies.jsonl --upstream https://api.openai.com/v1
+    # replay: cycle through the recorded replies per kind, with their latency
+    python -m benchmarks.stub_llm_server --replay replies.jsonl
+
+GET /stub/stats returns request counts per kind; --rate-limit-every N answers
+every Nth request with a 429 to exercise the rate limiter.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+from flask import Flask, jsonify, request
+
+IDENTIFY_REPLY = """```json
+{
+    "birds": [
+        {"scientific_name": "Erithacus rubecula", "common_name": "European robin", "confidence": "high"}
+    ],
+    "insects": [
+        {"scientific_name": "Apis mellifera", "common_name": "Western honey bee", "confidence": "medium"}
+    ],
+    "plants": [
+        {"scientific_name": "Taraxacum officinale", "common_name": "Common dandelion", "confidence": "high"},
+        {"scientific_name": "Trifolium repens", "common_name": "White clover", "confidence": "low"}
+    ]
+}
+```"""
+
+ANALYZE_REPLY = {
+    "species_identification": {
+        "name": "Common dandelion (Taraxacum officinale)",
+        "what_is_it": "A perennial flowering plant common in lawns and meadows.",
+        "ecological_importance": "An early nectar source for pollinators.",
+        "species_interactions": ["Visited by honey bees", "Seeds eaten by finches"],
+    },
+    "sampling_guidance": {
+        "question": "Can you see any insects on the flowers?",
+        "yes_action": "Take a close-up photo of the insect.",
+        "no_action": "Look at the leaves for signs of grazing.",
+    },
+    "next_target": {
+        "focus": "Pollinators",
+        "location": "Flower heads in full sun.",
+        "importance": "Pollinator diversity indicates habitat health.",
+    },
+}
+
+LINK_REPLIES = ["pollinates", "feeds on", "shares habitat", "is eaten by", ""]
+
+CHAT_REPLY = "Dandelions flower from early spring and are an important food source for bees."
+
+
+def classify(body: Dict[str, Any]) -> str:
+    messages = body.get("messages", [])
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            return "identify"
+    system = " ".join(m.get("content", "") for m in messages
+                      if m.get("role") == "system" and isinstance(m.get("content"), str))
+    if "links species" in system:
+        return "link"
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        return "analyze"
+    return "chat"
+
+
+def canned_reply(kind: str) -> str:
+    if kind == "identify":
+        return IDENTIFY_REPLY
+    if kind == "analyze":
+        return json.dumps(ANALYZE_REPLY)
+    if kind == "link":
+        return random.choice(LINK_REPLIES)
+    return CHAT_REPLY
+
+
+def completion(content: str, model: str, prompt_chars: int) -> Dict[str, Any]:
+    prompt_tokens = max(1, prompt_chars // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "id": f"chatcmpl-stub-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class Replay:
+    """Recorded replies, served round-robin per kind."""
+
+    def __init__(self, path: str):
+        by_kind: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    by_kind[entry["kind"]].append(entry)
+        if not by_kind:
+            raise ValueError(f"No recorded replies in {path}")
+        self.cycles = {kind: itertools.cycle(entries) for kind, entries in by_kind.items()}
+        self.lock = threading.Lock()
+
+    def next(self, kind: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            cycle = self.cycles.get(kind)
+            return next(cycle) if cycle else None
+
+
+def create_app(args) -> Flask:
+    app = Flask(__name__)
+    counts: Counter = Counter()
+    lock = threading.Lock()
+    replay = Replay(args.replay) if args.replay else None
+    upstream = httpx.Client(base_url=args.upstream, timeout=120) if args.record else None
+
+    def latency_for(kind: str, recorded_ms: Optional[float] = None) -> float:
+        if kind == "identify" and args.vision_latency_ms is not None:
+            base = args.vision_latency_ms
+        elif args.latency_ms is not None:
+            base = args.latency_ms
+        else:
+            base = recorded_ms or 0
+        return max(0.0, base + random.uniform(-args.jitter_ms, args.jitter_ms)) / 1000
+
+    @app.route("/v1/chat/completions", methods=["POST"])
+    def chat_completions():
+        body = request.get_json(force=True)
+        kind = classify(body)
+        model = body.get("model", "stub")
+        with lock:
+            counts[kind] += 1
+            counts["total"] += 1
+            n = counts["total"]
+
+        if args.rate_limit_every and n % args.rate_limit_every == 0:
+            response = jsonify({"error": {"message": "Rate limit reached (stub)", "type": "requests",
+                                          "code": "rate_limit_exceeded"}})
+            response.status_code = 429
+            response.headers["Retry-After"] = "2"
+            return response
+
+        if upstream is not None:
+            start = time.perf_counter()
+            reply = upstream.post("/chat/completions", json=body,
+                                  headers={"Authorization": request.headers.get("Authorization", "")})
+            latency_ms = (time.perf_counter() - start) * 1000
+            if reply.status_code == 200:
+                data = reply.json()
+                with lock, open(args.record, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"kind": kind, "content": data["choices"][0]["message"]["content"],
+                                        "latency_ms": round(latency_ms)}) + "\n")
+            return reply.content, reply.status_code, {"Content-Type": "application/json"}
+
+        entry = replay.next(kind) if replay else None
+        if entry is not None:
+            content = entry["content"]
+            time.sleep(latency_for(kind, entry.get("latency_ms")))
+        else:
+            content = canned_reply(kind)
+            time.sleep(latency_for(kind))
+
+        return jsonify(completion(content, model, len(json.dumps(body.get("messages", [])))))
+
+    @app.route("/v1/models", methods=["GET"])
+    def models():
+        return jsonify({"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "bitz"}]})
+
+    @app.route("/stub/stats", methods=["GET"])
+    def stats():
+        with lock:
+            return jsonify(dict(counts))
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible stub for BITZ benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=None,
+                        help="Mean reply latency (default: 0, or the recorded latency in replay mode)")
+    parser.add_argument("--vision-latency-ms", type=float, default=None,
+                        help="Mean latency of identification (vision) calls, if different")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Uniform +/- jitter around the latency")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth request with a 429")
+    parser.add_argument("--replay", default=None, help="JSONL file of recorded replies to serve")
+    parser.add_argument("--record", default=None, help="Forward to --upstream and append replies to this JSONL file")
+    parser.add_argument("--upstream", default="https://api.openai.com/v1", help="Real API used by --record")
+    args = parser.parse_args()
+
+    if args.record and args.replay:
+        parser.error("--record and --replay are exclusive")
+
+    app = create_app(args)
+    print(f"Stub LLM server on http://{args.host}:{args.port}/v1 "
+          f"({'recording' if args.record else 'replay' if args.replay else 'canned'} mode)")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,39 @@ MongoDB database module for BITZ.
 
 Three collections:
   - quests          : one doc per quest (metadata only, no heavy arrays)
-  - observations    : one doc per image/observation within a quest
+  - observations    : one doc per image/observation within a quest, the
+                      analysis as a versioned subdocument
   - species         : one doc per species identification row (from CSV)
 
+plus analyzer_states, the serialized ImageAnalyzer conversation state shared
+by all gunicorn workers (see session_store.MongoStateBackend), jobs, the
+background work queue (see job_queue), identification_cache, vision
+results keyed by image content hash (see identification_cache), and
+rate_limits, the shared LLM token bucket and daily budget (see rate_limiter),
+quest_storage, the bytes and files each quest uses on disk (see
+storage_stats), and geocode_cache, place names and coordinates looked up
+by geocoding.
+
 This keeps documents small, lets us query/filter/paginate at every level,
 and matches how the data is actually produced and consumed.
 """
 
+import ast
+import json
 import os
+import re
+import threading
 import time
-from typing import Optional, Dict, Any, List
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple, Union
+from bson.binary import Binary
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument
 from pymongo.errors import ConnectionFailure
 from dotenv import load_dotenv
 
+import metrics
+import query_profiler
+
 load_dotenv()
 
 # ---------------------------------------------------------------------------
@@ -25,20 +44,86 @@ load_dotenv()
 # ---------------------------------------------------------------------------
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 DATABASE_NAME = os.getenv("MONGO_DATABASE", "bitz")
+# Analyzer states can always be rebuilt from observations, so idle ones expire
+ANALYZER_STATE_TTL = int(os.getenv("ANALYZER_STATE_TTL", str(7 * 24 * 3600)))
+# Finished jobs are kept this long for status polling, then expire
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+# Version of the `analysis` subdocument of observations (the /analyze result)
+ANALYSIS_SCHEMA_VERSION = 1
+
+# Connection pool, per process. A gunicorn worker serves 2 request threads
+# plus background threads (identification fallback, index builds, profiler),
+# so a small pool suffices; a starved pool fails after the wait queue timeout
+# instead of hanging the request.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "20"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+# 0 = no socket timeout (the driver default)
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+# "auto": zstd and/or snappy when their Python packages are installed, else none
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "auto")
 
 _client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
 _db = None
 
 
+def _compressors() -> List[str]:
+    if MONGO_COMPRESSORS != "auto":
+        return [c.strip() for c in MONGO_COMPRESSORS.split(",") if c.strip()]
+    found = []
+    try:
+        import zstandard  # noqa: F401
+        found.append("zstd")
+    except ImportError:
+        pass
+    try:
+        import snappy  # noqa: F401
+        found.append("snappy")
+    except ImportError:
+        pass
+    return found
+
+
+def client_options() -> Dict[str, Any]:
+    """Keyword arguments of the MongoClient, from the MONGO_* environment variables."""
+    options: Dict[str, Any] = {
+        "appname": "bitz",
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS or None,
+        "readPreference": MONGO_READ_PREFERENCE,
+    }
+    compressors = _compressors()
+    if compressors:
+        options["compressors"] = compressors
+    return options
+
+
 def get_client():
     """Get or create MongoDB client."""
     global _client
     if _client is None:
-        try:
-            _client = MongoClient(MONGO_URI)
-            _client.admin.command("ping")
-        except ConnectionFailure as e:
-            raise ConnectionError(f"Failed to connect to MongoDB: {e}")
+        with _client_lock:
+            if _client is None:
+                try:
+                    client = MongoClient(
+                        MONGO_URI,
+                        event_listeners=query_profiler.listeners(get_database) + metrics.pool_listeners(),
+                        **client_options(),
+                    )
+                    client.admin.command("ping")
+                except ConnectionFailure as e:
+                    raise ConnectionError(f"Failed to connect to MongoDB: {e}")
+                _client = client
     return _client
 
 
@@ -51,20 +136,23 @@ def get_database():
 
 
 # ---------------------------------------------------------------------------
-# Collection accessors (lazy init + indexes)
+# Collection accessors (indexes are declared and built in indexes.py)
 # ---------------------------------------------------------------------------
 _quests_col = None
 _observations_col = None
 _species_col = None
+_analyzer_states_col = None
+_jobs_col = None
+_identification_cache_col = None
+_rate_limits_col = None
+_quest_storage_col = None
+_geocode_cache_col = None
 
 
 def get_quests_collection():
     global _quests_col
     if _quests_col is None:
         _quests_col = get_database()["quests"]
-        _quests_col.create_index("quest_id", unique=True)
-        _quests_col.create_index("user_id")
-        _quests_col.create_index("timestamp")
     return _quests_col
 
 
@@ -72,9 +160,6 @@ def get_observations_collection():
     global _observations_col
     if _observations_col is None:
         _observations_col = get_database()["observations"]
-        _observations_col.create_index([("quest_id", ASCENDING), ("position", ASCENDING)])
-        _observations_col.create_index("quest_id")
-        _observations_col.create_index("timestamp")
     return _observations_col
 
 
@@ -82,17 +167,89 @@ def get_species_collection():
     global _species_col
     if _species_col is None:
         _species_col = get_database()["species"]
-        _species_col.create_index("quest_id")
-        _species_col.create_index("observation_image")
-        _species_col.create_index("scientific_name")
-        _species_col.create_index("taxonomic_group")
     return _species_col
 
 
+def get_analyzer_states_collection():
+    global _analyzer_states_col
+    if _analyzer_states_col is None:
+        _analyzer_states_col = get_database()["analyzer_states"]
+    return _analyzer_states_col
+
+
+def get_jobs_collection():
+    global _jobs_col
+    if _jobs_col is None:
+        _jobs_col = get_database()["jobs"]
+    return _jobs_col
+
+
+def get_identification_cache_collection():
+    global _identification_cache_col
+    if _identification_cache_col is None:
+        _identification_cache_col = get_database()["identification_cache"]
+    return _identification_cache_col
+
+
+def get_rate_limits_collection():
+    global _rate_limits_col
+    if _rate_limits_col is None:
+        _rate_limits_col = get_database()["rate_limits"]
+    return _rate_limits_col
+
+
+def get_quest_storage_collection():
+    global _quest_storage_col
+    if _quest_storage_col is None:
+        _quest_storage_col = get_database()["quest_storage"]
+    return _quest_storage_col
+
+
+def get_geocode_cache_collection():
+    global _geocode_cache_col
+    if _geocode_cache_col is None:
+        _geocode_cache_col = get_database()["geocode_cache"]
+    return _geocode_cache_col
+
+
 # ===================================================================
 # QUESTS
 # ===================================================================
 
+def quest_document(
+    quest_id: str,
+    user_id: str,
+    flavor: Optional[str] = None,
+    coordinates: Optional[str] = None,
+    location: Optional[str] = None,
+    timestamp: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Fields save_quest sets (also used by bulk writers such as migrate_to_mongodb)."""
+    return {
+        "quest_id": quest_id,
+        "user_id": user_id,
+        "flavor": flavor,
+        "coordinates": coordinates,
+        "location": location,
+        "timestamp": timestamp or str(int(time.time())),
+        "updated_at": datetime.now(timezone.utc),
+    }
+
+
+def empty_quest_storage(quest_id: str) -> Dict[str, Any]:
+    """
+    quest_storage document of a quest without files (see storage_stats),
+    inserted with the quest so the size and activity sorts of
+    list_quests_with_storage list it.
+    """
+    return {
+        "quest_id": quest_id,
+        **{f"{kind}_{unit}": 0 for kind in ("images", "renditions", "total") for unit in ("bytes", "files")},
+        "updated_at": datetime.now(timezone.utc),
+    }
+
+
+@metrics.timed("mongo")
 def save_quest(
     quest_id: str,
     user_id: str,
@@ -103,23 +260,21 @@ def save_quest(
 ) -> bool:
     """Create or update quest metadata."""
     try:
-        doc = {
-            "quest_id": quest_id,
-            "user_id": user_id,
-            "flavor": flavor,
-            "coordinates": coordinates,
-            "location": location,
-            "timestamp": timestamp or str(int(time.time())),
-        }
-        get_quests_collection().update_one(
+        doc = quest_document(quest_id, user_id, flavor, coordinates, location, timestamp)
+        result = get_quests_collection().update_one(
             {"quest_id": quest_id}, {"$set": doc}, upsert=True
         )
+        if result.upserted_id is not None:
+            get_quest_storage_collection().update_one(
+                {"quest_id": quest_id}, {"$setOnInsert": empty_quest_storage(quest_id)}, upsert=True
+            )
         return True
     except Exception as e:
         print(f"Error saving quest: {e}")
         return False
 
 
+@metrics.timed("mongo")
 def load_quest(quest_id: str) -> Optional[Dict[str, Any]]:
     """Load quest metadata."""
     try:
@@ -132,6 +287,7 @@ def load_quest(quest_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
+@metrics.timed("mongo")
 def get_all_quest_ids() -> List[str]:
     """Return sorted list of all quest IDs."""
     try:
@@ -144,6 +300,7 @@ def get_all_quest_ids() -> List[str]:
         return []
 
 
+@metrics.timed("mongo")
 def get_quests_paginated(
     page: int = 1,
     per_page: int = 20,
@@ -185,12 +342,214 @@ def get_quests_paginated(
         return {"quests": [], "total": 0, "page": page, "per_page": per_page, "total_pages": 0}
 
 
+# Listing sort keys -> (collection holding the field, field)
+QUEST_LISTING_SORTS = {
+    "date": ("quests", "timestamp"),
+    "name": ("quests", "quest_id"),
+    "size": ("quest_storage", "total_bytes"),
+    "updated": ("quest_storage", "updated_at"),
+}
+
+
+@metrics.timed("mongo")
+def list_quests_with_storage(
+    page: int = 1,
+    per_page: int = 50,
+    sort: str = "date",
+    sort_order: int = -1,
+    search: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    One page of quests with their disk usage (the quest_storage document,
+    under "storage"), for the dashboard and the explorer.
+
+    `search` matches the start of the quest id. The query starts from the
+    collection holding the sort field and joins the other one on the page
+    only, so a page costs the same whatever the number of quests; the one
+    exception is sorting by size or activity within one user's quests.
+    """
+    source, field = QUEST_LISTING_SORTS.get(sort, QUEST_LISTING_SORTS["date"])
+    query: Dict[str, Any] = {}
+    if search:
+        query["quest_id"] = {"$regex": f"^{re.escape(search)}"}
+    if user_id:
+        query["user_id"] = user_id
+        if source == "quest_storage":
+            source = "quests"
+            field = f"storage.{field}"
+
+    try:
+        skip = (page - 1) * per_page
+        if source == "quests":
+            col = get_quests_collection()
+            join = {"$lookup": {"from": "quest_storage", "localField": "quest_id",
+                                "foreignField": "quest_id", "as": "storage"}}
+            pipeline: List[Dict[str, Any]] = [{"$match": query}]
+            if field.startswith("storage."):
+                pipeline.append(join)
+            pipeline += [{"$sort": {field: sort_order}}, {"$skip": skip}, {"$limit": per_page}]
+            if not field.startswith("storage."):
+                pipeline.append(join)
+            pipeline += [
+                {"$set": {"storage": {"$ifNull": [{"$first": "$storage"}, {}]}}},
+                {"$project": {"_id": 0, "storage._id": 0}},
+            ]
+        else:
+            # Every quest has a storage document: created with the quest
+            # (empty_quest_storage), or by storage_stats reconcile for older ones
+            col = get_quest_storage_collection()
+            pipeline = [
+                {"$match": query},
+                {"$sort": {field: sort_order}},
+                {"$skip": skip},
+                {"$limit": per_page},
+                {"$project": {"_id": 0}},
+                {"$lookup": {"from": "quests", "localField": "quest_id",
+                             "foreignField": "quest_id", "as": "quest"}},
+                {"$replaceWith": {"$mergeObjects": [
+                    {"$ifNull": [{"$first": "$quest"}, {"quest_id": "$quest_id"}]},
+                    {"storage": "$$ROOT"},
+                ]}},
+                {"$project": {"_id": 0, "storage.quest": 0}},
+            ]
+
+        total = col.count_documents(query)
+        quests = list(col.aggregate(pipeline))
+        return {
+            "quests": quests,
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "total_pages": max(1, -(-total // per_page)),
+        }
+    except Exception as e:
+        print(f"Error listing quests: {e}")
+        return {"quests": [], "total": 0, "page": page, "per_page": per_page, "total_pages": 0}
+
+
+_BLANK = {"$in": [None, ""]}  # also matches a missing field
+
+
+@metrics.timed("mongo")
+def get_quests_missing_location(limit: int = 0) -> List[Dict[str, Any]]:
+    """
+    Quests without a location name, with their coordinates and the location
+    of their first located image (under "image_location"), for geocoding.
+    """
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": {"location": _BLANK}},
+        {"$project": {"_id": 0, "quest_id": 1, "coordinates": 1}},
+        {"$lookup": {
+            "from": "observations",
+            "let": {"quest_id": "$quest_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$quest_id", "$$quest_id"]},
+                            "image_location": {"$ne": None}}},
+                {"$sort": {"position": ASCENDING}},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "image_location": 1}},
+            ],
+            "as": "located",
+        }},
+        {"$set": {"image_location": {"$arrayElemAt": ["$located.image_location", 0]}}},
+        {"$project": {"located": 0}},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    try:
+        return list(get_quests_collection().aggregate(pipeline, allowDiskUse=True))
+    except Exception as e:
+        print(f"Error listing quests without location: {e}")
+        return []
+
+
+@metrics.timed("mongo")
+def get_quests_missing_coordinates(limit: int = 0) -> List[Dict[str, Any]]:
+    """Quests with a location name but no coordinates."""
+    try:
+        cursor = get_quests_collection().find(
+            {"coordinates": _BLANK, "location": {"$type": "string", "$ne": ""}},
+            {"_id": 0, "quest_id": 1, "location": 1},
+        ).limit(limit)
+        return list(cursor)
+    except Exception as e:
+        print(f"Error listing quests without coordinates: {e}")
+        return []
+
+
+@metrics.timed("mongo")
+def update_quests(updates: Dict[str, Dict[str, Any]]) -> int:
+    """Set fields on several quests ({quest_id: fields}) with one bulk write."""
+    if not updates:
+        return 0
+    from pymongo import UpdateOne
+
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne({"quest_id": quest_id}, {"$set": {**fields, "updated_at": now}})
+        for quest_id, fields in updates.items()
+    ]
+    try:
+        return get_quests_collection().bulk_write(operations, ordered=False).modified_count
+    except Exception as e:
+        print(f"Error updating quests: {e}")
+        return 0
+
+
+@metrics.timed("mongo")
+def get_map_quests(updated_since: Optional[datetime] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Quests (all, or those updated after `updated_since`) with what the map
+    shows: their coordinates and location, the located image observations
+    and the species names, in one aggregation that reads no message text.
+    None if the query failed (as opposed to no quests).
+    """
+    pipeline: List[Dict[str, Any]] = []
+    if updated_since is not None:
+        pipeline.append({"$match": {"updated_at": {"$gt": updated_since}}})
+    pipeline += [
+        {"$project": {"_id": 0, "quest_id": 1, "coordinates": 1, "location": 1, "updated_at": 1}},
+        {"$lookup": {
+            "from": "observations",
+            "let": {"quest_id": "$quest_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$quest_id", "$$quest_id"]},
+                            "image_filename": {"$type": "string"},
+                            "image_location": {"$ne": None}}},
+                {"$sort": {"position": ASCENDING}},
+                {"$project": {"_id": 0, "image_filename": 1, "image_location": 1, "ts": 1}},
+            ],
+            "as": "observations",
+        }},
+        {"$lookup": {
+            "from": "species",
+            "let": {"quest_id": "$quest_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$quest_id", "$$quest_id"]}}},
+                {"$project": {"_id": 0, "observation_image": 1, "common_name": 1,
+                              "scientific_name": 1, "taxonomic_group": 1}},
+            ],
+            "as": "species",
+        }},
+    ]
+    try:
+        return list(get_quests_collection().aggregate(pipeline, allowDiskUse=True))
+    except Exception as e:
+        print(f"Error loading map quests: {e}")
+        return None
+
+
+@metrics.timed("mongo")
 def delete_quest(quest_id: str) -> bool:
     """Delete a quest and all its observations and species."""
     try:
         get_quests_collection().delete_one({"quest_id": quest_id})
         get_observations_collection().delete_many({"quest_id": quest_id})
         get_species_collection().delete_many({"quest_id": quest_id})
+        get_analyzer_states_collection().delete_one({"quest_id": quest_id})
+        get_jobs_collection().delete_many({"quest_id": quest_id})
+        get_quest_storage_collection().delete_one({"quest_id": quest_id})
         return True
     except Exception as e:
         print(f"Error deleting quest: {e}")
@@ -201,29 +560,100 @@ def delete_quest(quest_id: str) -> bool:
 # OBSERVATIONS
 # ===================================================================
 
+def timestamp_seconds(timestamp: Any) -> Optional[int]:
+    """
+    Epoch seconds of a stored timestamp ("1700000000", "1700000000.5" or a
+    number), or None. Observations keep it as `ts` so they can be sorted on
+    an index; `timestamp` stays the string the clients send and read.
+    """
+    try:
+        return int(float(timestamp))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_analysis(value: Any) -> Optional[Dict[str, Any]]:
+    """
+    The analysis dict of an assistant response: a dict, JSON text, or the
+    Python repr older code stored (str(result)); None if it is not one.
+    """
+    if isinstance(value, dict):
+        return value
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        parsed = json.loads(value)
+    except json.JSONDecodeError:
+        try:
+            # Round-trip through JSON so tuples, sets, etc. do not reach BSON
+            parsed = json.loads(json.dumps(ast.literal_eval(value.strip())))
+        except Exception:
+            return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def analysis_fields(assistant_response: Any) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    ($set, $unset) of the assistant response of an observation. Analyses
+    are stored as the `analysis` subdocument with `analysis_version`;
+    anything else (plain text) stays in `assistant_response` with version 0.
+    """
+    analysis = parse_analysis(assistant_response)
+    if analysis is not None:
+        return {"analysis": analysis, "analysis_version": ANALYSIS_SCHEMA_VERSION}, {"assistant_response": ""}
+    return {"assistant_response": assistant_response or "", "analysis_version": 0}, {"analysis": ""}
+
+
+def assistant_text(obs: Dict[str, Any]) -> str:
+    """The assistant response of an observation as the JSON text clients parse."""
+    if "analysis" in obs:
+        return json.dumps(obs["analysis"], ensure_ascii=False)
+    return obs.get("assistant_response", "")
+
+
+def observation_update(
+    quest_id: str,
+    position: int,
+    timestamp: str,
+    user_message: str = "",
+    assistant_response: Union[str, Dict[str, Any]] = "",
+    image_filename: Optional[str] = None,
+    image_location: Optional[Any] = None,
+) -> Dict[str, Any]:
+    """Update document of save_observation, upserted on (quest_id, position)."""
+    doc = {
+        "quest_id": quest_id,
+        "position": position,
+        "timestamp": timestamp,
+        "ts": timestamp_seconds(timestamp),
+        "user_message": user_message,
+        "image_filename": image_filename,
+        "image_location": image_location,
+    }
+    response_set, response_unset = analysis_fields(assistant_response)
+    doc.update(response_set)
+    return {"$set": doc, "$unset": response_unset}
+
+
+@metrics.timed("mongo")
 def save_observation(
     quest_id: str,
     position: int,
     timestamp: str,
     user_message: str = "",
-    assistant_response: str = "",
+    assistant_response: Union[str, Dict[str, Any]] = "",
     image_filename: Optional[str] = None,
     image_location: Optional[Any] = None,
 ) -> bool:
-    """Save a single observation (one image upload / chat turn)."""
+    """
+    Save a single observation (one image upload / chat turn).
+    `assistant_response` is the analysis dict, or text (see analysis_fields).
+    """
     try:
-        doc = {
-            "quest_id": quest_id,
-            "position": position,
-            "timestamp": timestamp,
-            "user_message": user_message,
-            "assistant_response": assistant_response,
-            "image_filename": image_filename,
-            "image_location": image_location,
-        }
         get_observations_collection().update_one(
             {"quest_id": quest_id, "position": position},
-            {"$set": doc},
+            observation_update(quest_id, position, timestamp, user_message, assistant_response,
+                               image_filename, image_location),
             upsert=True,
         )
         return True
@@ -232,6 +662,7 @@ def save_observation(
         return False
 
 
+@metrics.timed("mongo")
 def load_observations(quest_id: str) -> List[Dict[str, Any]]:
     """Load all observations for a quest, sorted by position."""
     try:
@@ -246,6 +677,132 @@ def load_observations(quest_id: str) -> List[Dict[str, Any]]:
         return []
 
 
+# Observations with an image
+IMAGE_OBSERVATION_FILTER = {"image_filename": {"$type": "string"}}
+# Those shown in the image grid, which pages on ts: rows without a numeric ts
+# (not backfilled, or an unparsable timestamp) would sort after every cursor.
+# The partial index on ts has the same filter.
+IMAGE_GRID_FILTER = {**IMAGE_OBSERVATION_FILTER, "ts": {"$type": "number"}}
+
+
+def _image_cursor(obs: Dict[str, Any]) -> str:
+    return f"{obs['ts']}:{obs['position']}:{obs['quest_id']}"
+
+
+@metrics.timed("mongo")
+def get_image_observations_page(
+    limit: int = 60,
+    cursor: Optional[str] = None,
+    quest_ids: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    One page of image observations, newest first, each with the species
+    identified on it (under "species"), plus the cursor of the next page.
+
+    Pages are keyed on (ts, quest_id, position) rather than skipped, so a
+    page reads `limit` index entries wherever it starts. The assistant
+    response is not read. Observations without a numeric ts are left out
+    (see backfill_observation_ts.py).
+    """
+    query: Dict[str, Any] = dict(IMAGE_GRID_FILTER)
+    if quest_ids:
+        query["quest_id"] = quest_ids[0] if len(quest_ids) == 1 else {"$in": quest_ids}
+    if cursor:
+        try:
+            ts_text, position_text, after_quest = cursor.split(":", 2)
+            ts, position = int(ts_text), int(position_text)
+        except ValueError:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        query["$or"] = [
+            {"ts": {"$lt": ts}},
+            {"ts": ts, "quest_id": {"$gt": after_quest}},
+            {"ts": ts, "quest_id": after_quest, "position": {"$gt": position}},
+        ]
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"ts": DESCENDING, "quest_id": ASCENDING, "position": ASCENDING}},
+        {"$limit": limit + 1},
+        {"$project": {"_id": 0, "quest_id": 1, "position": 1, "ts": 1, "timestamp": 1,
+                      "image_filename": 1, "image_location": 1}},
+        {"$lookup": {
+            "from": "species",
+            "let": {"quest_id": "$quest_id", "image": "$image_filename"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$quest_id", "$$quest_id"]},
+                    {"$eq": ["$observation_image", "$$image"]},
+                ]}}},
+                {"$project": {"_id": 0, "taxonomic_group": 1, "scientific_name": 1, "common_name": 1}},
+            ],
+            "as": "species",
+        }},
+    ]
+    try:
+        observations = list(get_observations_collection().aggregate(pipeline))
+    except Exception as e:
+        print(f"Error loading image observations: {e}")
+        return {"observations": [], "next_cursor": None}
+
+    next_cursor = None
+    if len(observations) > limit:
+        observations = observations[:limit]
+        next_cursor = _image_cursor(observations[-1])
+    return {"observations": observations, "next_cursor": next_cursor}
+
+
+@metrics.timed("mongo")
+def get_observations_to_identify(
+    quest_ids: Optional[List[str]] = None,
+    model: Optional[str] = None,
+    prompt_version: Optional[str] = None,
+    limit: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Image observations without species rows, in (quest_id, position) order.
+    With `model` and `prompt_version`, rows identified by another model or
+    prompt do not count, so those observations are returned as well.
+    """
+    query: Dict[str, Any] = dict(IMAGE_OBSERVATION_FILTER)
+    if quest_ids:
+        query["quest_id"] = quest_ids[0] if len(quest_ids) == 1 else {"$in": quest_ids}
+
+    species_match: List[Dict[str, Any]] = [
+        {"$eq": ["$quest_id", "$$quest_id"]},
+        {"$eq": ["$observation_image", "$$image"]},
+    ]
+    if model is not None:
+        species_match.append({"$eq": ["$identify_model", model]})
+    if prompt_version is not None:
+        species_match.append({"$eq": ["$prompt_version", prompt_version]})
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"quest_id": ASCENDING, "position": ASCENDING}},
+        {"$project": {"_id": 0, "quest_id": 1, "position": 1, "image_filename": 1, "image_location": 1}},
+        {"$lookup": {
+            "from": "species",
+            "let": {"quest_id": "$quest_id", "image": "$image_filename"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": species_match}}},
+                {"$limit": 1},
+                {"$project": {"_id": 1}},
+            ],
+            "as": "identified",
+        }},
+        {"$match": {"identified": {"$size": 0}}},
+        {"$project": {"identified": 0}},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    try:
+        return list(get_observations_collection().aggregate(pipeline, allowDiskUse=True))
+    except Exception as e:
+        print(f"Error listing observations to identify: {e}")
+        return []
+
+
+@metrics.timed("mongo")
 def count_observations(quest_id: str) -> int:
     """Count observations in a quest."""
     try:
@@ -259,6 +816,15 @@ def count_observations(quest_id: str) -> int:
 # SPECIES
 # ===================================================================
 
+def _touch_quests(quest_ids: List[str]) -> None:
+    """Bump updated_at of quests whose species changed (read by map_data)."""
+    get_quests_collection().update_many(
+        {"quest_id": {"$in": sorted(set(quest_ids))}},
+        {"$set": {"updated_at": datetime.now(timezone.utc)}},
+    )
+
+
+@metrics.timed("mongo")
 def save_species(
     quest_id: str,
     image_name: str,
@@ -293,12 +859,14 @@ def save_species(
             {"$set": doc},
             upsert=True,
         )
+        _touch_quests([quest_id])
         return True
     except Exception as e:
         print(f"Error saving species: {e}")
         return False
 
 
+@metrics.timed("mongo")
 def save_species_batch(species_list: List[Dict[str, Any]]) -> bool:
     """Save multiple species rows efficiently using bulk upserts."""
     try:
@@ -320,12 +888,34 @@ def save_species_batch(species_list: List[Dict[str, Any]]) -> bool:
             )
         if operations:
             col.bulk_write(operations, ordered=False)
+            _touch_quests([sp["quest_id"] for sp in species_list])
         return True
     except Exception as e:
         print(f"Error in batch species save: {e}")
         return False
 
 
+@metrics.timed("mongo")
+def delete_outdated_species(quest_id: str, image_name: str, model: str, prompt_version: str) -> int:
+    """Remove the species rows of an image identified by another model or prompt."""
+    try:
+        result = get_species_collection().delete_many({
+            "quest_id": quest_id,
+            "observation_image": image_name,
+            "$or": [
+                {"identify_model": {"$ne": model}},
+                {"prompt_version": {"$ne": prompt_version}},
+            ],
+        })
+        if result.deleted_count:
+            _touch_quests([quest_id])
+        return result.deleted_count
+    except Exception as e:
+        print(f"Error deleting outdated species: {e}")
+        return 0
+
+
+@metrics.timed("mongo")
 def load_species(quest_id: str) -> List[Dict[str, Any]]:
     """Load all species for a quest."""
     try:
@@ -336,6 +926,7 @@ def load_species(quest_id: str) -> List[Dict[str, Any]]:
         return []
 
 
+@metrics.timed("mongo")
 def count_species(quest_id: str) -> int:
     """Count species identifications for a quest."""
     try:
@@ -345,6 +936,7 @@ def count_species(quest_id: str) -> int:
         return 0
 
 
+@metrics.timed("mongo")
 def get_species_groups(quest_id: str) -> Dict[str, int]:
     """Get taxonomic group counts for a quest."""
     try:
@@ -359,6 +951,7 @@ def get_species_groups(quest_id: str) -> Dict[str, int]:
         return {}
 
 
+@metrics.timed("mongo")
 def get_species_csv_string(quest_id: str) -> str:
     """Reconstruct the CSV string from species documents."""
     try:
@@ -385,11 +978,64 @@ def get_species_csv_string(quest_id: str) -> str:
         return ""
 
 
+# ===================================================================
+# ANALYZER STATES
+# ===================================================================
+
+@metrics.timed("mongo")
+def save_analyzer_state(quest_id: str, state: bytes) -> Optional[int]:
+    """Store a serialized analyzer state; returns the new version number."""
+    try:
+        doc = get_analyzer_states_collection().find_one_and_update(
+            {"quest_id": quest_id},
+            {
+                "$set": {"state": Binary(state), "updated_at": datetime.now(timezone.utc)},
+                "$inc": {"version": 1},
+            },
+            projection={"version": 1, "_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["version"]
+    except Exception as e:
+        print(f"Error saving analyzer state: {e}")
+        return None
+
+
+@metrics.timed("mongo")
+def load_analyzer_state(quest_id: str) -> Optional[Tuple[bytes, int]]:
+    """Return (serialized state, version) or None if nothing is stored."""
+    try:
+        doc = get_analyzer_states_collection().find_one(
+            {"quest_id": quest_id}, {"state": 1, "version": 1, "_id": 0}
+        )
+        if not doc:
+            return None
+        return bytes(doc["state"]), doc["version"]
+    except Exception as e:
+        print(f"Error loading analyzer state: {e}")
+        return None
+
+
+@metrics.timed("mongo")
+def get_analyzer_state_version(quest_id: str) -> Optional[int]:
+    """Cheap staleness check: the stored version without the state payload."""
+    try:
+        doc = get_analyzer_states_collection().find_one(
+            {"quest_id": quest_id}, {"version": 1, "_id": 0}
+        )
+        return doc["version"] if doc else None
+    except Exception as e:
+        print(f"Error reading analyzer state version: {e}")
+        return None
+
+
 # ===================================================================
 # BACKWARD-COMPATIBLE HELPERS
 # (used by existing code that expects the old flat format)
 # ===================================================================
 
+@metrics.timed("mongo")
 def save_conversation(
     flavor: str,
     coordinates: str,
@@ -432,10 +1078,15 @@ def save_conversation(
         return False
 
 
-def load_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+@metrics.timed("mongo")
+def load_conversation(conversation_id: str, structured: bool = False) -> Optional[Dict[str, Any]]:
     """
     Backward-compatible load that reconstructs the old flat format
     from the three collections.
+
+    Each entry's "assistant" is the JSON text clients expect; with
+    `structured`, analyses are returned as the stored dicts instead (for
+    server code that reads them, and saves them back, without parsing).
     """
     try:
         quest = load_quest(conversation_id)
@@ -450,7 +1101,7 @@ def load_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
             entry: Dict[str, Any] = {
                 "user": obs.get("user_message", ""),
                 "timestamp": obs.get("timestamp", ""),
-                "assistant": obs.get("assistant_response", ""),
+                "assistant": obs["analysis"] if structured and "analysis" in obs else assistant_text(obs),
             }
             if obs.get("image_filename"):
                 entry["image_filename"] = obs["image_filename"]
@@ -472,6 +1123,7 @@ def load_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
+@metrics.timed("mongo")
 def get_all_conversations(user_id: Optional[str] = None) -> List[Dict[str, Any]]:
     """Backward-compatible: return list of quest docs."""
     try:
@@ -487,6 +1139,7 @@ def get_all_conversations(user_id: Optional[str] = None) -> List[Dict[str, Any]]
         return []
 
 
+@metrics.timed("mongo")
 def get_conversations_paginated(
     page: int = 1,
     per_page: int = 20,
@@ -514,9 +1167,34 @@ def get_conversations_paginated(
 # CONNECTION
 # ===================================================================
 
+def _forget_client():
+    global _client, _client_lock, _db
+    global _quests_col, _observations_col, _species_col, _analyzer_states_col
+    global _jobs_col, _identification_cache_col, _rate_limits_col, _quest_storage_col, _geocode_cache_col
+    _client = None
+    _client_lock = threading.Lock()
+    _db = None
+    _quests_col = _observations_col = _species_col = _analyzer_states_col = None
+    _jobs_col = _identification_cache_col = _rate_limits_col = _quest_storage_col = None
+    _geocode_cache_col = None
+
+
 def close_connection():
     """Close MongoDB connection."""
-    global _client
     if _client:
         _client.close()
-        _client = None
+    _forget_client()
+
+
+def reset_after_fork():
+    """
+    Drop the client inherited from the parent process. Its pooled sockets and
+    monitor threads belong to the parent, so the child must not use or close
+    it; a fresh client is created on next use. Runs automatically in forked
+    children and from gunicorn's post_fork hook.
+    """
+    _forget_client()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
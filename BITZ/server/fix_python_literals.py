@@ -5,18 +5,34 @@ literal instead of valid JSON.
 
 Python literals use True/False/None and single quotes; this script detects
 them, parses with ast.literal_eval, and re-serialises as proper JSON.
+Repaired assistant responses are stored as the `analysis` subdocument, and
+literals left inside existing analyses are inlined.
+
+Only candidates are read: MongoDB filters on a regex over the text fields
+and returns just those fields. Parsing runs in a process pool, fixes are
+written with one bulk_write per batch, and --apply records the last
+written _id in a resume file so an interrupted run continues where it
+stopped.
 
 Usage:
     python fix_python_literals.py              # dry-run (default)
     python fix_python_literals.py --apply      # actually write fixes
+    python fix_python_literals.py --apply --restart   # ignore the resume file
 """
 
 import argparse
 import ast
 import json
+import os
 import re
 import sys
-from typing import Any, Optional
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
 
 import db
 
@@ -165,58 +181,153 @@ def try_fix(text: str) -> Optional[str]:
     return None
 
 
-def fix_observations(apply: bool = False, diagnose: bool = False):
-    col = db.get_observations_collection()
-    total = col.count_documents({})
-    print(f"Scanning {total} observations …\n")
+# Text fields that may hold a Python literal; analyses converted by
+# migrate_analyses.py live in the `analysis` subdocument instead
+TEXT_FIELDS = ("assistant_response", "user_message")
+# Where a literal ends up inside a structured analysis (see _fix_embedded_literals)
+EMBEDDED_FIELD = "analysis.species_identification.information"
 
-    fields_to_check = ["assistant_response", "user_message"]
-    fixed = 0
-    skipped = 0
-    errors = []
-    error_samples = []
+# Server-side prefilter: a string starting with { or [ that contains one of
+# the tokens needs_fixing looks for. Everything else is never sent over.
+_LITERAL_PATTERN = {"$type": "string", "$regex": r"^\s*[\[{].*(True|False|None|')", "$options": "s"}
+CANDIDATES = {"$or": [{field: _LITERAL_PATTERN} for field in TEXT_FIELDS + (EMBEDDED_FIELD,)]}
+PROJECTION = {"quest_id": 1, "position": 1, "analysis": 1, **{field: 1 for field in TEXT_FIELDS}}
 
-    for doc in col.find():
-        doc_id = doc["_id"]
-        quest_id = doc.get("quest_id", "?")
-        position = doc.get("position", "?")
-        updates = {}
 
-        for field in fields_to_check:
-            value = doc.get(field)
-            if not value or not isinstance(value, str):
-                continue
+def repair_document(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Repairs of one observation (run in the worker processes).
+    Returns {"_id", "quest_id", "position", "set", "unset", "fixed", "errors"}
+    where errors are (field, preview) pairs of values that could not be fixed.
+    """
+    result = {
+        "_id": doc["_id"],
+        "quest_id": doc.get("quest_id", "?"),
+        "position": doc.get("position", "?"),
+        "set": {},
+        "unset": {},
+        "fixed": [],
+        "errors": [],
+    }
+
+    for field in TEXT_FIELDS:
+        value = doc.get(field)
+        if not value or not isinstance(value, str) or not needs_fixing(value):
+            continue
+        fixed = try_fix(value)
+        if fixed is None:
+            preview = value[:500] + ("…" if len(value) > 500 else "")
+            result["errors"].append((field, preview))
+            continue
+        result["fixed"].append(field)
+        if field == "assistant_response":
+            # Store the repaired response the way save_observation would
+            response_set, response_unset = db.analysis_fields(fixed)
+            result["set"].update(response_set)
+            result["unset"].update(response_unset)
+        else:
+            result["set"][field] = fixed
 
-            if not needs_fixing(value):
-                continue
+    analysis = doc.get("analysis")
+    if isinstance(analysis, dict) and "assistant_response" not in result["fixed"]:
+        repaired = _fix_embedded_literals(analysis)
+        if repaired != analysis:
+            result["fixed"].append("analysis")
+            result["set"]["analysis"] = repaired
 
-            result = try_fix(value)
-            if result is None:
-                errors.append((quest_id, position, field))
-                if diagnose and len(error_samples) < 5:
-                    preview = value[:500] + ("…" if len(value) > 500 else "")
-                    error_samples.append((quest_id, position, field, preview))
-                continue
+    return result
 
-            updates[field] = result
 
-        if not updates:
-            continue
+def batches(cursor, size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-        fixed += 1
-        label = ", ".join(updates.keys())
-        print(f"  [{quest_id} pos={position}] fixing {label}")
 
-        if apply:
-            col.update_one({"_id": doc_id}, {"$set": updates})
-        else:
-            skipped += 1
+def load_resume_token(path: str) -> Optional[ObjectId]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return ObjectId(f.read().strip())
+    except (OSError, InvalidId):
+        return None
+
+
+def save_resume_token(path: str, last_id: ObjectId) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(str(last_id))
+    os.replace(tmp, path)
+
+
+def fix_observations(
+    apply: bool = False,
+    diagnose: bool = False,
+    batch_size: int = 500,
+    workers: Optional[int] = None,
+    resume_file: Optional[str] = None,
+):
+    """
+    Repair candidate observations in _id order, `batch_size` at a time:
+    each batch is parsed by the process pool and written with one
+    unordered bulk_write. With `resume_file`, the last _id of every written
+    batch is saved there and the next run starts after it.
+    """
+    col = db.get_observations_collection()
+    query = dict(CANDIDATES)
+    resume_from = load_resume_token(resume_file) if resume_file else None
+    if resume_from is not None:
+        query = {"$and": [CANDIDATES, {"_id": {"$gt": resume_from}}]}
+        print(f"Resuming after _id {resume_from}")
+    total = col.count_documents(query)
+    print(f"Scanning {total} candidate observations …\n")
+
+    fixed = 0
+    written = 0
+    errors = []
+    error_samples = []
+    started = time.monotonic()
+
+    cursor = col.find(query, PROJECTION, batch_size=batch_size).sort("_id", 1)
+    chunksize = max(1, batch_size // (4 * (workers or os.cpu_count() or 1)))
+    scanned = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for docs in batches(cursor, batch_size):
+            batch = []
+            for result in pool.map(repair_document, docs, chunksize=chunksize):
+                for field, preview in result["errors"]:
+                    errors.append((result["quest_id"], result["position"], field))
+                    if diagnose and len(error_samples) < 5:
+                        error_samples.append((result["quest_id"], result["position"], field, preview))
+                if not result["fixed"]:
+                    continue
+                fixed += 1
+                print(f"  [{result['quest_id']} pos={result['position']}] fixing {', '.join(result['fixed'])}")
+                update = {"$set": result["set"]}
+                if result["unset"]:
+                    update["$unset"] = result["unset"]
+                batch.append(UpdateOne({"_id": result["_id"]}, update))
+
+            if apply:
+                if batch:
+                    written += col.bulk_write(batch, ordered=False).modified_count
+                if resume_file:
+                    save_resume_token(resume_file, docs[-1]["_id"])
+            scanned += len(docs)
+            elapsed = time.monotonic() - started
+            print(f"  … {scanned}/{total} scanned ({scanned / elapsed if elapsed else 0:.0f} docs/s)")
 
     print(f"\n{'=' * 60}")
     print(f"Documents scanned : {total}")
     print(f"Documents to fix  : {fixed}")
-    if not apply:
-        print(f"Skipped (dry-run) : {skipped}")
+    if apply:
+        print(f"Written           : {written}")
+    else:
+        print(f"Skipped (dry-run) : {fixed}")
     if errors:
         print(f"Errors            : {len(errors)}")
         for qid, pos, field in errors[:20]:
@@ -252,6 +363,22 @@ def main():
         "--diagnose", action="store_true",
         help="Print first 5 unfixable values for debugging",
     )
+    parser.add_argument(
+        "--batch-size", type=int, default=500,
+        help="Documents per bulk write (default: 500)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Parser processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--resume-file", default="fix_python_literals.resume",
+        help="Where --apply keeps the last written _id (default: fix_python_literals.resume)",
+    )
+    parser.add_argument(
+        "--restart", action="store_true",
+        help="Ignore the resume file and scan from the start",
+    )
     args = parser.parse_args()
 
     print("=" * 60)
@@ -266,7 +393,16 @@ def main():
         print(f"Connection failed: {e}")
         sys.exit(1)
 
-    fix_observations(apply=args.apply, diagnose=args.diagnose)
+    if args.restart and os.path.exists(args.resume_file):
+        os.remove(args.resume_file)
+
+    fix_observations(
+        apply=args.apply,
+        diagnose=args.diagnose,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        resume_file=args.resume_file,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Geocoding of quest locations, cached in MongoDB (the geocode_cache collection).
+
+reverse(lat, lng) gives the place name of a point, search(name) the
+coordinates of a place. Results, including "not found", are cached per
+backend: reverse lookups keyed by the coordinates rounded to
+GEOCODE_PRECISION decimals (3 ≈ 100 m, so nearby photos share one
+lookup), searches by the normalized name. Errors of the backend (network,
+HTTP status) are not cached.
+
+Backends (GEOCODER_BACKEND):
+
+  nominatim  a Nominatim server at GEOCODER_URL (the public one by
+             default, or a local instance or stub). Requests are throttled
+             to one every GEOCODER_MIN_INTERVAL seconds per process, as the
+             public server's usage policy asks.
+  gazetteer  an offline CSV file (GEOCODER_GAZETTEER) with name, latitude
+             and longitude columns; reverse gives the nearest entry within
+             GEOCODER_GAZETTEER_MAX_KM.
+  stub       no lookup: names are made from the coordinates, for tests and
+             benchmarks.
+
+The command line fills quests that lack a location name (from their
+coordinates, or the location of their first located image) or coordinates
+(from their location name), deduplicating points before any lookup.
+Lookups of a dry-run are cached too, so the --apply run after it is fast:
+
+    python geocoding.py fill-names [--limit N] [--apply]
+    python geocoding.py fill-coordinates [--limit N] [--apply]
+    python geocoding.py reverse LAT LNG
+    python geocoding.py search NAME
+"""
+
+import argparse
+import csv
+import math
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+import db
+import map_data
+
+GEOCODER_BACKEND = os.getenv("GEOCODER_BACKEND", "nominatim")
+GEOCODER_URL = os.getenv("GEOCODER_URL", "https://nominatim.openstreetmap.org").rstrip("/")
+GEOCODER_USER_AGENT = os.getenv("GEOCODER_USER_AGENT", "BITZ/1.0 (https://github.com/RubenGres/BITZ)")
+GEOCODER_MIN_INTERVAL = float(os.getenv("GEOCODER_MIN_INTERVAL", "1.0"))
+GEOCODER_TIMEOUT = float(os.getenv("GEOCODER_TIMEOUT", "10"))
+GEOCODER_GAZETTEER = os.getenv("GEOCODER_GAZETTEER", "")
+GEOCODER_GAZETTEER_MAX_KM = float(os.getenv("GEOCODER_GAZETTEER_MAX_KM", "50"))
+GEOCODE_PRECISION = int(os.getenv("GEOCODE_PRECISION", "3"))
+
+REVERSE = "reverse"
+SEARCH = "search"
+
+Point = Tuple[float, float]
+
+
+class GeocoderError(Exception):
+    """The backend could not answer (as opposed to finding nothing)."""
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class Throttle:
+    """At most one call every `interval` seconds, across threads."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next:
+                time.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+class NominatimBackend:
+    name = "nominatim"
+
+    def __init__(self, url: str = GEOCODER_URL, min_interval: float = GEOCODER_MIN_INTERVAL):
+        self.url = url
+        self.throttle = Throttle(min_interval)
+        self.client = httpx.Client(
+            timeout=GEOCODER_TIMEOUT,
+            headers={"User-Agent": GEOCODER_USER_AGENT},
+        )
+
+    def _get(self, path: str, params: Dict[str, object]):
+        self.throttle.wait()
+        try:
+            response = self.client.get(f"{self.url}/{path}", params={"format": "json", **params})
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise GeocoderError(f"{path} request failed: {e}") from e
+
+    def reverse(self, lat: float, lng: float) -> Optional[str]:
+        # zoom 10 (city level), like the client's own lookups
+        data = self._get("reverse", {"lat": lat, "lon": lng, "zoom": 10})
+        if not isinstance(data, dict):
+            return None
+        return data.get("display_name") or None
+
+    def search(self, name: str) -> Optional[Point]:
+        data = self._get("search", {"q": name, "limit": 1})
+        if not data:
+            return None
+        return float(data[0]["lat"]), float(data[0]["lon"])
+
+
+class GazetteerBackend:
+    name = "gazetteer"
+
+    def __init__(self, path: str = GEOCODER_GAZETTEER, max_km: float = GEOCODER_GAZETTEER_MAX_KM):
+        if not path:
+            raise ValueError("GEOCODER_GAZETTEER is not set")
+        self.max_km = max_km
+        self.places: List[Tuple[str, float, float]] = []
+        self.by_name: Dict[str, Point] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    place = (row["name"], float(row["latitude"]), float(row["longitude"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                self.places.append(place)
+                self.by_name.setdefault(normalize_name(place[0]), place[1:])
+        # Qualify the cache key so changing the file does not serve old results
+        self.name = f"gazetteer:{os.path.basename(path)}"
+
+    def reverse(self, lat: float, lng: float) -> Optional[str]:
+        best, best_km = None, self.max_km
+        for name, place_lat, place_lng in self.places:
+            km = haversine_km(lat, lng, place_lat, place_lng)
+            if km <= best_km:
+                best, best_km = name, km
+        return best
+
+    def search(self, name: str) -> Optional[Point]:
+        return self.by_name.get(normalize_name(name))
+
+
+class StubBackend:
+    name = "stub"
+
+    def reverse(self, lat: float, lng: float) -> Optional[str]:
+        return f"Place {lat:.{GEOCODE_PRECISION}f}, {lng:.{GEOCODE_PRECISION}f}"
+
+    def search(self, name: str) -> Optional[Point]:
+        return lat_lng(name.removeprefix("Place "))
+
+
+BACKENDS = {
+    "nominatim": NominatimBackend,
+    "gazetteer": GazetteerBackend,
+    "stub": StubBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            try:
+                _backend = BACKENDS[GEOCODER_BACKEND]()
+            except KeyError:
+                raise ValueError(f"Unknown GEOCODER_BACKEND {GEOCODER_BACKEND!r} "
+                                 f"(expected one of {', '.join(BACKENDS)})")
+        return _backend
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+def lat_lng(value) -> Optional[Point]:
+    """(lat, lng) of a stored coordinates value (see map_data.lat_lng), or None."""
+    position = map_data.lat_lng(value)
+    return (position[0], position[1]) if position else None
+
+
+def point_key(lat: float, lng: float) -> str:
+    return f"{lat:.{GEOCODE_PRECISION}f},{lng:.{GEOCODE_PRECISION}f}"
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"\s+", " ", name).strip().lower()
+
+
+# ---------------------------------------------------------------------------
+# Cached lookups
+# ---------------------------------------------------------------------------
+
+def _cached(kind: str, backend_name: str, keys: List[str]) -> Dict[str, dict]:
+    try:
+        cursor = db.get_geocode_cache_collection().find(
+            {"kind": kind, "backend": backend_name, "key": {"$in": keys}},
+            {"_id": 0, "key": 1, "name": 1, "latitude": 1, "longitude": 1},
+        )
+        return {doc["key"]: doc for doc in cursor}
+    except Exception as e:
+        print(f"Error reading geocode cache: {e}")
+        return {}
+
+
+def _store(kind: str, backend_name: str, key: str, name: Optional[str], point: Optional[Point]) -> None:
+    try:
+        db.get_geocode_cache_collection().update_one(
+            {"kind": kind, "backend": backend_name, "key": key},
+            {"$set": {
+                "name": name,
+                "latitude": point[0] if point else None,
+                "longitude": point[1] if point else None,
+                "created_at": datetime.now(timezone.utc),
+            }},
+            upsert=True,
+        )
+    except Exception as e:
+        print(f"Error writing geocode cache: {e}")
+
+
+def reverse_batch(points: Iterable[Point]) -> Dict[str, Optional[str]]:
+    """
+    Place names of many points, keyed by point_key. Points sharing a
+    rounded key are looked up once; cached keys are read with one query and
+    only the rest go to the (throttled) backend.
+    """
+    backend = get_backend()
+    rounded = {point_key(lat, lng): (round(lat, GEOCODE_PRECISION), round(lng, GEOCODE_PRECISION))
+               for lat, lng in points}
+    cached = _cached(REVERSE, backend.name, list(rounded))
+    names = {key: doc.get("name") for key, doc in cached.items()}
+    for key, (lat, lng) in rounded.items():
+        if key in names:
+            continue
+        try:
+            name = backend.reverse(lat, lng)
+        except GeocoderError as e:
+            print(f"Reverse geocoding {key} failed: {e}")
+            continue
+        names[key] = name
+        _store(REVERSE, backend.name, key, name, (lat, lng))
+    return names
+
+
+def reverse(lat: float, lng: float) -> Optional[str]:
+    """Place name of a point, or None."""
+    return reverse_batch([(lat, lng)]).get(point_key(lat, lng))
+
+
+def search_batch(names: Iterable[str]) -> Dict[str, Optional[Point]]:
+    """Coordinates of many place names, keyed by normalize_name."""
+    backend = get_backend()
+    queries = {normalize_name(name): name for name in names if name and name.strip()}
+    cached = _cached(SEARCH, backend.name, list(queries))
+    points: Dict[str, Optional[Point]] = {
+        key: (doc["latitude"], doc["longitude"]) if doc.get("latitude") is not None else None
+        for key, doc in cached.items()
+    }
+    for key, name in queries.items():
+        if key in points:
+            continue
+        try:
+            point = backend.search(name)
+        except GeocoderError as e:
+            print(f"Searching {name!r} failed: {e}")
+            continue
+        points[key] = point
+        _store(SEARCH, backend.name, key, name if point else None, point)
+    return points
+
+
+def search(name: str) -> Optional[Point]:
+    """(lat, lng) of a place name, or None."""
+    return search_batch([name]).get(normalize_name(name))
+
+
+# ---------------------------------------------------------------------------
+# Quest enrichment
+# ---------------------------------------------------------------------------
+
+def fill_names(apply: bool = False, limit: int = 0) -> Tuple[int, int]:
+    """
+    Set the location name of quests that have none, from their coordinates
+    or those of their first located image. Returns (found, written).
+    """
+    quests = db.get_quests_missing_location(limit)
+    points = {}
+    for quest in quests:
+        point = lat_lng(quest.get("coordinates")) or lat_lng(quest.get("image_location"))
+        if point is not None:
+            points[quest["quest_id"]] = point
+    print(f"{len(quests)} quest(s) without a location name, {len(points)} with coordinates")
+
+    names = reverse_batch(points.values())
+    updates = {}
+    for quest_id, (lat, lng) in points.items():
+        name = names.get(point_key(lat, lng))
+        if name:
+            updates[quest_id] = {"location": name}
+            print(f"  {quest_id}: {name}")
+    return len(updates), db.update_quests(updates) if apply else 0
+
+
+def fill_coordinates(apply: bool = False, limit: int = 0) -> Tuple[int, int]:
+    """Set the coordinates of quests that only have a location name. Returns (found, written)."""
+    quests = db.get_quests_missing_coordinates(limit)
+    print(f"{len(quests)} quest(s) with a location name but no coordinates")
+
+    points = search_batch(quest["location"] for quest in quests)
+    updates = {}
+    for quest in quests:
+        point = points.get(normalize_name(quest["location"]))
+        if point:
+            # Same "lat, lng" form as the coordinates the client sends
+            updates[quest["quest_id"]] = {"coordinates": f"{point[0]}, {point[1]}"}
+            print(f"  {quest['quest_id']}: {quest['location']} → {point[0]}, {point[1]}")
+    return len(updates), db.update_quests(updates) if apply else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cached geocoding of quest locations")
+    sub = parser.add_subparsers(dest="action", required=True)
+    for action, help_text in (("fill-names", "Name the location of quests from their coordinates"),
+                              ("fill-coordinates", "Find the coordinates of quests from their location name")):
+        cmd = sub.add_parser(action, help=help_text)
+        cmd.add_argument("--apply", action="store_true", help="Actually write (default is dry-run)")
+        cmd.add_argument("--limit", type=int, default=0, help="At most N quests")
+    rev = sub.add_parser("reverse", help="Place name of a point")
+    rev.add_argument("lat", type=float)
+    rev.add_argument("lng", type=float)
+    srch = sub.add_parser("search", help="Coordinates of a place name")
+    srch.add_argument("name")
+    args = parser.parse_args()
+
+    try:
+        db.get_client()
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+
+    print(f"Backend: {get_backend().name}")
+    if args.action == "reverse":
+        print(reverse(args.lat, args.lng) or "Not found")
+    elif args.action == "search":
+        point = search(args.name)
+        print(f"{point[0]}, {point[1]}" if point else "Not found")
+    else:
+        fill = fill_names if args.action == "fill-names" else fill_coordinates
+        found, written = fill(apply=args.apply, limit=args.limit)
+        print(f"\n{found} quest(s) resolved")
+        if args.apply:
+            print(f"{written} quest(s) updated")
+        elif found:
+            print("\nThis was a dry-run. Re-run with --apply to write changes.")
+
+
+if __name__ == "__main__":
+    main()
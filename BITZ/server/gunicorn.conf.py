@@ -0,0 +1,43 @@
+"""
+gunicorn settings for the BITZ server (used by the Dockerfile):
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Workers drop any MongoDB client inherited from the master (post_fork).
+Besides the worker settings, this prepares Prometheus multiprocess mode so
+GET /metrics aggregates the samples of every worker (see metrics.py): each
+worker writes to PROMETHEUS_MULTIPROC_DIR, which is emptied at startup, and
+the files of exited workers are released.
+"""
+
+import os
+import shutil
+
+bind = os.getenv("GUNICORN_BIND", "unix:/app/socket/gunicorn.sock")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+threads = int(os.getenv("GUNICORN_THREADS", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+# Must be set before any worker imports prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/bitz-metrics")
+
+
+def on_starting(server):
+    # Samples left over from a previous run would be summed into the new ones
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def post_fork(server, worker):
+    # A MongoDB client created in the master (e.g. with --preload) must not be
+    # shared; db also resets itself via os.register_at_fork
+    import db
+
+    db.reset_after_fork()
+
+
+def child_exit(server, worker):
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
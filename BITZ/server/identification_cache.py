@@ -0,0 +1,112 @@
+"""
+Persistent cache of species identification results.
+
+Users often re-upload the same or nearly the same shot, and
+utils/remake_species.py re-identifies whole quests; each time a full vision
+call is paid. Results are stored in the identification_cache collection,
+keyed by the SHA-256 of the image file plus the model, prompt version and
+language that produced them, so changing the prompt invalidates the cache.
+
+Near-duplicates (IDENT_CACHE_PHASH=1): each entry also stores a 64-bit
+difference hash split into four 16-bit bands. Two hashes within Hamming
+distance 3 always share at least one band, so candidates are found with an
+indexed `$in` on the bands and then checked exactly.
+"""
+
+import hashlib
+import os
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+import db
+import image_handler
+
+IDENT_CACHE_ENABLED = os.getenv("IDENT_CACHE_ENABLED", "1") == "1"
+IDENT_CACHE_PHASH = os.getenv("IDENT_CACHE_PHASH", "0") == "1"
+IDENT_CACHE_PHASH_DISTANCE = min(3, int(os.getenv("IDENT_CACHE_PHASH_DISTANCE", "3")))
+
+_BANDS = 4
+_BAND_BITS = 16
+
+
+def content_hash(image_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _to_int64(value: int) -> int:
+    """BSON integers are signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _bands(phash: int):
+    mask = (1 << _BAND_BITS) - 1
+    return [(i << _BAND_BITS) | ((phash >> (i * _BAND_BITS)) & mask) for i in range(_BANDS)]
+
+
+def fingerprint(image_path: str) -> Tuple[str, Optional[int]]:
+    """(content hash, perceptual hash or None) of an image file."""
+    phash = None
+    if IDENT_CACHE_PHASH:
+        try:
+            phash = image_handler.dhash(image_path)
+        except Exception as e:
+            print(f"Could not compute perceptual hash of {image_path}: {e}")
+    return content_hash(image_path), phash
+
+
+def lookup(fp: Tuple[str, Optional[int]], model: str, prompt_version: str, language: str) -> Optional[str]:
+    """Cached raw reply for this image (or a near-duplicate), if any."""
+    digest, phash = fp
+    key = {"model": model, "prompt_version": prompt_version, "language": language}
+    try:
+        col = db.get_identification_cache_collection()
+        doc = col.find_one_and_update(
+            {"content_hash": digest, **key},
+            {"$inc": {"hits": 1}},
+            projection={"raw_reply": 1, "_id": 0},
+        )
+        if doc:
+            return doc["raw_reply"]
+
+        if phash is None:
+            return None
+        candidates = col.find(
+            {"phash_bands": {"$in": _bands(phash)}, **key},
+            {"phash": 1, "raw_reply": 1},
+        ).limit(50)
+        for candidate in candidates:
+            distance = bin((candidate["phash"] ^ _to_int64(phash)) & ((1 << 64) - 1)).count("1")
+            if distance <= IDENT_CACHE_PHASH_DISTANCE:
+                col.update_one({"_id": candidate["_id"]}, {"$inc": {"near_hits": 1}})
+                return candidate["raw_reply"]
+        return None
+    except Exception as e:
+        print(f"Error reading identification cache: {e}")
+        return None
+
+
+def store(fp: Tuple[str, Optional[int]], model: str, prompt_version: str, language: str, raw_reply: str) -> None:
+    digest, phash = fp
+    doc = {
+        "content_hash": digest,
+        "model": model,
+        "prompt_version": prompt_version,
+        "language": language,
+        "raw_reply": raw_reply,
+        "created_at": datetime.now(timezone.utc),
+    }
+    if phash is not None:
+        doc["phash"] = _to_int64(phash)
+        doc["phash_bands"] = _bands(phash)
+    try:
+        db.get_identification_cache_collection().update_one(
+            {"content_hash": digest, "model": model, "prompt_version": prompt_version, "language": language},
+            {"$setOnInsert": doc},
+            upsert=True,
+        )
+    except Exception as e:
+        print(f"Error writing identification cache: {e}")
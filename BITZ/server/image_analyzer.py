@@ -1,35 +1,93 @@
-from openai import OpenAI
 import json
 import os
 import base64
 import re
+import zlib
+from functools import lru_cache
 from typing import Dict, List, Optional, Union
-from oaak_classify import identify_chatgpt
+from oaak_classify import IDENTIFY_LANGUAGE, identify_chatgpt
+import db
+import llm_clients
+import metrics
+import rate_limiter
+from prompt_context import PromptContext, dedupe_names, usage_report
+
+
+@lru_cache(maxsize=1)
+def _load_system_prompts() -> dict:
+    """Read prompts/analyze/*.txt once per process; every session shares the same dict."""
+    prompts = {}
+    
+    # Get all .txt files in the prompts/analyze directory
+    prompt_dir = "prompts/analyze"
+    for filename in os.listdir(prompt_dir):
+        if filename.endswith(".txt"):
+            filepath = os.path.join(prompt_dir, filename)
+            # Remove the .txt extension to use as key
+            key = os.path.splitext(filename)[0]
+            
+            # Read the file content
+            with open(filepath, 'r') as file:
+                prompts[key] = file.read()
+    
+    return prompts
+
+
+def parse_assistant_response(data) -> Optional[Dict]:
+    """
+    Parse a stored assistant response back into a dict. Observations store
+    the analysis as a subdocument (load_conversation(structured=True) hands
+    it over as is); JSON text and Python reprs come from older rows.
+    """
+    return db.parse_analysis(data)
+
 
 class ImageAnalyzer:
     def __init__(self, api_key: Optional[str] = None):
         """Initialize the ImageAnalyzer with an optional API key."""
-        self.client = OpenAI(api_key=api_key or os.getenv('OPENAI_API_KEY'))
+        self.client = llm_clients.get_openai_client(api_key)
         self.conversation_history = []
-        self.system_prompts = self._load_system_prompts()
+        self.system_prompts = _load_system_prompts()
+        self.context = PromptContext()
+        self.last_usage: Dict[str, int] = {}
 
-    def _load_system_prompts(self) -> dict:
-        import os
-        prompts = {}
-        
-        # Get all .txt files in the prompts/analyze directory
-        prompt_dir = "prompts/analyze"
-        for filename in os.listdir(prompt_dir):
-            if filename.endswith(".txt"):
-                filepath = os.path.join(prompt_dir, filename)
-                # Remove the .txt extension to use as key
-                key = os.path.splitext(filename)[0]
-                
-                # Read the file content
-                with open(filepath, 'r') as file:
-                    prompts[key] = file.read()
-        
-        return prompts
+    @classmethod
+    def from_history(cls, history: List[Dict], api_key: Optional[str] = None) -> "ImageAnalyzer":
+        """
+        Rebuild a session from persisted observations (the `history` list of
+        db.load_conversation), e.g. after the in-memory session was evicted.
+        """
+        analyzer = cls(api_key=api_key)
+        for entry in history or []:
+            result = parse_assistant_response(entry.get('assistant'))
+            if result:
+                analyzer.conversation_history.append({
+                    "role": "assistant",
+                    "content": json.dumps(result)
+                })
+        return analyzer
+
+    def to_state(self) -> bytes:
+        """Compact serialization of the session: minified JSON, zlib-compressed."""
+        state = {"v": 1, "h": self.conversation_history}
+        return zlib.compress(json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def from_state(cls, payload: bytes, api_key: Optional[str] = None) -> "ImageAnalyzer":
+        """Restore a session serialized with to_state()."""
+        state = json.loads(zlib.decompress(payload).decode('utf-8'))
+        analyzer = cls(api_key=api_key)
+        analyzer.conversation_history = state.get("h", [])
+        return analyzer
+
+    def _record_usage(self, name: str, response, report: Dict[str, int]) -> None:
+        """Keep the token counts of the last LLM call and add them to the metrics."""
+        self.last_usage = usage_report(response, report)
+        metrics.record_tokens(name, self.last_usage)
+
+    def approx_size(self) -> int:
+        """Approximate number of bytes held by the conversation history."""
+        return sum(len(m.get("content", "")) for m in self.conversation_history)
 
     def _extract_json_from_text(self, text: str) -> Dict:
         """
@@ -68,6 +126,17 @@ class ImageAnalyzer:
         # If all extraction attempts fail, create a default structure with the raw text
         return self._create_fallback_response(text)
     
+    def limit_response_body(self, error: rate_limiter.LimitExceeded) -> Dict:
+        """
+        Body of the 429 for an analysis refused by the rate limiter: shaped
+        like an analysis, so the client still renders the message, plus the
+        rate_limiter.error_body fields.
+        """
+        body = self._create_fallback_response(str(error))
+        body.update(rate_limiter.error_body(error))
+        body["species_identification"]["what_is_it"] = body["error"]
+        return body
+
     def _create_fallback_response(self, text: str) -> Dict:
         """Create a fallback response when JSON parsing fails."""
         return {
@@ -92,7 +161,7 @@ class ImageAnalyzer:
             "raw_response": text[:500] + ("..." if len(text) > 500 else "")
         }
 
-    def analyze_image(self, image_input: Union[str, dict], flavor: str, history) -> Dict:
+    def analyze_image(self, image_input: Union[str, dict], flavor: str, history, image_b64: Optional[str] = None) -> Dict:
         """
         Analyze an image using OpenAI's model for biodiversity sampling.
         This is a two step process, first the species identification and then the full analysis text.
@@ -102,6 +171,8 @@ class ImageAnalyzer:
             image_input: Either a local file path (str) or a dict containing image URL
                         Format for URL: {"type": "image_url", "image_url": {"url": "https://..."}}
             flavor: The flavor of the analysis
+            image_b64: Already preprocessed base64 rendition of the image, if the
+                       caller has one (avoids reading the file back)
         
         Returns:
             Dict containing the biodiversity analysis results
@@ -112,43 +183,33 @@ class ImageAnalyzer:
 
         def get_species_name(entry):
             try:
-                data = entry['assistant']
-                if isinstance(data, str):
-                    data = json.loads(data)
+                data = parse_assistant_response(entry['assistant']) or {}
                 return data.get('species_identification', {}).get('name', '')
             except:
                 return ''
 
-        species_names = [name for name in map(get_species_name, history) if name]
+        species_names = dedupe_names(list(map(get_species_name, history)))
 
         print("species_names are:", species_names)
 
         try:
-            language = "en"  # Default language, adjust as needed
-            species_csv_lines = identify_chatgpt(image_input, language)
-
-            messages = [
-                {
-                    "role": "system",
-                    "content": self.system_prompts[flavor]
-                }
-            ]
-
-            # Add conversation history for context
-            messages.extend(self.conversation_history)
-
-            # Add the current image
-            messages.append({
-                "role": "user",
-                "content": f"Here are the species found on the image: \n\n {species_csv_lines}. Previous species identified: {', '.join(species_names)}",
-            })
+            species_csv_lines = identify_chatgpt(image_input, IDENTIFY_LANGUAGE, image_b64=image_b64)
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=2048,
-                response_format={"type": "json_object"}  # Request JSON formatting
+            # Windowed history + summary of older turns, within the token budget
+            messages, report = self.context.build(
+                self.system_prompts[flavor],
+                self.conversation_history,
+                f"Here are the species found on the image: \n\n {species_csv_lines}. Previous species identified: {', '.join(species_names)}",
             )
+
+            with rate_limiter.limit("analyze"), metrics.span("llm", "analyze"):
+                response = self.client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=messages,
+                    max_tokens=2048,
+                    response_format={"type": "json_object"}  # Request JSON formatting
+                )
+            self._record_usage("analyze", response, report)
             
             response_content = response.choices[0].message.content
             
@@ -173,6 +234,9 @@ class ImageAnalyzer:
                 })
                 return result
 
+        except rate_limiter.LimitExceeded:
+            # Surfaced by the route as a 429 with Retry-After
+            raise
         except Exception as e:
             return {
                 "error": f"Analysis failed: {str(e)}",
@@ -205,28 +269,27 @@ class ImageAnalyzer:
             Dict containing the next sampling guidance
         """
         try:
-            # Add user's response to conversation history
-            self.conversation_history.append({
-                "role": "user",
-                "content": f"My observation: {answer}"
-            })
-
-            messages = [
-                {
-                    "role": "system", 
-                    "content": self.system_prompts["default"]
-                }
-            ]
-            
-            # Add conversation history
-            messages.extend(self.conversation_history)
+            user_content = f"My observation: {answer}"
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=1024,
-                response_format={"type": "json_object"}  # Request JSON formatting
+            # Windowed history within the token budget; the answer itself is
+            # always sent verbatim, never folded into the summary
+            messages, report = self.context.build(
+                self.system_prompts["default"],
+                self.conversation_history,
+                user_content,
             )
+
+            with rate_limiter.limit("answer"), metrics.span("llm", "answer"):
+                response = self.client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=messages,
+                    max_tokens=1024,
+                    response_format={"type": "json_object"}  # Request JSON formatting
+                )
+            self._record_usage("answer", response, report)
+
+            # Add user's response to conversation history
+            self.conversation_history.append({"role": "user", "content": user_content})
             
             response_content = response.choices[0].message.content
             
@@ -253,5 +316,7 @@ class ImageAnalyzer:
                 })
                 return result
 
+        except rate_limiter.LimitExceeded:
+            raise
         except Exception as e:
             return self._create_fallback_response(f"Failed to process response: {str(e)}")
@@ -1,6 +1,19 @@
-
 import requests
 import base64
+import hashlib
+import io
+import os
+from PIL import Image, ImageOps
+
+import metrics
+import storage_stats
+
+# Vision models downscale high-detail images to fit 2048x2048 and then to a
+# 768px shortest side; anything larger is only upload and latency.
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "2048"))
+VISION_SHORT_SIDE = int(os.getenv("VISION_SHORT_SIDE", "768"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+VISION_CACHE_DIR = os.getenv("VISION_CACHE_DIR", os.path.join("history", "cache", "vision"))
 
 def get_base64_from_url(image_url):
     response = requests.get(image_url)
@@ -8,7 +21,7 @@ def get_base64_from_url(image_url):
         return base64.b64encode(response.content).decode('utf-8')
     else:
         raise ValueError(f"Failed to fetch image, status code: {response.status_code}")
-    
+
 def get_base64_from_path(image_path):
     """Reads an image from a file and converts it to a Base64-encoded string."""
     try:
@@ -19,3 +32,97 @@ def get_base64_from_path(image_path):
     except Exception as e:
         raise ValueError(f"Error processing file {image_path}: {e}")
 
+def vision_size(width, height, max_side=VISION_MAX_SIDE, short_side=VISION_SHORT_SIDE):
+    """Target size that fits max_side on the long edge and short_side on the short edge, never upscaling."""
+    scale = min(1.0, max_side / max(width, height), short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+@metrics.timed("pil")
+def preprocess_for_vision(source, max_side=VISION_MAX_SIDE, short_side=VISION_SHORT_SIDE, quality=VISION_JPEG_QUALITY):
+    """
+    EXIF-transpose, downscale and re-encode an image as JPEG for a vision call.
+
+    Args:
+        source: A file path or the raw image bytes.
+
+    Returns:
+        The re-encoded JPEG bytes (EXIF metadata is not carried over).
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        size = vision_size(*img.size, max_side=max_side, short_side=short_side)
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=quality, optimize=True)
+        return buffer.getvalue()
+
+def dhash(source, hash_size=8):
+    """
+    64-bit difference hash of an image (path or bytes): similar images get
+    hashes with a small Hamming distance, unlike a content hash.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img).convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = list(img.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+def _vision_cache_path(image_path, max_side, short_side, quality):
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}|{max_side}|{short_side}|{quality}"
+    return os.path.join(VISION_CACHE_DIR, hashlib.sha1(key.encode()).hexdigest() + ".jpg")
+
+def vision_cache_path(image_path):
+    """Where the vision rendition of an image is cached with the current settings."""
+    return _vision_cache_path(image_path, VISION_MAX_SIDE, VISION_SHORT_SIDE, VISION_JPEG_QUALITY)
+
+def get_vision_base64_from_path(image_path, max_side=VISION_MAX_SIDE, short_side=VISION_SHORT_SIDE, quality=VISION_JPEG_QUALITY, image_bytes=None):
+    """
+    Base64 of the preprocessed rendition of an image, cached on disk per image
+    and settings. Falls back to the original file if it cannot be decoded.
+
+    `image_bytes` can hold the content of `image_path` when the caller just
+    wrote it, so the file is not read back from disk.
+    """
+    try:
+        cache_path = _vision_cache_path(image_path, max_side, short_side, quality)
+    except FileNotFoundError:
+        raise ValueError(f"File not found: {image_path}")
+
+    if os.path.isfile(cache_path):
+        with open(cache_path, "rb") as cached:
+            return base64.b64encode(cached.read()).decode("utf-8")
+
+    try:
+        data = preprocess_for_vision(image_bytes if image_bytes is not None else image_path, max_side, short_side, quality)
+    except Exception as e:
+        print(f"Vision preprocessing failed for {image_path}, sending original: {e}")
+        if image_bytes is not None:
+            return base64.b64encode(image_bytes).decode("utf-8")
+        return get_base64_from_path(image_path)
+
+    try:
+        os.makedirs(VISION_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(data)
+        previous_size = storage_stats.file_size(cache_path)
+        os.replace(tmp_path, cache_path)
+        storage_stats.file_written(storage_stats.quest_of_image(image_path), storage_stats.RENDITIONS,
+                                   cache_path, previous_size)
+    except OSError as e:
+        print(f"Could not cache vision rendition of {image_path}: {e}")
+
+    return base64.b64encode(data).decode("utf-8")
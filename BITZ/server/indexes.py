@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+MongoDB index declarations and maintenance.
+
+INDEXES lists, per collection, the indexes the code's queries need. Each
+index is there for a specific query:
+
+  quests        quest_id (unique)             load/save by id
+                user_id + timestamp           listings of one user, newest first
+                timestamp                     listings of everyone / everyone else
+                updated_at                    map_data incremental refresh
+  observations  quest_id + position           load_observations (filter + sort)
+                ts + quest_id + position      image grid pages, newest first (only
+                                              observations with an image and a
+                                              numeric ts)
+  species       quest_id + observation_image  save_species(_batch) upsert key, unique
+                + scientific_name             so a re-identified image never
+                                              duplicates rows; its quest_id prefix
+                                              serves load/count/group by quest
+  ...           (analyzer_states, jobs, identification_cache, rate_limits,
+                 quest_storage, geocode_cache: see the modules using them)
+
+DEPRECATED lists indexes that a declared one supersedes (a prefix of a
+compound index); they are dropped once the replacement exists.
+
+ensure_indexes() is idempotent; the server and the job worker run it in a
+background thread at startup (ensure_indexes_background), so a long build
+never delays serving. Creating the unique species index fails if duplicate
+rows already exist; `python indexes.py dedupe-species` removes them.
+
+Other indexes can be listed with their $indexStats usage and dropped:
+    python indexes.py ensure
+    python indexes.py status
+    python indexes.py unused [--min-age-days 7] [--drop]
+    python indexes.py dedupe-species [--dry-run]
+
+$indexStats counters restart with mongod, so only trust "unused" after the
+server has been up for a while (--min-age-days).
+"""
+
+import argparse
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+import db
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "quests": [
+        IndexModel([("quest_id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("timestamp", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "observations": [
+        IndexModel([("quest_id", ASCENDING), ("position", ASCENDING)]),
+        IndexModel(
+            [("ts", DESCENDING), ("quest_id", ASCENDING), ("position", ASCENDING)],
+            name="image_grid_ts",
+            partialFilterExpression=db.IMAGE_GRID_FILTER,
+        ),
+    ],
+    "species": [
+        IndexModel(
+            [("quest_id", ASCENDING), ("observation_image", ASCENDING), ("scientific_name", ASCENDING)],
+            unique=True,
+        ),
+    ],
+    "analyzer_states": [
+        IndexModel([("quest_id", ASCENDING)], unique=True),
+        IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=db.ANALYZER_STATE_TTL),
+    ],
+    "jobs": [
+        # Idempotency key: one job per type and (quest, image)
+        IndexModel([("type", ASCENDING), ("quest_id", ASCENDING), ("image", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)]),
+        IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=db.JOB_RETENTION),
+    ],
+    "identification_cache": [
+        IndexModel(
+            [("content_hash", ASCENDING), ("model", ASCENDING), ("prompt_version", ASCENDING), ("language", ASCENDING)],
+            unique=True,
+        ),
+        IndexModel([("phash_bands", ASCENDING)]),
+    ],
+    "rate_limits": [
+        # Daily budget counters carry an expire_at; the bucket document does not
+        IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "quest_storage": [
+        IndexModel([("quest_id", ASCENDING)], unique=True),
+        # Dashboard sorts (db.list_quests_with_storage)
+        IndexModel([("total_bytes", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "geocode_cache": [
+        # Lookup key of geocoding.reverse / geocoding.search
+        IndexModel([("kind", ASCENDING), ("backend", ASCENDING), ("key", ASCENDING)], unique=True),
+    ],
+}
+
+# Superseded index -> the declared index that replaces it
+DEPRECATED: Dict[str, Dict[str, str]] = {
+    "quests": {"user_id_1": "user_id_1_timestamp_-1"},
+    "observations": {
+        "quest_id_1": "quest_id_1_position_1",
+        # Same keys, partial filter without the numeric ts condition
+        "ts_-1_quest_id_1_position_1": "image_grid_ts",
+    },
+    "species": {"quest_id_1": "quest_id_1_observation_image_1_scientific_name_1"},
+}
+
+_started = False
+_started_lock = threading.Lock()
+
+
+def declared_names(collection: str) -> List[str]:
+    return [model.document["name"] for model in INDEXES.get(collection, [])]
+
+
+def _ensure_index(col, model: IndexModel) -> bool:
+    spec = model.document
+    try:
+        col.create_indexes([model])
+        return True
+    except OperationFailure as e:
+        # A TTL whose duration changed (e.g. JOB_RETENTION): update it in place
+        if e.code in (85, 86) and "expireAfterSeconds" in spec:
+            col.database.command("collMod", col.name, index={
+                "keyPattern": dict(spec["key"]), "expireAfterSeconds": spec["expireAfterSeconds"],
+            })
+            return True
+        if e.code == 11000:
+            hint = " (run `python indexes.py dedupe-species`)" if col.name == "species" else ""
+            print(f"Cannot build unique index {col.name}.{spec['name']}: duplicate keys exist{hint}")
+        else:
+            print(f"Cannot build index {col.name}.{spec['name']}: {e}")
+        return False
+
+
+def ensure_indexes() -> Dict[str, List[str]]:
+    """Create missing declared indexes and drop deprecated ones. Returns what changed."""
+    database = db.get_database()
+    changes: Dict[str, List[str]] = {"created": [], "dropped": [], "failed": []}
+    for collection, models in INDEXES.items():
+        col = database[collection]
+        before = set(col.index_information())
+        for model in models:
+            name = model.document["name"]
+            if _ensure_index(col, model):
+                if name not in before:
+                    changes["created"].append(f"{collection}.{name}")
+            else:
+                changes["failed"].append(f"{collection}.{name}")
+
+        existing = set(col.index_information())
+        for old, replacement in DEPRECATED.get(collection, {}).items():
+            if old in existing and replacement in existing:
+                col.drop_index(old)
+                changes["dropped"].append(f"{collection}.{old}")
+
+    for action in ("created", "dropped"):
+        if changes[action]:
+            print(f"Indexes {action}: {', '.join(changes[action])}")
+    return changes
+
+
+def ensure_indexes_background() -> None:
+    """Run ensure_indexes() once per process in a daemon thread."""
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+
+    def run():
+        try:
+            ensure_indexes()
+        except Exception as e:
+            print(f"Index build failed: {e}")
+
+    threading.Thread(target=run, name="ensure-indexes", daemon=True).start()
+
+
+def index_usage(collection: str) -> List[Dict[str, Any]]:
+    """$indexStats of a collection: name, key, ops since the counter started."""
+    stats = db.get_database()[collection].aggregate([{"$indexStats": {}}])
+    return [
+        {
+            "name": s["name"],
+            "key": dict(s["key"]),
+            "ops": s["accesses"]["ops"],
+            "since": s["accesses"]["since"],
+        }
+        for s in stats
+    ]
+
+
+def unused_indexes(min_age_days: float) -> List[Dict[str, Any]]:
+    """Undeclared indexes with no recorded use for at least `min_age_days`."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=min_age_days)
+    result = []
+    for collection in db.get_database().list_collection_names():
+        declared = set(declared_names(collection)) | {"_id_"}
+        for usage in index_usage(collection):
+            since = usage["since"]
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            if usage["name"] not in declared and usage["ops"] == 0 and since <= cutoff:
+                result.append({"collection": collection, **usage})
+    return result
+
+
+def dedupe_species(dry_run: bool = False) -> int:
+    """Delete duplicate species rows (same quest, image and name), keeping the newest."""
+    col = db.get_species_collection()
+    groups = col.aggregate(
+        [
+            {"$group": {
+                "_id": {"q": "$quest_id", "i": "$observation_image", "s": "$scientific_name"},
+                "ids": {"$push": "$_id"},
+                "n": {"$sum": 1},
+            }},
+            {"$match": {"n": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
+    )
+    to_delete = []
+    for group in groups:
+        to_delete.extend(sorted(group["ids"])[:-1])
+    if to_delete and not dry_run:
+        for start in range(0, len(to_delete), 1000):
+            col.delete_many({"_id": {"$in": to_delete[start:start + 1000]}})
+    return len(to_delete)
+
+
+def print_status() -> None:
+    database = db.get_database()
+    for collection in sorted(set(INDEXES) | set(database.list_collection_names())):
+        if collection not in database.list_collection_names():
+            print(f"{collection}: (collection does not exist yet)")
+            continue
+        declared = set(declared_names(collection))
+        usage = {u["name"]: u for u in index_usage(collection)}
+        print(f"{collection}:")
+        for name in sorted(declared | set(usage)):
+            u = usage.get(name)
+            if u is None:
+                state = "MISSING"
+            elif name in declared or name == "_id_":
+                state = "declared" if name != "_id_" else "default"
+            elif name in DEPRECATED.get(collection, {}):
+                state = "deprecated"
+            else:
+                state = "undeclared"
+            ops = f"{u['ops']} ops since {u['since']:%Y-%m-%d}" if u else ""
+            print(f"  {name:<56} {state:<11} {ops}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the MongoDB indexes of BITZ")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("ensure", help="Create declared indexes and drop deprecated ones")
+    sub.add_parser("status", help="Declared, missing and undeclared indexes with their usage")
+    unused = sub.add_parser("unused", help="Undeclared indexes $indexStats reports as unused")
+    unused.add_argument("--min-age-days", type=float, default=7,
+                        help="Only indexes whose usage counter is at least this old (default: 7)")
+    unused.add_argument("--drop", action="store_true", help="Drop them")
+    dedupe = sub.add_parser("dedupe-species", help="Remove duplicate species rows before the unique index")
+    dedupe.add_argument("--dry-run", action="store_true", help="Only count duplicates")
+    args = parser.parse_args()
+
+    try:
+        db.get_client()
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+
+    if args.action == "ensure":
+        changes = ensure_indexes()
+        if changes["failed"]:
+            sys.exit(1)
+        if not changes["created"] and not changes["dropped"]:
+            print("All declared indexes exist.")
+    elif args.action == "status":
+        print_status()
+    elif args.action == "unused":
+        rows = unused_indexes(args.min_age_days)
+        if not rows:
+            print("No unused undeclared indexes.")
+        for row in rows:
+            print(f"{row['collection']}.{row['name']} {row['key']} unused since {row['since']:%Y-%m-%d}")
+            if args.drop:
+                db.get_database()[row["collection"]].drop_index(row["name"])
+                print("  dropped")
+    elif args.action == "dedupe-species":
+        n = dedupe_species(args.dry_run)
+        print(f"{'Found' if args.dry_run else 'Deleted'} {n} duplicate species rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Durable background job queue stored in MongoDB (the `jobs` collection).
+
+Web workers only enqueue; job_worker.py claims and runs the jobs with bounded
+concurrency. A job is identified by (type, quest_id, image), so enqueuing the
+same image twice is a no-op. Failed jobs are retried with exponential backoff
+up to JOB_MAX_ATTEMPTS. A running job holds a lease; if its worker dies (e.g.
+the container is recycled mid-call) the lease expires and another worker
+picks the job up again.
+
+Job lifecycle:  pending -> running -> done
+                              |
+                              +--> pending (retry, run_at in the future;
+                              |             deferred by the rate limiter)
+                              +--> failed  (attempts exhausted)
+"""
+
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import db
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "10"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "900"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+IDENTIFY_SPECIES = "identify_species"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with jitter for the given number of attempts made."""
+    delay = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def enqueue(
+    job_type: str,
+    quest_id: str,
+    image: str,
+    payload: Dict[str, Any],
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+    delay_seconds: float = 0,
+) -> bool:
+    """
+    Add a job unless one already exists for (job_type, quest_id, image).
+    `delay_seconds` postpones the first run.
+
+    Returns:
+        True if the job is queued (newly or already), False if MongoDB failed.
+    """
+    now = _now()
+    try:
+        db.get_jobs_collection().update_one(
+            {"type": job_type, "quest_id": quest_id, "image": image},
+            {
+                "$setOnInsert": {
+                    "payload": payload,
+                    "status": PENDING,
+                    "attempts": 0,
+                    "max_attempts": max_attempts,
+                    "run_at": now + timedelta(seconds=delay_seconds),
+                    "created_at": now,
+                    "updated_at": now,
+                }
+            },
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # Two concurrent upserts for the same key: the other one won
+        return True
+    except Exception as e:
+        print(f"Error enqueuing {job_type} job for {quest_id}/{image}: {e}")
+        return False
+
+
+def claim(worker_id: str, job_types: List[str]) -> Optional[Dict[str, Any]]:
+    """Atomically take the next due job (or one whose lease expired)."""
+    now = _now()
+    return db.get_jobs_collection().find_one_and_update(
+        {
+            "type": {"$in": job_types},
+            "$or": [
+                {"status": PENDING, "run_at": {"$lte": now}},
+                {"status": RUNNING, "lease_until": {"$lt": now}},
+            ],
+        },
+        {
+            "$set": {
+                "status": RUNNING,
+                "worker": worker_id,
+                "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("run_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def complete(job: Dict[str, Any]) -> None:
+    now = _now()
+    db.get_jobs_collection().update_one(
+        {"_id": job["_id"], "worker": job.get("worker")},
+        {
+            "$set": {"status": DONE, "updated_at": now, "finished_at": now},
+            "$unset": {"lease_until": "", "last_error": ""},
+        },
+    )
+
+
+def fail(job: Dict[str, Any], error: str) -> str:
+    """Schedule a retry, or mark the job failed once attempts are exhausted. Returns the new status."""
+    now = _now()
+    attempts = job.get("attempts", 1)
+    update: Dict[str, Any] = {"last_error": error[:1000], "updated_at": now}
+    if attempts >= job.get("max_attempts", JOB_MAX_ATTEMPTS):
+        update.update({"status": FAILED, "finished_at": now})
+    else:
+        update.update({"status": PENDING, "run_at": now + timedelta(seconds=backoff_seconds(attempts))})
+    db.get_jobs_collection().update_one(
+        {"_id": job["_id"], "worker": job.get("worker")},
+        {"$set": update, "$unset": {"lease_until": ""}},
+    )
+    return update["status"]
+
+
+def defer(job: Dict[str, Any], delay_seconds: float, reason: str) -> None:
+    """Put a job back without counting the attempt (e.g. refused by the rate limiter)."""
+    now = _now()
+    db.get_jobs_collection().update_one(
+        {"_id": job["_id"], "worker": job.get("worker")},
+        {
+            "$set": {
+                "status": PENDING,
+                "run_at": now + timedelta(seconds=delay_seconds * random.uniform(1.0, 1.2)),
+                "last_error": reason[:1000],
+                "updated_at": now,
+            },
+            "$inc": {"attempts": -1},
+            "$unset": {"lease_until": ""},
+        },
+    )
+
+
+def cancel(job_type: str, quest_id: str, image: str) -> bool:
+    """
+    Drop the job of (job_type, quest_id, image) unless a worker is running it,
+    so the key can be enqueued again for a new file. Returns whether one was removed.
+    """
+    try:
+        result = db.get_jobs_collection().delete_one(
+            {"type": job_type, "quest_id": quest_id, "image": image, "status": {"$ne": RUNNING}}
+        )
+        return result.deleted_count > 0
+    except Exception as e:
+        print(f"Error cancelling {job_type} job for {quest_id}/{image}: {e}")
+        return False
+
+
+def quest_status(quest_id: str, job_type: str = IDENTIFY_SPECIES) -> Dict[str, Any]:
+    """Per-image job states of a quest, for client polling."""
+    try:
+        docs = list(
+            db.get_jobs_collection()
+            .find(
+                {"type": job_type, "quest_id": quest_id},
+                {"_id": 0, "image": 1, "status": 1, "attempts": 1, "last_error": 1, "run_at": 1},
+            )
+            .sort("created_at", 1)
+        )
+    except Exception as e:
+        print(f"Error loading job status: {e}")
+        return {"quest_id": quest_id, "error": str(e)}
+
+    counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+    for doc in docs:
+        counts[doc["status"]] = counts.get(doc["status"], 0) + 1
+        if doc.get("run_at"):
+            doc["run_at"] = doc["run_at"].isoformat()
+
+    return {
+        "quest_id": quest_id,
+        "counts": counts,
+        "complete": counts[PENDING] == 0 and counts[RUNNING] == 0,
+        "jobs": docs,
+    }
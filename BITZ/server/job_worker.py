@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Background worker for the MongoDB job queue (see job_queue.py).
+
+Runs JOB_WORKER_CONCURRENCY threads that claim due jobs, execute them and
+record the outcome (done, retry with backoff, or failed). Jobs refused by
+the shared LLM rate limiter are deferred without using up an attempt. Stops
+gracefully on SIGTERM/SIGINT: running jobs finish, no new job is claimed. A
+job cut off by a hard kill is retried once its lease expires.
+
+Usage:
+    python job_worker.py [--concurrency N] [--poll-interval SECONDS]
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+from typing import Any, Callable, Dict
+
+import db
+import indexes
+import job_queue
+import oaak_classify
+import rate_limiter
+
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+
+
+# -----------------------------------------------------------------------
+# Handlers
+# -----------------------------------------------------------------------
+
+def run_identify_species(job: Dict[str, Any]) -> None:
+    payload = job["payload"]
+    oaak_classify.identify_and_populate(
+        payload["image_path"],
+        job["quest_id"],
+        payload.get("history_directory", "./history"),
+        payload.get("image_coordinates"),
+        language=oaak_classify.IDENTIFY_LANGUAGE,
+    )
+
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], None]] = {
+    job_queue.IDENTIFY_SPECIES: run_identify_species,
+}
+
+
+# -----------------------------------------------------------------------
+# Worker
+# -----------------------------------------------------------------------
+
+class Worker:
+    def __init__(self, concurrency: int = JOB_WORKER_CONCURRENCY, poll_interval: float = JOB_POLL_INTERVAL):
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stop_event = threading.Event()
+
+    def run(self) -> None:
+        threads = [
+            threading.Thread(target=self._loop, args=(i,), name=f"job-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def stop(self, *_args) -> None:
+        print("Stopping: finishing running jobs …")
+        self.stop_event.set()
+
+    def _loop(self, slot: int) -> None:
+        worker_id = f"{self.worker_id}/{slot}"
+        while not self.stop_event.is_set():
+            try:
+                job = job_queue.claim(worker_id, list(HANDLERS))
+            except Exception as e:
+                print(f"[{worker_id}] claim failed: {e}")
+                self.stop_event.wait(self.poll_interval * 5)
+                continue
+
+            if job is None:
+                self.stop_event.wait(self.poll_interval)
+                continue
+
+            self._execute(worker_id, job)
+
+    def _execute(self, worker_id: str, job: Dict[str, Any]) -> None:
+        label = f"{job['type']} {job['quest_id']}/{job['image']} (attempt {job['attempts']})"
+        print(f"[{worker_id}] running {label}")
+        try:
+            HANDLERS[job["type"]](job)
+        except rate_limiter.LimitExceeded as e:
+            # Interactive traffic or the daily budget comes first; not a failure
+            job_queue.defer(job, e.retry_after, f"{type(e).__name__}: {e}")
+            print(f"[{worker_id}] {label} → deferred {e.retry_after}s: {e}")
+            return
+        except Exception as e:
+            status = job_queue.fail(job, f"{type(e).__name__}: {e}")
+            print(f"[{worker_id}] {label} → {status}: {e}")
+            traceback.print_exc()
+            return
+        job_queue.complete(job)
+        print(f"[{worker_id}] {label} → done")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background jobs from the MongoDB queue")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY,
+                        help=f"Jobs run in parallel (default: {JOB_WORKER_CONCURRENCY})")
+    parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL,
+                        help=f"Seconds between polls when idle (default: {JOB_POLL_INTERVAL})")
+    args = parser.parse_args()
+
+    try:
+        db.get_client().admin.command("ping")
+    except Exception as e:
+        print(f"Connection failed: {e}")
+        sys.exit(1)
+    indexes.ensure_indexes_background()
+
+    worker = Worker(args.concurrency, args.poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+
+    print(f"Job worker {worker.worker_id} started ({worker.concurrency} slots)")
+    worker.run()
+    print("Job worker stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Process-wide registry of pooled LLM clients.
+
+Creating an OpenAI / ChatOpenAI client per request or per session pays the
+client setup and opens a fresh HTTP connection pool every time. All call sites
+get their clients from here instead: one OpenAI client per API key and one
+ChatOpenAI per model, all sharing a single keep-alive httpx connection pool.
+
+Configuration (environment):
+    LLM_TIMEOUT            read/write timeout in seconds (default 60)
+    LLM_CONNECT_TIMEOUT    connect timeout in seconds (default 10)
+    LLM_MAX_RETRIES        SDK retries on connection errors / 429 / 5xx (default 2)
+    LLM_MAX_CONNECTIONS    pool size per process (default 20)
+    LLM_MAX_KEEPALIVE      idle keep-alive connections kept (default 10)
+    LLM_KEEPALIVE_EXPIRY   seconds an idle connection is kept (default 60)
+    OPENAI_BASE_URL        read by the SDKs, e.g. to target a local stub server
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+import httpx
+from langchain_openai import ChatOpenAI
+from openai import OpenAI
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+
+_lock = threading.Lock()
+_http_client: Optional[httpx.Client] = None
+_openai_clients: Dict[str, OpenAI] = {}
+_chat_models: Dict[str, ChatOpenAI] = {}
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def get_http_client() -> httpx.Client:
+    """The shared keep-alive connection pool (httpx.Client is thread-safe)."""
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    timeout=_timeout(),
+                    limits=httpx.Limits(
+                        max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                    ),
+                )
+    return _http_client
+
+
+def get_openai_client(api_key: Optional[str] = None) -> OpenAI:
+    """Shared OpenAI client for `api_key` (default: OPENAI_API_KEY)."""
+    key = api_key or os.getenv("OPENAI_API_KEY") or ""
+    client = _openai_clients.get(key)
+    if client is None:
+        http_client = get_http_client()
+        with _lock:
+            client = _openai_clients.get(key)
+            if client is None:
+                client = OpenAI(
+                    api_key=key or None,
+                    http_client=http_client,
+                    timeout=_timeout(),
+                    max_retries=LLM_MAX_RETRIES,
+                )
+                _openai_clients[key] = client
+    return client
+
+
+def get_chat_model(model_name: str = "gpt-5.2") -> ChatOpenAI:
+    """Shared LangChain chat model for `model_name`."""
+    model = _chat_models.get(model_name)
+    if model is None:
+        http_client = get_http_client()
+        with _lock:
+            model = _chat_models.get(model_name)
+            if model is None:
+                model = ChatOpenAI(
+                    model=model_name,
+                    http_client=http_client,
+                    timeout=_timeout(),
+                    max_retries=LLM_MAX_RETRIES,
+                )
+                _chat_models[model_name] = model
+    return model
+
+
+def reset():
+    """Drop all clients; pooled sockets must not be shared with a forked child."""
+    global _http_client, _lock
+    _lock = threading.Lock()
+    _http_client = None
+    _openai_clients.clear()
+    _chat_models.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset)
@@ -0,0 +1,157 @@
+"""
+Map points of every quest for GET /map/data, cached per process.
+
+The points come from db.get_map_quests, a single aggregation over quests
+joined with their located image observations and species names. Each
+quest becomes one compact entry: its center, and per located image the
+coordinates, thumbnail URL, time and species names.
+
+The cache is refreshed incrementally. At most every MAP_CACHE_REFRESH
+seconds a request asks MongoDB only for quests whose updated_at moved
+(db.save_quest and the species saves set it) and rebuilds those entries.
+Quests deleted by this process are evicted right away (forget). Every
+MAP_CACHE_FULL_REFRESH seconds the whole map is rebuilt, which also drops
+quests deleted through other workers. The serialized body and its ETag
+are only recomputed when an entry changed.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import db
+
+MAP_CACHE_REFRESH = float(os.getenv("MAP_CACHE_REFRESH", "5"))
+MAP_CACHE_FULL_REFRESH = float(os.getenv("MAP_CACHE_FULL_REFRESH", "300"))
+# Writes from other workers may land with a slightly older updated_at than
+# the last one seen here; re-read that much history on each refresh
+_CLOCK_SLACK = timedelta(seconds=5)
+
+_lock = threading.Lock()
+_entries: Dict[str, Dict[str, Any]] = {}
+_last_seen = None        # newest updated_at read so far
+_last_refresh = 0.0      # monotonic time of the last incremental refresh
+_last_full: Optional[float] = None  # monotonic time of the last full rebuild
+_body: Optional[bytes] = None
+_etag: Optional[str] = None
+
+
+def lat_lng(value: Any) -> Optional[List[float]]:
+    """
+    [lat, lng] of a stored location: {"latitude", "longitude"}, a
+    {"coordinates": {...}} wrapper or a "lat,lng" string; None otherwise.
+    """
+    if isinstance(value, dict):
+        if "coordinates" in value:
+            return lat_lng(value["coordinates"])
+        lat, lng = value.get("latitude"), value.get("longitude")
+    elif isinstance(value, str) and "," in value:
+        lat, lng = value.split(",", 1)
+    else:
+        return None
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return [round(lat, 6), round(lng, 6)]
+
+
+def build_entry(quest: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Map entry of a quest returned by db.get_map_quests (None if nothing to place)."""
+    quest_id = quest["quest_id"]
+    species_by_image: Dict[str, List[List[str]]] = {}
+    for sp in quest.get("species", []):
+        species_by_image.setdefault(sp.get("observation_image", ""), []).append(
+            [sp.get("common_name", ""), sp.get("scientific_name", ""), sp.get("taxonomic_group", "")]
+        )
+
+    points = []
+    for obs in quest.get("observations", []):
+        position = lat_lng(obs.get("image_location"))
+        if position is None:
+            continue
+        image = obs["image_filename"]
+        points.append({
+            "lat": position[0],
+            "lng": position[1],
+            "thumb": f"/explore/images/{quest_id}/{image}?res=thumb",
+            "ts": obs.get("ts"),
+            "species": species_by_image.get(image, []),
+        })
+
+    center = lat_lng(quest.get("location")) or lat_lng(quest.get("coordinates"))
+    if not points and center is None:
+        return None
+    return {"id": quest_id, "center": center, "points": points}
+
+
+def _apply(quests: List[Dict[str, Any]], full: bool) -> bool:
+    """Merge fresh quests into the cache; returns whether anything changed."""
+    global _entries, _last_seen
+    fresh = {}
+    for quest in quests:
+        updated_at = quest.get("updated_at")
+        if updated_at is not None and (_last_seen is None or updated_at > _last_seen):
+            _last_seen = updated_at
+        fresh[quest["quest_id"]] = build_entry(quest)
+
+    if full:
+        entries = {qid: entry for qid, entry in fresh.items() if entry is not None}
+        changed = entries != _entries
+        _entries = entries
+        return changed
+
+    changed = False
+    for quest_id, entry in fresh.items():
+        if entry is None:
+            changed |= _entries.pop(quest_id, None) is not None
+        elif _entries.get(quest_id) != entry:
+            _entries[quest_id] = entry
+            changed = True
+    return changed
+
+
+def _serialize() -> None:
+    global _body, _etag
+    quests = [_entries[qid] for qid in sorted(_entries)]
+    _body = json.dumps({"quests": quests}, separators=(",", ":")).encode("utf-8")
+    _etag = hashlib.sha1(_body).hexdigest()
+
+
+def get() -> Tuple[bytes, str]:
+    """The map payload ({"quests": [...]}) as JSON bytes, with its ETag."""
+    global _last_seen, _last_refresh, _last_full
+    with _lock:
+        now = time.monotonic()
+        full = _last_full is None or now - _last_full >= MAP_CACHE_FULL_REFRESH
+        changed = False
+        # On a query error the cached map is kept and the timestamps are not
+        # advanced, so the next request retries
+        if full:
+            started = datetime.utcnow()  # naive UTC, like the datetimes pymongo returns
+            quests = db.get_map_quests()
+            if quests is not None:
+                changed = _apply(quests, full=True)
+                _last_seen = max(_last_seen, started) if _last_seen is not None else started
+                _last_full = _last_refresh = now
+        elif now - _last_refresh >= MAP_CACHE_REFRESH:
+            quests = db.get_map_quests(updated_since=_last_seen - _CLOCK_SLACK)
+            if quests is not None:
+                changed = _apply(quests, full=False)
+                _last_refresh = now
+        if changed or _body is None:
+            _serialize()
+        return _body, _etag
+
+
+def forget(quest_id: str) -> None:
+    """Drop a deleted quest from this process's cache."""
+    with _lock:
+        if _entries.pop(quest_id, None) is not None and _body is not None:
+            _serialize()
@@ -0,0 +1,236 @@
+"""
+Prometheus metrics for the BITZ server, exposed at GET /metrics.
+
+Requests: latency histogram per route and status, in-flight requests per
+route, and response sizes (see init_app). Inside a request, span() times the
+parts that dominate latency, labelled by kind:
+
+    mongo      db.py functions (decorated with @timed("mongo"))
+    llm        calls to the model (identify, analyze, answer, question, link_species)
+    ratelimit  time spent waiting for the shared LLM rate limiter
+    pil        image work (thumbnails in explore_images, vision preprocessing)
+
+record_tokens() counts the tokens of the analyzer's LLM calls: prompt and
+completion as reported by the provider, and the estimated size of the
+summary of older turns within the prompt (see prompt_context.py).
+
+MongoDB connection pool: PoolListener (registered by db.get_client) records
+how long requests wait to check out a connection, checkout failures (pool
+exhausted, timeouts) and the connections open and in use per process.
+
+gunicorn workers are separate processes; with PROMETHEUS_MULTIPROC_DIR set
+(gunicorn.conf.py sets it) every worker writes its samples to files in that
+directory and /metrics aggregates all of them, whichever worker answers.
+
+prometheus_client is optional: without it (or with METRICS_ENABLED=0)
+spans cost nothing and /metrics answers 501.
+"""
+
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:  # prometheus_client is optional
+    prometheus_client = None
+
+ENABLED = METRICS_ENABLED and prometheus_client is not None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(9))  # 256 B .. 16 MB
+
+if ENABLED:
+    REQUEST_LATENCY = Histogram(
+        "bitz_http_request_duration_seconds", "Request latency",
+        ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+    )
+    REQUESTS_IN_FLIGHT = Gauge(
+        "bitz_http_requests_in_flight", "Requests being served",
+        ["method", "route"], multiprocess_mode="livesum",
+    )
+    RESPONSE_SIZE = Histogram(
+        "bitz_http_response_size_bytes", "Response body size",
+        ["method", "route"], buckets=SIZE_BUCKETS,
+    )
+    SPAN_LATENCY = Histogram(
+        "bitz_span_duration_seconds", "Time spent in a part of a request (MongoDB, LLM, PIL, ...)",
+        ["kind", "name"], buckets=LATENCY_BUCKETS,
+    )
+    SPAN_ERRORS = Counter(
+        "bitz_span_errors_total", "Spans that raised",
+        ["kind", "name"],
+    )
+    LLM_TOKENS = Counter(
+        "bitz_llm_tokens_total", "Tokens of LLM calls (prompt, completion, summary of older turns)",
+        ["name", "kind"],
+    )
+    MONGO_POOL_WAIT = Histogram(
+        "bitz_mongo_pool_wait_seconds", "Time to check out a MongoDB connection from the pool",
+        buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    )
+    MONGO_POOL_CHECKOUT_FAILURES = Counter(
+        "bitz_mongo_pool_checkout_failures_total", "Failed connection checkouts",
+        ["reason"],
+    )
+    MONGO_POOL_CONNECTIONS = Gauge(
+        "bitz_mongo_pool_connections", "Open MongoDB connections",
+        multiprocess_mode="livesum",
+    )
+    MONGO_POOL_IN_USE = Gauge(
+        "bitz_mongo_pool_connections_in_use", "MongoDB connections checked out",
+        multiprocess_mode="livesum",
+    )
+
+
+@contextmanager
+def span(kind: str, name: str):
+    """Time the enclosed block as `kind`/`name`."""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        SPAN_ERRORS.labels(kind, name).inc()
+        raise
+    finally:
+        SPAN_LATENCY.labels(kind, name).observe(time.perf_counter() - start)
+
+
+def record_tokens(name: str, usage: Dict[str, int]) -> None:
+    """Count the tokens of LLM call `name` from a prompt_context.usage_report()."""
+    if not ENABLED:
+        return
+    for kind, key in (("prompt", "prompt_tokens"), ("completion", "completion_tokens"), ("summary", "summary_tokens")):
+        if usage.get(key):
+            LLM_TOKENS.labels(name, kind).inc(usage[key])
+
+
+def timed(kind: str, name: Optional[str] = None):
+    """Decorator form of span(); the name defaults to the function name."""
+    def decorator(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(kind, label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Connection pool metrics; callbacks only update counters."""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.labels(str(event.reason)).inc()
+        MONGO_POOL_WAIT.observe(event.duration)
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_IN_USE.inc()
+        MONGO_POOL_WAIT.observe(event.duration)
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_IN_USE.dec()
+
+
+def pool_listeners() -> list:
+    """Event listeners for the MongoClient (empty when metrics are disabled)."""
+    return [PoolListener()] if ENABLED else []
+
+
+def _route() -> str:
+    # The URL rule, not the path, so /quest_info?id=... and /explore/images/<path> stay one series each
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_route = _route()
+    REQUESTS_IN_FLIGHT.labels(request.method, g.metrics_route).inc()
+
+
+def _after_request(response):
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        route = g.metrics_route
+        REQUEST_LATENCY.labels(request.method, route, str(response.status_code)).observe(time.perf_counter() - start)
+        size = response.content_length
+        if size is not None:
+            RESPONSE_SIZE.labels(request.method, route).observe(size)
+    return response
+
+
+def _teardown_request(exc):
+    route = g.pop("metrics_route", None)
+    if route is None:
+        return
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        # after_request did not run: the view raised
+        REQUEST_LATENCY.labels(request.method, route, "500").observe(time.perf_counter() - start)
+    REQUESTS_IN_FLIGHT.labels(request.method, route).dec()
+
+
+def _registry():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
+
+
+def init_app(app) -> None:
+    """Install the request hooks and the /metrics route."""
+    if ENABLED:
+        app.before_request(_before_request)
+        app.after_request(_after_request)
+        app.teardown_request(_teardown_request)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        if not ENABLED:
+            return Response("metrics disabled (METRICS_ENABLED=0 or prometheus_client not installed)\n",
+                            status=501, mimetype="text/plain")
+        return Response(prometheus_client.generate_latest(_registry()),
+                        mimetype=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Called by gunicorn when a worker exits, so its live gauges are dropped."""
+    if ENABLED and os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
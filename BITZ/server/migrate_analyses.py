@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Convert the assistant responses of existing observations to the structured
+`analysis` subdocument (see db.analysis_fields).
+
+Older rows hold the analysis as text: JSON, or the Python repr that
+/analyze used to store. Each row is parsed once here, with the repairs of
+fix_python_literals.py as a fallback, and rewritten with `analysis` and
+`analysis_version`. Text that is not an analysis is kept in
+`assistant_response` with version 0, so no row is scanned twice.
+
+Usage:
+    python migrate_analyses.py              # dry-run (default)
+    python migrate_analyses.py --apply      # actually write
+"""
+
+import argparse
+import sys
+
+from pymongo import UpdateOne
+
+import db
+from fix_python_literals import try_fix
+
+
+def to_analysis(text):
+    analysis = db.parse_analysis(text)
+    if analysis is None and isinstance(text, str) and text.strip():
+        repaired = try_fix(text)
+        if repaired is not None:
+            analysis = db.parse_analysis(repaired)
+    return analysis
+
+
+def migrate(apply: bool = False, batch_size: int = 500, verbose: bool = False):
+    col = db.get_observations_collection()
+    query = {"analysis_version": {"$exists": False}}
+    total = col.count_documents(query)
+    print(f"{total} observations to convert …\n")
+
+    converted = 0
+    text_only = 0
+    written = 0
+    batch = []
+    for doc in col.find(query, {"assistant_response": 1, "quest_id": 1, "position": 1}, batch_size=batch_size):
+        text = doc.get("assistant_response", "")
+        analysis = to_analysis(text)
+        if analysis is not None:
+            converted += 1
+            update = {"$set": {"analysis": analysis, "analysis_version": db.ANALYSIS_SCHEMA_VERSION},
+                      "$unset": {"assistant_response": ""}}
+        else:
+            text_only += 1
+            if verbose and text:
+                print(f"  [{doc.get('quest_id', '?')} pos={doc.get('position', '?')}] kept as text")
+            update = {"$set": {"analysis_version": 0}}
+        batch.append(UpdateOne({"_id": doc["_id"]}, update))
+
+        if len(batch) >= batch_size:
+            if apply:
+                written += col.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch and apply:
+        written += col.bulk_write(batch, ordered=False).modified_count
+
+    print(f"{'=' * 60}")
+    print(f"Observations scanned : {total}")
+    print(f"Analyses converted   : {converted}")
+    print(f"Kept as text         : {text_only}")
+    if apply:
+        print(f"Written              : {written}")
+    elif total:
+        print("\nThis was a dry-run. Re-run with --apply to write changes.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Store the assistant responses of MongoDB observations as structured analyses",
+    )
+    parser.add_argument("--apply", action="store_true", help="Actually write (default is dry-run)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Updates per bulk write (default: 500)")
+    parser.add_argument("--verbose", action="store_true", help="List responses that stay as text")
+    args = parser.parse_args()
+
+    try:
+        db.get_client()
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+
+    migrate(apply=args.apply, batch_size=args.batch_size, verbose=args.verbose)
+
+
+if __name__ == "__main__":
+    main()
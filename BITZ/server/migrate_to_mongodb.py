@@ -9,17 +9,33 @@ This script:
 4. Optionally verifies the migration
 5. Provides detailed progress and error reporting
 
+Quests are processed in parallel by a pool of worker processes (--workers).
+Each quest is written with one unordered bulk_write per collection, with
+the same documents db.save_quest / save_observation / save_species_batch
+produce. Every finished quest is appended to a checkpoint file; a re-run
+skips the quests it lists unless their history.json or CSV changed since.
+
 Usage:
-    python migrate_to_mongodb.py [--dry-run] [--verify] [--history-dir PATH]
+    python migrate_to_mongodb.py [--dry-run] [--verify | --verify-only]
+                                 [--workers N] [--batch-size N]
+                                 [--checkpoint PATH] [--no-resume]
+                                 [--history-dir PATH]
 """
 
 import csv
 import json
 import os
 import sys
+import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import List, Dict, Any, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
 import db
+import indexes
 
 
 # -----------------------------------------------------------------------
@@ -70,65 +86,54 @@ def validate_history(data: Dict[str, Any], quest_id: str) -> Tuple[bool, str]:
 # Migration of a single quest
 # -----------------------------------------------------------------------
 
-def migrate_quest(
-    quest_id: str,
-    quest_dir: str,
-    dry_run: bool = False,
-) -> Tuple[bool, str]:
+def read_quest(quest_id: str, quest_dir: str) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
     """
-    Migrate one quest directory → MongoDB.
-
-    Reads:
-      - history.json        → quests + observations collections
-      - species_data_english.csv  → species collection
+    Read and validate history.json and the species CSV (optional) of a quest.
+    Raises ValueError with a readable message.
     """
     history_path = os.path.join(quest_dir, "history.json")
     csv_path = os.path.join(quest_dir, "species_data_english.csv")
 
-    # -- read & validate history.json ----------------------------------
     try:
         with open(history_path, "r", encoding="utf-8") as f:
             data = json.load(f)
     except json.JSONDecodeError as e:
-        return False, f"Invalid JSON: {e}"
+        raise ValueError(f"Invalid JSON: {e}")
     except Exception as e:
-        return False, f"Cannot read history.json: {e}"
+        raise ValueError(f"Cannot read history.json: {e}")
 
     ok, err = validate_history(data, quest_id)
     if not ok:
-        return False, f"Validation failed: {err}"
+        raise ValueError(f"Validation failed: {err}")
 
-    # -- read CSV (optional) -------------------------------------------
     species_rows: List[Dict[str, str]] = []
     if os.path.isfile(csv_path):
         try:
             with open(csv_path, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    species_rows.append(row)
+                species_rows = list(csv.DictReader(f))
         except Exception as e:
-            return False, f"Cannot read CSV: {e}"
+            raise ValueError(f"Cannot read CSV: {e}")
 
-    if dry_run:
-        obs_count = len(data.get("history", []))
-        sp_count = len(species_rows)
-        return True, f"Validated ({obs_count} observations, {sp_count} species)"
+    return data, species_rows
 
-    # -- write to MongoDB -----------------------------------------------
-    try:
-        # 1. Quest metadata
-        db.save_quest(
-            quest_id=quest_id,
-            user_id=data.get("user_id", ""),
-            flavor=data.get("flavor"),
-            coordinates=data.get("coordinates"),
-            location=data.get("location"),
-            timestamp=data.get("timestamp"),
-        )
 
-        # 2. Observations (one per history entry)
-        for i, entry in enumerate(data.get("history", [])):
-            db.save_observation(
+def quest_operations(quest_id: str, data: Dict[str, Any],
+                     species_rows: List[Dict[str, str]]) -> Dict[str, list]:
+    """Bulk write operations per collection for one quest (same documents as db.save_*)."""
+    quest_doc = db.quest_document(
+        quest_id=quest_id,
+        user_id=data.get("user_id", ""),
+        flavor=data.get("flavor"),
+        coordinates=data.get("coordinates"),
+        location=data.get("location"),
+        timestamp=data.get("timestamp"),
+    )
+    history = data.get("history", [])
+
+    observations: list = [
+        UpdateOne(
+            {"quest_id": quest_id, "position": i},
+            db.observation_update(
                 quest_id=quest_id,
                 position=i,
                 timestamp=entry.get("timestamp", ""),
@@ -136,31 +141,86 @@ def migrate_quest(
                 assistant_response=entry.get("assistant", ""),
                 image_filename=entry.get("image_filename"),
                 image_location=entry.get("image_location"),
-            )
-
-        # 3. Species (batch insert from CSV)
-        if species_rows:
-            batch = []
-            for row in species_rows:
-                batch.append({
-                    "quest_id": quest_id,
-                    "observation_image": row.get("image_name", ""),
-                    "taxonomic_group": row.get("taxonomic_group", ""),
-                    "scientific_name": row.get("scientific_name", ""),
-                    "common_name": row.get("common_name", ""),
-                    "confidence": row.get("confidence", ""),
-                    "notes": row.get("notes", ""),
-                    "latitude": row.get("latitude", ""),
-                    "longitude": row.get("longitude", ""),
-                })
-            db.save_species_batch(batch)
-
-        obs_count = len(data.get("history", []))
-        sp_count = len(species_rows)
-        return True, f"Migrated ({obs_count} observations, {sp_count} species)"
+            ),
+            upsert=True,
+        )
+        for i, entry in enumerate(history)
+    ]
+    # No deletes: MongoDB is the source of truth, observations added after a
+    # quest was first migrated have positions beyond history.json
+
+    species = []
+    for row in species_rows:
+        doc = {
+            "quest_id": quest_id,
+            "observation_image": row.get("image_name", ""),
+            "taxonomic_group": row.get("taxonomic_group", ""),
+            "scientific_name": row.get("scientific_name", ""),
+            "common_name": row.get("common_name", ""),
+            "confidence": row.get("confidence", ""),
+            "notes": row.get("notes", ""),
+            "latitude": row.get("latitude", ""),
+            "longitude": row.get("longitude", ""),
+        }
+        species.append(UpdateOne(
+            {"quest_id": quest_id, "observation_image": doc["observation_image"],
+             "scientific_name": doc["scientific_name"]},
+            {"$set": doc},
+            upsert=True,
+        ))
+
+    return {
+        "quests": [UpdateOne({"quest_id": quest_id}, {"$set": quest_doc}, upsert=True)],
+        # So the dashboard's size and activity sorts list the quest before reconcile
+        "quest_storage": [UpdateOne({"quest_id": quest_id},
+                                    {"$setOnInsert": db.empty_quest_storage(quest_id)}, upsert=True)],
+        "observations": observations,
+        "species": species,
+    }
+
+
+def migrate_quest(
+    quest_id: str,
+    quest_dir: str,
+    dry_run: bool = False,
+    batch_size: int = 1000,
+) -> Tuple[bool, str, int]:
+    """
+    Migrate one quest directory → MongoDB with one unordered bulk write per
+    collection (split in batches of `batch_size` operations).
+
+    Reads:
+      - history.json        → quests + observations collections
+      - species_data_english.csv  → species collection
+
+    Returns (success, message, documents written).
+    """
+    try:
+        data, species_rows = read_quest(quest_id, quest_dir)
+    except ValueError as e:
+        return False, str(e), 0
+
+    obs_count = len(data.get("history", []))
+    sp_count = len(species_rows)
+    if dry_run:
+        return True, f"Validated ({obs_count} observations, {sp_count} species)", 0
 
+    # Observations first and the quest last, so a quest only shows up once
+    # its observations are in place
+    operations = quest_operations(quest_id, data, species_rows)
+    database = db.get_database()
+    try:
+        for collection in ("observations", "species", "quest_storage", "quests"):
+            ops = operations[collection]
+            for start in range(0, len(ops), batch_size):
+                database[collection].bulk_write(ops[start:start + batch_size], ordered=False)
+    except BulkWriteError as e:
+        first = e.details.get("writeErrors", [{}])[0]
+        return False, f"Write error: {first.get('errmsg', e)}", 0
     except Exception as e:
-        return False, f"Write error: {e}"
+        return False, f"Write error: {e}", 0
+
+    return True, f"Migrated ({obs_count} observations, {sp_count} species)", 1 + obs_count + sp_count
 
 
 # -----------------------------------------------------------------------
@@ -168,7 +228,11 @@ def migrate_quest(
 # -----------------------------------------------------------------------
 
 def verify_quest(quest_id: str, quest_dir: str) -> Tuple[bool, str]:
-    """Verify a migrated quest against the original files."""
+    """
+    Verify a migrated quest against the original files. MongoDB is the source
+    of truth and may have gained observations, species or a geocoded location
+    since the files were written, so it must hold at least what the files do.
+    """
     issues = []
 
     # -- check quest metadata ------------------------------------------
@@ -183,14 +247,14 @@ def verify_quest(quest_id: str, quest_dir: str) -> Tuple[bool, str]:
     for field in ("flavor", "user_id", "coordinates", "location"):
         orig_val = orig.get(field)
         db_val = quest.get(field)
-        if orig_val != db_val:
+        if orig_val != db_val and orig_val not in (None, ""):
             issues.append(f"quest.{field}: {orig_val!r} != {db_val!r}")
 
     # -- check observation count ---------------------------------------
     orig_obs = len(orig.get("history", []))
     db_obs = db.count_observations(quest_id)
-    if orig_obs != db_obs:
-        issues.append(f"observation count: {orig_obs} != {db_obs}")
+    if db_obs < orig_obs:
+        issues.append(f"observation count: {orig_obs} > {db_obs}")
 
     # -- check species count -------------------------------------------
     csv_path = os.path.join(quest_dir, "species_data_english.csv")
@@ -200,38 +264,119 @@ def verify_quest(quest_id: str, quest_dir: str) -> Tuple[bool, str]:
             next(reader, None)  # skip header
             orig_sp = sum(1 for _ in reader)
         db_sp = db.count_species(quest_id)
-        if orig_sp != db_sp:
-            issues.append(f"species count: {orig_sp} != {db_sp}")
+        if db_sp < orig_sp:
+            issues.append(f"species count: {orig_sp} > {db_sp}")
 
     if issues:
         return False, "; ".join(issues)
     return True, "Verification passed"
 
 
+# -----------------------------------------------------------------------
+# Checkpoints
+# -----------------------------------------------------------------------
+
+def source_mtimes(quest_dir: str) -> List[float]:
+    """Modification times of history.json and the species CSV (0 if absent)."""
+    mtimes = []
+    for name in ("history.json", "species_data_english.csv"):
+        try:
+            mtimes.append(os.path.getmtime(os.path.join(quest_dir, name)))
+        except OSError:
+            mtimes.append(0)
+    return mtimes
+
+
+def load_checkpoint(path: str) -> Dict[str, List[float]]:
+    """
+    quest_id → source mtimes of the quests migrated by earlier runs.
+    The checkpoint is a JSON-lines file appended to after each quest, so an
+    interrupted run loses at most the quests that were in flight.
+    """
+    done: Dict[str, List[float]] = {}
+    if not os.path.isfile(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # truncated last line of an interrupted run
+            if entry.get("status") == "ok":
+                done[entry["quest_id"]] = entry.get("mtimes")
+            else:
+                done.pop(entry.get("quest_id"), None)
+    return done
+
+
+# -----------------------------------------------------------------------
+# Worker
+# -----------------------------------------------------------------------
+
+def process_quest(quest_id: str, quest_dir: str, dry_run: bool, verify: bool,
+                  verify_only: bool, batch_size: int) -> Dict[str, Any]:
+    """Migrate and/or verify one quest; runs in a worker process."""
+    started = time.monotonic()
+    result: Dict[str, Any] = {
+        "quest_id": quest_id,
+        "mtimes": source_mtimes(quest_dir),
+        "ok": True,
+        "msg": "",
+        "docs": 0,
+        "verify": None,
+    }
+    try:
+        if not verify_only:
+            result["ok"], result["msg"], result["docs"] = migrate_quest(quest_id, quest_dir, dry_run, batch_size)
+        if result["ok"] and (verify or verify_only) and not dry_run:
+            result["verify"] = verify_quest(quest_id, quest_dir)
+    except Exception as e:
+        result["ok"], result["msg"] = False, f"Unexpected error: {e}"
+    result["seconds"] = time.monotonic() - started
+    return result
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
 # -----------------------------------------------------------------------
 # Main
 # -----------------------------------------------------------------------
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Migrate quest data from JSON/CSV files to MongoDB",
+        description="Migrate JSON/CSV quest data to MongoDB",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
   python migrate_to_mongodb.py --dry-run
   python migrate_to_mongodb.py
-  python migrate_to_mongodb.py --verify
-  python migrate_to_mongodb.py --history-dir /path/to/history
+  python migrate_to_mongodb.py --verify --workers 8
+  python migrate_to_mongodb.py --verify-only
+  python migrate_to_mongodb.py --history-dir /path/to/history --no-resume
         """,
     )
     parser.add_argument("--dry-run", action="store_true",
                         help="Validate without writing to MongoDB")
     parser.add_argument("--verify", action="store_true",
                         help="Verify data after migration")
+    parser.add_argument("--verify-only", action="store_true",
+                        help="Only verify quests already in MongoDB")
     parser.add_argument("--history-dir", type=str, default="./history",
                         help="Path to history directory (default: ./history)")
     parser.add_argument("--skip-existing", action="store_true",
                         help="Skip quests already present in MongoDB")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: number of CPUs)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="Operations per bulk write (default: 1000)")
+    parser.add_argument("--checkpoint", type=str, default="migrate_checkpoint.jsonl",
+                        help="Progress file used to resume (default: migrate_checkpoint.jsonl)")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Ignore the checkpoint and migrate every quest again")
 
     args = parser.parse_args()
 
@@ -253,57 +398,114 @@ Examples:
         print("Check your MONGO_URI in .env")
         sys.exit(1)
 
+    writing = not (args.dry_run or args.verify_only)
+    if writing:
+        indexes.ensure_indexes()
+
     # -- discover quests ------------------------------------------------
     print(f"Scanning {args.history_dir} ...")
     quest_dirs = find_quest_dirs(args.history_dir)
     if not quest_dirs:
         print("No quest directories found.")
         sys.exit(0)
-    print(f"Found {len(quest_dirs)} quest(s)\n")
+    print(f"Found {len(quest_dirs)} quest(s)")
+
+    skip_count = 0
+    if writing and args.skip_existing:
+        existing = set(db.get_all_quest_ids())
+        pending = [(qid, qdir) for qid, qdir in quest_dirs if qid not in existing]
+        skip_count += len(quest_dirs) - len(pending)
+        quest_dirs = pending
+
+    checkpoint = None
+    if writing:
+        done = {} if args.no_resume else load_checkpoint(args.checkpoint)
+        # A quest whose files changed since it was migrated is migrated again
+        pending = [(qid, qdir) for qid, qdir in quest_dirs if done.get(qid) != source_mtimes(qdir)]
+        skip_count += len(quest_dirs) - len(pending)
+        quest_dirs = pending
+        checkpoint = open(args.checkpoint, "w" if args.no_resume else "a", encoding="utf-8")
+
+    if skip_count:
+        print(f"Skipping {skip_count} quest(s) already migrated")
+    print(f"Processing {len(quest_dirs)} quest(s) with {args.workers} worker(s)\n")
 
     # -- process --------------------------------------------------------
     ok_count = 0
     fail_count = 0
-    skip_count = 0
+    verify_fail_count = 0
+    docs_total = 0
     errors: List[Tuple[str, str]] = []
+    started = time.monotonic()
 
-    for i, (quest_id, quest_dir) in enumerate(quest_dirs, 1):
-        print(f"[{i}/{len(quest_dirs)}] {quest_id} ", end="")
-
-        # skip-existing check
-        if not args.dry_run and args.skip_existing:
-            if db.load_quest(quest_id):
-                print("SKIPPED (exists)")
-                skip_count += 1
-                continue
-
-        success, msg = migrate_quest(quest_id, quest_dir, args.dry_run)
-
-        if success:
-            print(f"✓ {msg}")
-            ok_count += 1
-
-            if args.verify and not args.dry_run:
-                v_ok, v_msg = verify_quest(quest_id, quest_dir)
-                if v_ok:
-                    print(f"  ✓ {v_msg}")
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = [
+                pool.submit(process_quest, quest_id, quest_dir, args.dry_run, args.verify,
+                            args.verify_only, args.batch_size)
+                for quest_id, quest_dir in quest_dirs
+            ]
+            for i, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                quest_id = result["quest_id"]
+                elapsed = time.monotonic() - started
+                rate = i / elapsed if elapsed else 0.0
+                eta = (len(quest_dirs) - i) / rate if rate else 0.0
+                progress = f"[{i}/{len(quest_dirs)} {rate:.1f} q/s ETA {format_duration(eta)}] {quest_id}"
+
+                if result["ok"]:
+                    ok_count += 1
+                    docs_total += result["docs"]
+                    if result["msg"]:
+                        print(f"{progress} ✓ {result['msg']} ({result['seconds']:.2f}s)")
+                    else:
+                        print(progress)
                 else:
-                    print(f"  ✗ {v_msg}")
-                    errors.append((quest_id, f"Verify: {v_msg}"))
-        else:
-            print(f"✗ {msg}")
-            fail_count += 1
-            errors.append((quest_id, msg))
+                    fail_count += 1
+                    errors.append((quest_id, result["msg"]))
+                    print(f"{progress} ✗ {result['msg']}")
+
+                if result["verify"] is not None:
+                    v_ok, v_msg = result["verify"]
+                    if v_ok:
+                        print(f"  ✓ {v_msg}")
+                    else:
+                        print(f"  ✗ {v_msg}")
+                        verify_fail_count += 1
+                        errors.append((quest_id, f"Verify: {v_msg}"))
+
+                if checkpoint is not None:
+                    # A quest that failed verification is migrated again next run
+                    verified = result["verify"] is None or result["verify"][0]
+                    checkpoint.write(json.dumps({
+                        "quest_id": quest_id,
+                        "mtimes": result["mtimes"],
+                        "status": "ok" if result["ok"] and verified else "failed",
+                    }) + "\n")
+                    checkpoint.flush()
+    except KeyboardInterrupt:
+        print("\nInterrupted — re-run the same command to resume from the checkpoint.")
+        sys.exit(130)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    elapsed = time.monotonic() - started
 
     # -- summary --------------------------------------------------------
     print()
     print("=" * 70)
     print("Summary")
     print("=" * 70)
-    print(f"Total:    {len(quest_dirs)}")
+    print(f"Total:    {len(quest_dirs) + skip_count}")
     print(f"Success:  {ok_count}")
     print(f"Failed:   {fail_count}")
     print(f"Skipped:  {skip_count}")
+    if args.verify or args.verify_only:
+        print(f"Verify:   {ok_count - verify_fail_count} passed, {verify_fail_count} failed")
+    print(f"Elapsed:  {format_duration(elapsed)}")
+    if elapsed:
+        print(f"Rate:     {len(quest_dirs) / elapsed:.1f} quests/s, {docs_total / elapsed:.0f} documents/s")
 
     if errors:
         print("\nErrors:")
@@ -312,10 +514,10 @@ Examples:
 
     if args.dry_run:
         print("\nDry run — nothing was written. Re-run without --dry-run.")
-    elif ok_count > 0:
+    elif ok_count > 0 and not args.verify_only:
         print("\nMigration complete!")
 
-    sys.exit(1 if fail_count else 0)
+    sys.exit(1 if fail_count or verify_fail_count else 0)
 
 
 if __name__ == "__main__":
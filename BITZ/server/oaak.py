@@ -1,28 +1,26 @@
 import os
 import base64
 import json
+import shutil
 import time
 
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_openai import ChatOpenAI
 
+import image_handler
 import oaak_classify
 import threading
 import db
+import job_queue
+import llm_clients
+import storage_stats
 
-class ModelSingleton:
-    _instance = None
-    _model_name = None
-
-    @classmethod
-    def get_instance(cls, model_name="gpt-5.2"):
-        if cls._instance is None:
-            cls._model_name = model_name
-            cls._instance = ChatOpenAI(model=model_name)
-        return cls._instance
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "1") == "1"
+# /analyze identifies the same image synchronously; starting the background job a
+# bit later lets it reuse that result from the identification cache
+IDENTIFY_JOB_DELAY = float(os.getenv("IDENTIFY_JOB_DELAY", "20"))
 
 def get_model(model_name="gpt-5.2"):
-    return ModelSingleton.get_instance(model_name)
+    return llm_clients.get_chat_model(model_name)
 
 def save_conversation(flavor, coordinates, location_name, conversation_id, user_id, history, history_directory="./history"):
     """Save conversation history to MongoDB."""
@@ -36,39 +34,105 @@ def save_conversation(flavor, coordinates, location_name, conversation_id, user_
         history=history
     )
 
-def load_conversation(conversation_id, history_directory="./history"):
-    """Load conversation history from MongoDB if it exists."""
-    return db.load_conversation(conversation_id)
+def load_conversation(conversation_id, history_directory="./history", structured=False):
+    """Load conversation history from MongoDB if it exists (see db.load_conversation for `structured`)."""
+    return db.load_conversation(conversation_id, structured=structured)
 
-def save_image(image_b64, conversation_id, history_length, history_directory):
-    history_data_dir = os.path.join(history_directory, "images")
-    convo_dir = os.path.join(history_data_dir, conversation_id)
-    
+def get_image_path(conversation_id, history_length, history_directory):
     image_filename = f"{history_length}_image.jpg"
-    image_path = os.path.join(convo_dir, image_filename)
-    image_data = base64.b64decode(image_b64)
-
+    image_path = os.path.join(history_directory, "images", conversation_id, image_filename)
     os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    return image_path
+
+def save_image(image_b64, conversation_id, history_length, history_directory):
+    """Decode a base64 upload and write it to disk; returns (path, raw bytes)."""
+    image_path = get_image_path(conversation_id, history_length, history_directory)
+    image_data = base64.b64decode(image_b64)
+    previous_size = storage_stats.file_size(image_path)
 
     with open(image_path, "wb") as img_file:
         img_file.write(image_data)
+    storage_stats.file_written(conversation_id, storage_stats.IMAGES, image_path, previous_size)
+
+    return image_path, image_data
+
+def save_image_stream(stream, conversation_id, history_length, history_directory, chunk_size=64 * 1024):
+    """Write a binary upload (e.g. a multipart file) to disk chunk by chunk; returns the path."""
+    image_path = get_image_path(conversation_id, history_length, history_directory)
+    previous_size = storage_stats.file_size(image_path)
+
+    with open(image_path, "wb") as img_file:
+        shutil.copyfileobj(stream, img_file, chunk_size)
+    storage_stats.file_written(conversation_id, storage_stats.IMAGES, image_path, previous_size)
 
     return image_path
 
-def extract_species_from_images(image_path, conversation_id, history_directory, image_coordinates):
+def extract_species_from_images(image_path, conversation_id, history_directory, image_coordinates, image_b64=None):
+    """
+    Queue species identification for an uploaded image (run by job_worker.py).
+    Falls back to an in-process thread when the queue is disabled
+    (JOB_QUEUE_ENABLED=0) or MongoDB cannot take the job.
+    """
+    if JOB_QUEUE_ENABLED and job_queue.enqueue(
+        job_queue.IDENTIFY_SPECIES,
+        conversation_id,
+        os.path.basename(image_path),
+        {
+            "image_path": image_path,
+            "history_directory": history_directory,
+            "image_coordinates": image_coordinates,
+        },
+        delay_seconds=IDENTIFY_JOB_DELAY,
+    ):
+        return
+
     # run this in parallel to avoid slowing down
     classify_thread = threading.Thread(
         target=oaak_classify.identify_and_populate,
         args=(image_path, conversation_id, history_directory, image_coordinates),
+        kwargs={"image_b64": image_b64},
         daemon=True  # Ensures the thread is killed if the main program exits
     )
     classify_thread.start()
 
-def process_image(image_b64, conversation_id, history_length, image_coordinates, history_directory="./history"):
-    """Processes and saves an uploaded image."""
-    image_path = save_image(image_b64, conversation_id, history_length, history_directory)
-    extract_species_from_images(image_path, conversation_id, history_directory, image_coordinates)
-    return image_path
+def discard_image(image_path, conversation_id):
+    """
+    Undo process_image for an upload that was not added to the history (e.g.
+    refused by the rate limiter): cancel its identification job and remove
+    the file, so a retry writing the same path starts from scratch.
+    """
+    job_queue.cancel(job_queue.IDENTIFY_SPECIES, conversation_id, os.path.basename(image_path))
+    size = storage_stats.file_size(image_path)
+    if size is None:
+        return
+    try:
+        os.remove(image_path)
+    except OSError as e:
+        print(f"Could not remove discarded image {image_path}: {e}")
+        return
+    storage_stats.record(conversation_id, storage_stats.IMAGES, -size, -1)
+
+def process_image(image, conversation_id, history_length, image_coordinates, history_directory="./history"):
+    """
+    Processes and saves an uploaded image.
+
+    Args:
+        image: The base64 string of a JSON upload, or a binary stream.
+
+    Returns:
+        (image_path, vision_b64): where the original was stored, and the
+        preprocessed rendition for the vision model, computed once here and
+        shared by the background identification and the analyzer.
+    """
+    if isinstance(image, str):
+        image_path, image_data = save_image(image, conversation_id, history_length, history_directory)
+    else:
+        image_path = save_image_stream(image, conversation_id, history_length, history_directory)
+        image_data = None
+
+    vision_b64 = image_handler.get_vision_base64_from_path(image_path, image_bytes=image_data)
+    extract_species_from_images(image_path, conversation_id, history_directory, image_coordinates, vision_b64)
+    return image_path, vision_b64
 
 def prepare_messages(system_prompt, history, current_message, image_b64):
     """Prepares the message list for the model."""
@@ -2,12 +2,16 @@
 
 import os
 import json
+import hashlib
 import re
 import csv
 from tqdm import tqdm
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_openai import ChatOpenAI
+import identification_cache
 import image_handler
+import llm_clients
+import metrics
+import rate_limiter
 
 def extract_json(input_string):
     """
@@ -33,10 +37,12 @@ def extract_json(input_string):
 
     return parsed_data
 
-def identify_chatgpt_raw(image_path, language):
-    model = ChatOpenAI(model="gpt-5.2")
+IDENTIFY_MODEL = os.getenv("IDENTIFY_MODEL", "gpt-5.2")
+# Language of the common names. Part of the identification cache key: /analyze,
+# the background job and utils/remake_species must all use it to share results.
+IDENTIFY_LANGUAGE = "english"
 
-    system_prompt = f"""
+IDENTIFY_PROMPT = """
 Analyze this image and identify all visible species. Return your findings in JSON format with the following structure:
 
 {{
@@ -66,10 +72,38 @@ Guidelines:
 7. For complex scenes with many species, prioritize the most prominent/visible organisms
 """
 
+# Changes whenever the prompt text does, so cached results of an older prompt are not reused
+PROMPT_VERSION = hashlib.sha1(IDENTIFY_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+def identify_chatgpt_raw(image_path, language, image_b64=None, use_cache=True, priority=rate_limiter.INTERACTIVE):
+    """
+    Ask the vision model for the species in an image.
+    `image_b64` overrides the image sent (e.g. for benchmarking renditions);
+    by default the downscaled, cached vision rendition of `image_path` is used.
+    With `use_cache`, results are looked up in / stored to the identification
+    cache keyed by the content of `image_path`. Cache misses go through the
+    shared rate limiter with the given `priority`.
+    """
+    fp = None
+    if use_cache and identification_cache.IDENT_CACHE_ENABLED:
+        try:
+            fp = identification_cache.fingerprint(image_path)
+            cached = identification_cache.lookup(fp, IDENTIFY_MODEL, PROMPT_VERSION, language)
+            if cached is not None:
+                return cached
+        except OSError as e:
+            print(f"Identification cache skipped for {image_path}: {e}")
+            fp = None
+
+    model = llm_clients.get_chat_model(IDENTIFY_MODEL)
+
+    system_prompt = IDENTIFY_PROMPT.format(language=language)
+
     messages = [SystemMessage(content=system_prompt)]
     user_message_content = [{"type": "text", "text": ""}]
 
-    image_b64 = image_handler.get_base64_from_path(image_path)
+    if image_b64 is None:
+        image_b64 = image_handler.get_vision_base64_from_path(image_path)
 
     if image_b64:
         user_message_content.append({
@@ -79,11 +113,17 @@ Guidelines:
 
     messages.append(HumanMessage(content=user_message_content))
     
-    llm_reply_raw = model.invoke(messages)
+    with rate_limiter.limit("identify", priority), metrics.span("llm", "identify"):
+        llm_reply_raw = model.invoke(messages)
+
+    # Only cache replies that parsed, a malformed one may be transient
+    if fp is not None and extract_json(llm_reply_raw.content):
+        identification_cache.store(fp, IDENTIFY_MODEL, PROMPT_VERSION, language, llm_reply_raw.content)
+
     return llm_reply_raw.content
 
-def identify_chatgpt(image_path, language):
-    llm_reply_raw = identify_chatgpt_raw(image_path, language)
+def identify_chatgpt(image_path, language, image_b64=None, priority=rate_limiter.INTERACTIVE):
+    llm_reply_raw = identify_chatgpt_raw(image_path, language, image_b64=image_b64, priority=priority)
 
     identified_species = extract_json(llm_reply_raw)
 
@@ -104,11 +144,13 @@ def identify_chatgpt(image_path, language):
                 print(f"Unexpected format for {taxonomic_group}: expected list but got {type(species_list)}")
 
     return species_csv_lines
-def identify_and_populate(image, quest_id, history_directory, image_coordinates, language="english"):
+def identify_and_populate(image, quest_id, history_directory, image_coordinates, language=IDENTIFY_LANGUAGE, image_b64=None):
+    """Identify the species in `image` and save them to MongoDB; returns the number of rows."""
     import db
 
-    # Get the species data from LLM
-    species_csv_lines = identify_chatgpt(image, language=language)
+    # Get the species data from LLM (runs off the request path, so background priority)
+    species_csv_lines = identify_chatgpt(image, language=language, image_b64=image_b64,
+                                         priority=rate_limiter.BACKGROUND)
 
     # Extract latitude and longitude from image_coordinates
     try:
@@ -132,7 +174,12 @@ def identify_and_populate(image, quest_id, history_directory, image_coordinates,
             "notes": line[5] if len(line) > 5 else "",
             "latitude": latitude,
             "longitude": longitude,
+            # Lets utils/remake_species.py find rows of an older model or prompt
+            "identify_model": IDENTIFY_MODEL,
+            "prompt_version": PROMPT_VERSION,
         })
 
-    if batch:
-        db.save_species_batch(batch)
\ No newline at end of file
+    # Raise so a queued job is retried instead of silently losing the result
+    if batch and not db.save_species_batch(batch):
+        raise RuntimeError(f"Could not save species for {quest_id}/{os.path.basename(image)}")
+    return len(batch)
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+Token-budgeted prompt context for ImageAnalyzer.
+
+Sending every previous assistant JSON plus the full list of species found so
+far makes input tokens (and latency) grow linearly with the length of a quest.
+PromptContext keeps the prompt bounded instead:
+
+  - the last ANALYZER_CONTEXT_TURNS turns are sent verbatim,
+  - older turns are folded into a one-line summary (species + follow-up asked),
+  - previously found species are deduplicated,
+  - if the result still exceeds ANALYZER_CONTEXT_TOKENS, the oldest verbatim
+    turns move into the summary and the summary is truncated.
+
+Token counts use tiktoken when it is installed, otherwise a chars/4 estimate.
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken is optional
+    _ENCODING = None
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("ANALYZER_CONTEXT_TOKENS", "3000"))
+CONTEXT_RECENT_TURNS = int(os.getenv("ANALYZER_CONTEXT_TURNS", "4"))
+
+# Per-message framing overhead of the chat format
+_MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Number of tokens in `text` (exact with tiktoken, approximate otherwise)."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Token estimate for a list of chat messages with string content."""
+    return sum(
+        estimate_tokens(m.get("content", "") if isinstance(m.get("content"), str) else json.dumps(m.get("content")))
+        + _MESSAGE_OVERHEAD
+        for m in messages
+    )
+
+
+def dedupe_names(names: List[str]) -> List[str]:
+    """Drop empty and repeated names (case-insensitive), keeping first-seen order."""
+    seen = set()
+    unique = []
+    for name in names:
+        key = (name or "").strip().lower()
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(name.strip())
+    return unique
+
+
+def summarize_turn(message: Dict[str, Any]) -> str:
+    """One short line for a turn that fell out of the verbatim window."""
+    content = message.get("content", "")
+    if message.get("role") == "assistant":
+        try:
+            data = json.loads(content)
+        except (json.JSONDecodeError, TypeError):
+            return ""
+        name = data.get("species_identification", {}).get("name", "")
+        question = data.get("sampling_guidance", {}).get("question", "")
+        return f"identified {name}" + (f" (asked: {question})" if question else "") if name else ""
+    return content.strip()[:120]
+
+
+class PromptContext:
+    """Builds bounded message lists and reports their size."""
+
+    def __init__(
+        self,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        recent_turns: int = CONTEXT_RECENT_TURNS,
+    ):
+        self.token_budget = token_budget
+        self.recent_turns = max(0, recent_turns)
+
+    def build(
+        self,
+        system_prompt: str,
+        history: List[Dict[str, Any]],
+        user_content: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """
+        Assemble [system, summary?, recent turns..., user?] within the budget.
+
+        Args:
+            system_prompt: The flavor prompt.
+            history: The full conversation_history (role/content dicts).
+            user_content: The new user message, if any.
+
+        Returns:
+            (messages, report) where report holds the estimated prompt tokens
+            and how many turns were sent verbatim / summarized.
+        """
+        system = {"role": "system", "content": system_prompt}
+        tail = [{"role": "user", "content": user_content}] if user_content else []
+        fixed_tokens = count_message_tokens([system] + tail)
+
+        split = max(0, len(history) - self.recent_turns)
+        older, recent = history[:split], history[split:]
+
+        # Move turns into the summary until the verbatim window fits
+        while recent and fixed_tokens + count_message_tokens(recent) > self.token_budget:
+            older, recent = history[:len(older) + 1], recent[1:]
+
+        messages = [system]
+        summary = self._summary_message(older, self.token_budget - fixed_tokens - count_message_tokens(recent))
+        if summary:
+            messages.append(summary)
+        messages.extend(recent)
+        messages.extend(tail)
+
+        report = {
+            "estimated_prompt_tokens": count_message_tokens(messages),
+            "summary_tokens": count_message_tokens([summary]) if summary else 0,
+            "turns_verbatim": len(recent),
+            "turns_summarized": len(older),
+        }
+        return messages, report
+
+    def _summary_message(self, older: List[Dict[str, Any]], budget: int) -> Optional[Dict[str, Any]]:
+        lines = [line for line in map(summarize_turn, older) if line]
+        if not lines or budget <= _MESSAGE_OVERHEAD:
+            return None
+        text = "Earlier in this quest: " + "; ".join(lines) + "."
+        # Keep the most recent part of the summary if it does not fit
+        while estimate_tokens(text) + _MESSAGE_OVERHEAD > budget and len(lines) > 1:
+            lines = lines[1:]
+            text = "Earlier in this quest (most recent): " + "; ".join(lines) + "."
+        if estimate_tokens(text) + _MESSAGE_OVERHEAD > budget:
+            return None
+        return {"role": "system", "content": text}
+
+
+def usage_report(response: Any, report: Dict[str, int]) -> Dict[str, int]:
+    """Merge the provider's reported token usage into a PromptContext report."""
+    usage = getattr(response, "usage", None)
+    merged = dict(report)
+    if usage is not None:
+        merged["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+        merged["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+        merged["total_tokens"] = getattr(usage, "total_tokens", 0) or 0
+    return merged
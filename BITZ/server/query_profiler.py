@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Optional slow-query log and profiler for the MongoDB layer.
+
+With MONGO_PROFILER=1, db.get_client() registers a pymongo CommandListener
+that times every query command (find, aggregate, count, distinct, update,
+delete, findAndModify). Commands slower than MONGO_SLOW_MS are reduced to
+their shape (the filter with values replaced by "?", so
+{"quest_id": "abc"} and {"quest_id": "xyz"} are the same shape) and handed to
+a background thread, which:
+
+  - explains each new shape once (queryPlanner verbosity, nothing is run)
+    and summarizes the winning plan: stages, index used, and filter fields
+    the index does not cover (e.g. a quest listing of one user searched by
+    quest id runs on the user_id + timestamp index and checks the quest_id
+    prefix on every document it fetches);
+  - logs the command, flagging COLLSCAN plans;
+  - accumulates count / total / max time per shape in the query_profile
+    collection, shared by all workers.
+
+Listener callbacks only do in-memory work; no I/O happens on the request
+thread.
+
+Report the most expensive shapes:
+    python query_profiler.py top [-n 20] [--collscan] [--json]
+    python query_profiler.py reset
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import monitoring
+
+MONGO_PROFILER = os.getenv("MONGO_PROFILER", "0") == "1"
+MONGO_SLOW_MS = float(os.getenv("MONGO_SLOW_MS", "100"))
+
+PROFILE_COLLECTION = "query_profile"
+
+# Where the filter of each profiled command lives
+_FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "findandmodify": "query",
+}
+_PROFILED = set(_FILTER_FIELDS) | {"aggregate", "update", "delete"}
+# Session and cluster fields that explain does not accept
+_DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "txnNumber", "$readPreference", "autocommit",
+                  "startTransaction", "readConcern", "writeConcern", "ordered", "bypassDocumentValidation"}
+
+
+def shape(value: Any) -> Any:
+    """The structure of a filter with literal values replaced by '?'."""
+    if isinstance(value, dict):
+        return {k: shape(v) if k.startswith("$") or isinstance(v, dict) else "?" for k, v in value.items()}
+    if isinstance(value, list):
+        return [shape(v) for v in value] if value and isinstance(value[0], dict) else "?"
+    return "?"
+
+
+def _command_filter(name: str, command: Dict[str, Any]) -> Dict[str, Any]:
+    if name == "update":
+        updates = command.get("updates") or [{}]
+        return updates[0].get("q", {})
+    if name == "delete":
+        deletes = command.get("deletes") or [{}]
+        return deletes[0].get("q", {})
+    if name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        return pipeline[0].get("$match", {}) if pipeline else {}
+    return command.get(_FILTER_FIELDS.get(name, "filter")) or {}
+
+
+def _explainable(name: str, command: Dict[str, Any]) -> Dict[str, Any]:
+    cmd = {k: v for k, v in command.items() if k not in _DRIVER_FIELDS}
+    # explain takes a single write statement
+    if name == "update":
+        cmd["updates"] = cmd.get("updates", [])[:1]
+    elif name == "delete":
+        cmd["deletes"] = cmd.get("deletes", [])[:1]
+    return cmd
+
+
+def _find_planner(explain: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if "queryPlanner" in explain:
+        return explain["queryPlanner"]
+    for stage in explain.get("stages", []):
+        cursor = stage.get("$cursor")
+        if cursor and "queryPlanner" in cursor:
+            return cursor["queryPlanner"]
+    return None
+
+
+def summarize_plan(explain: Dict[str, Any], filter_fields: List[str]) -> Dict[str, Any]:
+    """Stages, indexes and uncovered filter fields of the winning plan."""
+    planner = _find_planner(explain)
+    if planner is None:
+        return {"stages": [], "indexes": [], "collscan": False, "unindexed_fields": []}
+    plan = planner.get("winningPlan", {})
+    plan = plan.get("queryPlan", plan)  # slot-based engine nests the classic plan
+
+    stages, indexes, indexed_fields = [], [], set()
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        stage = node.get("stage")
+        if stage:
+            stages.append(stage)
+        if stage == "IXSCAN":
+            indexes.append(node.get("indexName", ""))
+            indexed_fields.update(node.get("keyPattern", {}).keys())
+        if "inputStage" in node:
+            pending.append(node["inputStage"])
+        pending.extend(node.get("inputStages", []))
+
+    collscan = "COLLSCAN" in stages
+    unindexed = [f for f in filter_fields if not f.startswith("$") and f not in indexed_fields]
+    return {"stages": stages, "indexes": indexes, "collscan": collscan, "unindexed_fields": unindexed}
+
+
+def _describe(summary: Dict[str, Any]) -> str:
+    text = " <- ".join(summary["stages"]) or "?"
+    if summary["indexes"]:
+        text += f" [{', '.join(summary['indexes'])}]"
+    if summary["collscan"]:
+        text += " COLLSCAN!"
+    elif summary["unindexed_fields"]:
+        text += f" unindexed: {', '.join(summary['unindexed_fields'])}"
+    return text
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Times query commands and queues the slow ones for the background thread."""
+
+    def __init__(self, get_database: Callable, slow_ms: float = MONGO_SLOW_MS):
+        self.get_database = get_database
+        self.slow_ms = slow_ms
+        self._inflight: Dict[Any, Any] = {}
+        self._queue: "queue.Queue" = queue.Queue(maxsize=1000)
+        self._plans: Dict[str, Dict[str, Any]] = {}
+        threading.Thread(target=self._drain, name="query-profiler", daemon=True).start()
+
+    # --- listener callbacks (request thread, in-memory only) -------------
+
+    def started(self, event):
+        if event.command_name in _PROFILED:
+            collection = event.command.get(event.command_name)
+            if collection != PROFILE_COLLECTION:
+                self._inflight[(event.request_id, event.connection_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        entry = self._inflight.pop((event.request_id, event.connection_id), None)
+        if entry is None:
+            return
+        ms = event.duration_micros / 1000
+        if ms >= self.slow_ms:
+            try:
+                self._queue.put_nowait((entry[0], event.command_name, entry[1], ms))
+            except queue.Full:
+                pass
+
+    def failed(self, event):
+        self._inflight.pop((event.request_id, event.connection_id), None)
+
+    # --- background thread ------------------------------------------------
+
+    def _drain(self):
+        while True:
+            database, name, command, ms = self._queue.get()
+            try:
+                self._record(database, name, command, ms)
+            except Exception as e:
+                print(f"Query profiler error: {e}")
+
+    def _record(self, database: str, name: str, command: Dict[str, Any], ms: float) -> None:
+        collection = command.get(name)
+        filter_doc = _command_filter(name, command)
+        query_shape = shape(filter_doc)
+        sort_shape = shape(command.get("sort")) if command.get("sort") else None
+        key = json.dumps([collection, name, query_shape, sort_shape], sort_keys=True)
+        shape_id = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+        db = self.get_database().client[database]
+        summary = self._plans.get(shape_id)
+        if summary is None:
+            try:
+                explain = db.command("explain", _explainable(name, command), verbosity="queryPlanner")
+                summary = summarize_plan(explain, list(filter_doc.keys()))
+            except Exception as e:
+                summary = {"stages": [], "indexes": [], "collscan": False, "unindexed_fields": [],
+                           "error": str(e)}
+            self._plans[shape_id] = summary
+
+        print(f"Slow MongoDB {name} on {collection}: {ms:.0f} ms "
+              f"filter={json.dumps(query_shape)} plan={_describe(summary)}")
+
+        now = datetime.now(timezone.utc)
+        self.get_database()[PROFILE_COLLECTION].update_one(
+            {"_id": shape_id},
+            {
+                "$set": {
+                    "database": database,
+                    "collection": collection,
+                    "command": name,
+                    "shape": json.dumps(query_shape, sort_keys=True),
+                    "sort": json.dumps(sort_shape, sort_keys=True) if sort_shape else None,
+                    "plan": summary,
+                    "last_seen": now,
+                },
+                "$inc": {"count": 1, "total_ms": ms},
+                "$max": {"max_ms": ms},
+                "$setOnInsert": {"first_seen": now},
+            },
+            upsert=True,
+        )
+
+
+def listeners(get_database: Callable) -> List[monitoring.CommandListener]:
+    """Event listeners for the MongoClient (empty unless MONGO_PROFILER=1)."""
+    return [SlowQueryListener(get_database)] if MONGO_PROFILER else []
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def top(n: int, collscan_only: bool) -> List[Dict[str, Any]]:
+    import db
+
+    query = {"plan.collscan": True} if collscan_only else {}
+    return list(
+        db.get_database()[PROFILE_COLLECTION]
+        .find(query, {"_id": 0, "first_seen": 0})
+        .sort("total_ms", -1)
+        .limit(n)
+    )
+
+
+def print_top(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        print("No slow queries recorded (is MONGO_PROFILER=1 set on the server?)")
+        return
+    print(f"{'total s':>9} {'count':>7} {'mean ms':>9} {'max ms':>8}  command")
+    print("-" * 100)
+    for row in rows:
+        mean = row["total_ms"] / row["count"]
+        print(f"{row['total_ms'] / 1000:>9.1f} {row['count']:>7} {mean:>9.1f} {row['max_ms']:>8.0f}  "
+              f"{row['collection']}.{row['command']} {row['shape']}"
+              + (f" sort={row['sort']}" if row.get("sort") else ""))
+        print(f"{'':>37}plan: {_describe(row['plan'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report slow MongoDB query shapes recorded by the profiler")
+    sub = parser.add_subparsers(dest="action", required=True)
+    top_parser = sub.add_parser("top", help="Most expensive query shapes by total time")
+    top_parser.add_argument("-n", type=int, default=20, help="Number of shapes (default: 20)")
+    top_parser.add_argument("--collscan", action="store_true", help="Only shapes planned as collection scans")
+    top_parser.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    sub.add_parser("reset", help="Forget all recorded shapes")
+    args = parser.parse_args()
+
+    if args.action == "reset":
+        import db
+
+        deleted = db.get_database()[PROFILE_COLLECTION].delete_many({}).deleted_count
+        print(f"Removed {deleted} query shapes")
+        return
+
+    rows = top(args.n, args.collscan)
+    if args.json:
+        print(json.dumps(rows, indent=2, default=str))
+    else:
+        print_top(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Global LLM rate limiter and daily call budget, shared by all gunicorn workers
+and the job worker through MongoDB (the `rate_limits` collection).
+
+Token bucket: a single document refilled at LLM_RATE_PER_SECOND up to
+LLM_BURST tokens; each LLM call takes one token with an atomic pipeline
+update, so concurrent workers never overdraw it.
+
+Priorities: interactive calls (/analyze, /answer, /question) may drain the
+bucket. Background calls (queued species identification, /link_species*
+precompute) only take tokens while more than LLM_BACKGROUND_RESERVE of the
+burst is left, and stop at LLM_BACKGROUND_BUDGET_SHARE of the daily budget,
+so a backlog of jobs never starves users.
+
+Daily budget: LLM_DAILY_CALL_BUDGET calls per UTC day (0 = unlimited),
+counted per endpoint. Once exhausted, calls raise BudgetExceeded until
+midnight UTC; the routes answer with a readable message instead of failing.
+
+A 429 from the provider raises RateLimited and empties the shared bucket, so
+every worker backs off instead of hammering the API. If MongoDB is
+unreachable the limiter lets calls through.
+
+Point OPENAI_BASE_URL at a local stub server to exercise it without cost.
+"""
+
+import math
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+import openai
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import db
+import metrics
+
+RATE_LIMITER_ENABLED = os.getenv("RATE_LIMITER_ENABLED", "1") == "1"
+LLM_RATE_PER_SECOND = float(os.getenv("LLM_RATE_PER_SECOND", "5"))
+LLM_BURST = float(os.getenv("LLM_BURST", "20"))
+LLM_BACKGROUND_RESERVE = float(os.getenv("LLM_BACKGROUND_RESERVE", "0.3"))
+LLM_MAX_WAIT = float(os.getenv("LLM_MAX_WAIT", "10"))
+LLM_BACKGROUND_MAX_WAIT = float(os.getenv("LLM_BACKGROUND_MAX_WAIT", "2"))
+LLM_DAILY_CALL_BUDGET = int(os.getenv("LLM_DAILY_CALL_BUDGET", "0"))
+LLM_BACKGROUND_BUDGET_SHARE = float(os.getenv("LLM_BACKGROUND_BUDGET_SHARE", "0.8"))
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+BUCKET_ID = "bucket:llm"
+BUDGET_RETENTION_DAYS = 30
+
+_bucket_ready = False
+
+
+class LimitExceeded(Exception):
+    """An LLM call was refused; retry after `retry_after` seconds."""
+
+    reason = "limited"
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class RateLimited(LimitExceeded):
+    reason = "rate_limited"
+
+
+class BudgetExceeded(LimitExceeded):
+    reason = "daily_budget_exceeded"
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _seconds_until_midnight() -> float:
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+
+def _ensure_bucket(col) -> None:
+    global _bucket_ready
+    if not _bucket_ready:
+        col.update_one(
+            {"_id": BUCKET_ID},
+            {"$setOnInsert": {"tokens": LLM_BURST, "updated_at": time.time()}},
+            upsert=True,
+        )
+        _bucket_ready = True
+
+
+def _take_token(priority: str, cost: float) -> float:
+    """
+    Refill the bucket and take `cost` tokens if allowed for this priority.
+
+    Returns:
+        0 if granted, otherwise the estimated seconds until enough tokens are back.
+    """
+    global _bucket_ready
+    col = db.get_rate_limits_collection()
+    _ensure_bucket(col)
+    reserve = LLM_BURST * LLM_BACKGROUND_RESERVE if priority == BACKGROUND else 0
+    needed = cost + reserve
+    now = time.time()
+    elapsed = {"$max": [0, {"$subtract": [now, "$updated_at"]}]}
+    doc = col.find_one_and_update(
+        {"_id": BUCKET_ID},
+        [
+            {"$set": {
+                "tokens": {"$min": [LLM_BURST, {"$add": ["$tokens", {"$multiply": [elapsed, LLM_RATE_PER_SECOND]}]}]},
+                "updated_at": {"$max": [now, "$updated_at"]},
+            }},
+            {"$set": {"granted": {"$gte": ["$tokens", needed]}}},
+            {"$set": {"tokens": {"$cond": ["$granted", {"$subtract": ["$tokens", cost]}, "$tokens"]}}},
+        ],
+        projection={"tokens": 1, "granted": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is None:
+        # Bucket document removed behind our back; recreate it next time
+        _bucket_ready = False
+        return 0
+    if doc["granted"]:
+        return 0
+    return max(0.05, (needed - doc["tokens"]) / LLM_RATE_PER_SECOND)
+
+
+def _charge_budget(endpoint: str, priority: str, cost: float) -> None:
+    if LLM_DAILY_CALL_BUDGET <= 0:
+        return
+    cap = LLM_DAILY_CALL_BUDGET
+    if priority == BACKGROUND:
+        cap = int(LLM_DAILY_CALL_BUDGET * LLM_BACKGROUND_BUDGET_SHARE)
+    day = _today()
+    try:
+        # When the counter is already at the limit the filter misses and the
+        # upsert collides with the existing document
+        db.get_rate_limits_collection().update_one(
+            {"_id": f"budget:{day}", "calls": {"$lte": cap - cost}},
+            {
+                "$inc": {"calls": cost, f"by_endpoint.{endpoint}": cost},
+                "$setOnInsert": {
+                    "day": day,
+                    "expire_at": datetime.now(timezone.utc) + timedelta(days=BUDGET_RETENTION_DAYS),
+                },
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        raise BudgetExceeded(
+            f"Daily LLM budget reached ({priority} limit {cap} calls)",
+            _seconds_until_midnight(),
+        )
+
+
+def acquire(endpoint: str, priority: str = INTERACTIVE, cost: float = 1) -> None:
+    """
+    Wait for permission to make `cost` LLM calls for `endpoint`.
+
+    Raises:
+        RateLimited: no token within LLM_MAX_WAIT (LLM_BACKGROUND_MAX_WAIT for background calls).
+        BudgetExceeded: today's budget for this priority is used up.
+    """
+    if not RATE_LIMITER_ENABLED:
+        return
+    max_wait = LLM_BACKGROUND_MAX_WAIT if priority == BACKGROUND else LLM_MAX_WAIT
+    deadline = time.monotonic() + max_wait
+    try:
+        with metrics.span("ratelimit", endpoint):
+            while True:
+                wait = _take_token(priority, cost)
+                if wait == 0:
+                    break
+                remaining = deadline - time.monotonic()
+                if wait > remaining:
+                    raise RateLimited(f"LLM rate limit reached for {endpoint} ({priority})", wait)
+                time.sleep(wait)
+            _charge_budget(endpoint, priority, cost)
+    except PyMongoError as e:
+        print(f"Rate limiter unavailable, allowing {endpoint} call: {e}")
+
+
+def _drain(retry_after: float) -> None:
+    """Empty the shared bucket after a provider 429 so all workers back off."""
+    try:
+        db.get_rate_limits_collection().update_one(
+            {"_id": BUCKET_ID},
+            {"$set": {"tokens": -retry_after * LLM_RATE_PER_SECOND, "updated_at": time.time()}},
+        )
+    except PyMongoError as e:
+        print(f"Could not drain rate limiter bucket: {e}")
+
+
+@contextmanager
+def limit(endpoint: str, priority: str = INTERACTIVE, cost: float = 1):
+    """
+    Guard an LLM call: acquire a token first, and turn a provider 429 into
+    RateLimited.
+
+        with rate_limiter.limit("question"):
+            response = client.chat.completions.create(...)
+    """
+    acquire(endpoint, priority, cost)
+    try:
+        yield
+    except openai.RateLimitError as e:
+        retry_after = 20.0
+        try:
+            retry_after = float(e.response.headers.get("retry-after", retry_after))
+        except (AttributeError, TypeError, ValueError):
+            pass
+        if RATE_LIMITER_ENABLED:
+            _drain(retry_after)
+        raise RateLimited(f"LLM provider rate limit for {endpoint}: {e}", retry_after) from e
+
+
+def error_body(error: LimitExceeded) -> Dict[str, Any]:
+    """JSON body for a refused call, shared by the routes."""
+    if isinstance(error, BudgetExceeded):
+        message = "BITZ has reached its daily analysis limit. Please try again tomorrow."
+    else:
+        message = "BITZ is very busy right now. Please try again in a moment."
+    return {"error": message, "reason": error.reason, "retry_after": error.retry_after}
+
+
+def stats() -> Dict[str, Any]:
+    """Current bucket level and today's budget usage."""
+    col = db.get_rate_limits_collection()
+    bucket = col.find_one({"_id": BUCKET_ID}, {"_id": 0, "granted": 0}) or {}
+    budget = col.find_one({"_id": f"budget:{_today()}"}, {"_id": 0, "expire_at": 0}) or {}
+    return {
+        "enabled": RATE_LIMITER_ENABLED,
+        "rate_per_second": LLM_RATE_PER_SECOND,
+        "burst": LLM_BURST,
+        "background_reserve": LLM_BACKGROUND_RESERVE,
+        "tokens": bucket.get("tokens"),
+        "daily_call_budget": LLM_DAILY_CALL_BUDGET or None,
+        "background_budget": int(LLM_DAILY_CALL_BUDGET * LLM_BACKGROUND_BUDGET_SHARE) or None,
+        "today": {"day": _today(), "calls": budget.get("calls", 0), "by_endpoint": budget.get("by_endpoint", {})},
+    }
@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 """
-Script to restore a backup from a GCP bucket.
-Usage: ./restore.py [specific_backup_path] 
+Script to restore a backup made by backup.py.
+
+Incremental backups (a manifest plus content-addressed objects, see
+backup.py) are rebuilt in parallel into history_temp, each file checked
+against its SHA-256, then swapped in place of history (the previous folder
+is kept as history_old). Older zip backups on GCS are still restored.
+
+Usage: ./restore.py TARGET [manifests/<timestamp>.json]   # default: latest manifest
+       ./restore.py [bucket_name] [backup_path.zip]      # zip backup
+       ./restore.py [bucket/path/to/backup.zip]
        or just ./restore.py to restore the last backup
 """
 
+import argparse
+import json
 import os
 import sys
 import zipfile
 import shutil
-from google.cloud import storage
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import backup
+import backup_storage
 
 def download_from_gcp(bucket_name, source_blob_name, destination_file):
     """
@@ -23,6 +36,8 @@ def download_from_gcp(bucket_name, source_blob_name, destination_file):
     print(f"Downloading {source_blob_name} from GCP bucket {bucket_name}...")
     
     try:
+        from google.cloud import storage
+
         storage_client = storage.Client()
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(source_blob_name)
@@ -35,6 +50,16 @@ def download_from_gcp(bucket_name, source_blob_name, destination_file):
         print(f"Error downloading from GCP: {e}")
         sys.exit(1)
 
+def swap_in(temp_dir, destination_dir):
+    """Replace destination_dir by temp_dir, keeping the current one as <destination_dir>_old."""
+    if os.path.exists(destination_dir):
+        backup_dir = f"{destination_dir}_old"
+        if os.path.exists(backup_dir):
+            shutil.rmtree(backup_dir)
+        shutil.move(destination_dir, backup_dir)
+        print(f"Existing {destination_dir} backed up to {backup_dir}")
+    shutil.move(temp_dir, destination_dir)
+
 def extract_zip_archive(zip_file, destination_dir):
     """
     Extract a zip archive to the specified directory
@@ -56,56 +81,86 @@ def extract_zip_archive(zip_file, destination_dir):
         with zipfile.ZipFile(zip_file, 'r') as zipf:
             zipf.extractall(temp_dir)
         
-        # If destination directory exists, rename it to _old as backup
-        if os.path.exists(destination_dir):
-            backup_dir = f"{destination_dir}_old"
-            if os.path.exists(backup_dir):
-                shutil.rmtree(backup_dir)
-            shutil.move(destination_dir, backup_dir)
-            print(f"Existing {destination_dir} backed up to {backup_dir}")
-        
-        # Move the extracted contents to the destination directory
-        shutil.move(temp_dir, destination_dir)
+        # The archive holds history/..., extracted next to destination_dir's name
+        extracted = os.path.join(temp_dir, os.path.basename(destination_dir))
+        swap_in(extracted if os.path.isdir(extracted) else temp_dir, destination_dir)
+        if os.path.isdir(temp_dir):
+            shutil.rmtree(temp_dir)
         
         print(f"Extraction completed to {destination_dir}")
     except Exception as e:
         print(f"Error extracting zip archive: {e}")
         sys.exit(1)
 
-def get_last_backup_info():
+def latest_manifest(storage):
+    manifests = sorted(key for key in storage.list("manifests/") if key.endswith(".json"))
+    if not manifests:
+        print(f"Error: no manifest found in {storage.url}")
+        sys.exit(1)
+    return manifests[-1]
+
+def restore_manifest(target, manifest_key, destination_dir, workers=8):
     """
-    Get information about the last backup from .last_backup.txt
-    
-    Returns:
-        tuple: (bucket_name, blob_path)
+    Rebuild destination_dir from an incremental backup.
+
+    Args:
+        target (str): Backup target (gs://bucket/prefix or a local directory)
+        manifest_key (str): Manifest to restore, None for the latest
+        destination_dir (str): Directory to restore to
+        workers (int): Parallel downloads
     """
+    storage = backup_storage.open_target(target)
+    manifest_key = manifest_key or latest_manifest(storage)
+    print(f"Restoring {manifest_key} from {storage.url}...")
+    manifest = json.loads(storage.download_bytes(manifest_key))
+    files = manifest["files"]
+
+    temp_dir = f"{destination_dir}_temp"
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir)
+    os.makedirs(temp_dir)
+
+    # Each object is downloaded once, then copied to the other paths sharing it
+    paths_by_hash = {}
+    for rel, entry in files.items():
+        paths_by_hash.setdefault(entry["sha256"], []).append(rel)
+
+    def fetch(sha256, rels):
+        first = os.path.join(temp_dir, *rels[0].split("/"))
+        os.makedirs(os.path.dirname(first), exist_ok=True)
+        storage.download_file(backup.object_key(sha256), first)
+        if backup.file_sha256(first) != sha256:
+            raise ValueError(f"{rels[0]}: checksum mismatch")
+        for rel in rels[1:]:
+            path = os.path.join(temp_dir, *rel.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(first, path)
+        for rel in rels:
+            mtime = files[rel].get("mtime")
+            if mtime:
+                os.utime(os.path.join(temp_dir, *rel.split("/")), (mtime, mtime))
+
     try:
-        with open(".last_backup.txt", "r") as f:
-            info = f.read().strip().split("|")
-            return info[0], info[1]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(fetch, sha256, rels) for sha256, rels in paths_by_hash.items()]
+            for i, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if i % 100 == 0 or i == len(futures):
+                    print(f"  {i}/{len(futures)} objects downloaded")
+        swap_in(temp_dir, destination_dir)
     except Exception as e:
-        print(f"Error reading last backup info: {e}")
-        print("Please specify the backup to restore manually.")
+        print(f"Error restoring backup: {e}")
+        print(f"Partial download left in {temp_dir}; {destination_dir} was not modified")
         sys.exit(1)
 
-def main():
-    # Determine which backup to restore
-    if len(sys.argv) > 2:
-        # If both bucket and blob path are provided
-        bucket_name = sys.argv[1]
-        source_blob_name = sys.argv[2]
-    elif len(sys.argv) == 2 and '/' in sys.argv[1]:
-        # If a combined path is provided (e.g., "bucket/path/to/backup.zip")
-        parts = sys.argv[1].split('/', 1)
-        bucket_name = parts[0]
-        source_blob_name = parts[1]
-    else:
-        # Use the last backup
-        print("No specific backup specified, attempting to restore the last backup...")
-        bucket_name, source_blob_name = get_last_backup_info()
-    
-    # Set paths
-    destination_dir = "history"
+    print("\nRestore Summary:")
+    print(f"- Target: {storage.url}")
+    print(f"- Manifest: {manifest_key}")
+    print(f"- Files: {len(files)}")
+    print(f"- Destination: {destination_dir}")
+    print("\nRestore completed successfully!")
+
+def restore_zip(bucket_name, source_blob_name, destination_dir):
     local_zip = os.path.basename(source_blob_name)
     
     # Download the backup from GCP
@@ -128,5 +183,58 @@ def main():
     
     print("\nRestore completed successfully!")
 
+def get_last_backup_info():
+    """
+    Get information about the last backup from .last_backup.txt
+    
+    Returns:
+        tuple: (bucket_name or target, blob_path or manifest)
+    """
+    try:
+        with open(".last_backup.txt", "r") as f:
+            info = f.read().strip().split("|")
+            return info[0], info[1]
+    except Exception as e:
+        print(f"Error reading last backup info: {e}")
+        print("Please specify the backup to restore manually.")
+        sys.exit(1)
+
+def is_target(value):
+    return "://" in value or value.startswith(("/", "."))
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore a backup of the history folder")
+    parser.add_argument("backup", nargs="*",
+                        help="TARGET [MANIFEST], BUCKET BLOB.zip or BUCKET/BLOB.zip (default: the last backup)")
+    parser.add_argument("--destination", default="history", help="Folder to restore (default: history)")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel downloads (default: 8)")
+    args = parser.parse_args()
+
+    # Determine which backup to restore
+    if args.backup and is_target(args.backup[0]):
+        target = args.backup[0]
+        manifest_key = args.backup[1] if len(args.backup) > 1 else None
+        restore_manifest(target, manifest_key, args.destination, max(1, args.workers))
+        return
+
+    if len(args.backup) > 1:
+        # If both bucket and blob path are provided
+        bucket_name = args.backup[0]
+        source_blob_name = args.backup[1]
+    elif len(args.backup) == 1 and '/' in args.backup[0]:
+        # If a combined path is provided (e.g., "bucket/path/to/backup.zip")
+        parts = args.backup[0].split('/', 1)
+        bucket_name = parts[0]
+        source_blob_name = parts[1]
+    else:
+        # Use the last backup
+        print("No specific backup specified, attempting to restore the last backup...")
+        bucket_name, source_blob_name = get_last_backup_info()
+        if is_target(bucket_name):
+            restore_manifest(bucket_name, source_blob_name, args.destination, max(1, args.workers))
+            return
+
+    restore_zip(bucket_name, source_blob_name, args.destination)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,277 @@
+"""
+Bounded, evicting store for per-quest ImageAnalyzer sessions.
+
+A plain dict keeps one analyzer per conversation_id for the lifetime of the
+worker, so memory only grows. This store keeps at most ANALYZER_SESSIONS_MAX
+sessions, drops the least recently used one when full, and evicts sessions
+that have been idle for longer than ANALYZER_SESSION_TTL seconds.
+
+Sessions are also written to a shared state backend (MongoDB by default, see
+ANALYZER_STATE_BACKEND) after every turn, so /answer sees the context of an
+/analyze that ran on another gunicorn worker or node. The in-memory copy is
+only a cache: each request compares its version with the backend's (a
+projection on a single small field) and reloads the payload when stale.
+
+With no stored state (first turn, expired state, backend down) the session is
+rebuilt from the observations persisted in MongoDB (ImageAnalyzer.from_history).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import db
+
+SESSIONS_MAX = int(os.getenv("ANALYZER_SESSIONS_MAX", "256"))
+SESSION_TTL_SECONDS = int(os.getenv("ANALYZER_SESSION_TTL", "1800"))
+STATE_BACKEND = os.getenv("ANALYZER_STATE_BACKEND", "mongo")
+
+
+# ---------------------------------------------------------------------------
+# State backends
+# ---------------------------------------------------------------------------
+
+class MongoStateBackend:
+    """Shared state in the analyzer_states collection."""
+
+    def version(self, key: str) -> Optional[int]:
+        return db.get_analyzer_state_version(key)
+
+    def load(self, key: str) -> Optional[Tuple[bytes, int]]:
+        return db.load_analyzer_state(key)
+
+    def save(self, key: str, payload: bytes) -> Optional[int]:
+        return db.save_analyzer_state(key, payload)
+
+
+class MemoryStateBackend:
+    """Process-local state; for development and tests (not shared across workers)."""
+
+    def __init__(self):
+        self._states: Dict[str, Tuple[bytes, int]] = {}
+        self._lock = threading.Lock()
+
+    def version(self, key: str) -> Optional[int]:
+        with self._lock:
+            state = self._states.get(key)
+            return state[1] if state else None
+
+    def load(self, key: str) -> Optional[Tuple[bytes, int]]:
+        with self._lock:
+            return self._states.get(key)
+
+    def save(self, key: str, payload: bytes) -> Optional[int]:
+        with self._lock:
+            version = self._states.get(key, (b"", 0))[1] + 1
+            self._states[key] = (payload, version)
+            return version
+
+
+STATE_BACKENDS = {
+    "mongo": MongoStateBackend,
+    "memory": MemoryStateBackend,
+}
+
+
+def create_state_backend(name: str = STATE_BACKEND):
+    """Instantiate a backend by name; 'none' disables shared state."""
+    if name == "none":
+        return None
+    if name not in STATE_BACKENDS:
+        raise ValueError(f"Unknown analyzer state backend: {name}")
+    return STATE_BACKENDS[name]()
+
+
+# ---------------------------------------------------------------------------
+# Session store
+# ---------------------------------------------------------------------------
+
+class _Entry:
+    __slots__ = ("value", "version", "last_access")
+
+    def __init__(self, value: Any, version: Optional[int]):
+        self.value = value
+        self.version = version
+        self.last_access = time.monotonic()
+
+
+class SessionStore:
+    """Thread-safe LRU + idle-TTL cache of analyzer sessions over a shared state backend."""
+
+    def __init__(
+        self,
+        rebuild: Callable[[str], Any],
+        restore: Optional[Callable[[bytes], Any]] = None,
+        backend=None,
+        max_entries: int = SESSIONS_MAX,
+        ttl_seconds: int = SESSION_TTL_SECONDS,
+    ):
+        """
+        Args:
+            rebuild: Called with the session key when there is no stored state;
+                     must return a ready-to-use session (e.g. rebuilt from
+                     persisted history).
+            restore: Deserializes a payload produced by the session's to_state().
+            backend: Shared state backend (see STATE_BACKENDS), or None to keep
+                     sessions in this process only.
+            max_entries: Maximum number of sessions kept in memory.
+            ttl_seconds: Idle time after which a session is evicted.
+        """
+        self._rebuild = rebuild
+        self._restore = restore
+        self._backend = backend if restore else None
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_reloads = 0
+        self.state_loads = 0
+        self.state_saves = 0
+        self.state_save_failures = 0
+        self.rebuilds = 0
+        self.evictions_lru = 0
+        self.evictions_ttl = 0
+
+    def get(self, key: str, builder: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Return the session for `key`, loading or building it when missing or stale.
+
+        Args:
+            key: The conversation_id.
+            builder: Optional zero-argument factory used instead of the default
+                     rebuild when the caller already has the history at hand.
+        """
+        remote_version = self._backend.version(key) if self._backend else None
+
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == remote_version:
+                self._touch(key, entry)
+                self.hits += 1
+                return entry.value
+            if entry is not None:
+                self.stale_reloads += 1
+            else:
+                self.misses += 1
+
+        # Load outside the lock: both paths hit MongoDB
+        value, version = self._load(key, builder)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                # Another thread loaded the same version meanwhile
+                self._touch(key, entry)
+                return entry.value
+            self._entries[key] = _Entry(value, version)
+            self._entries.move_to_end(key)
+            self._trim()
+        return value
+
+    def save(self, key: str, value: Any) -> None:
+        """
+        Publish a session after it changed, so other workers pick it up.
+
+        When the backend save fails, the local copy keeps the version it was
+        loaded at: it still matches the backend, so the next get() returns it
+        instead of reloading the older stored state.
+        """
+        version = None
+        saved = True
+        if self._backend:
+            version = self._backend.save(key, value.to_state())
+            saved = version is not None
+            if not saved:
+                with self._lock:
+                    entry = self._entries.get(key)
+                version = entry.version if entry is not None else self._backend.version(key)
+
+        with self._lock:
+            if self._backend:
+                if saved:
+                    self.state_saves += 1
+                else:
+                    self.state_save_failures += 1
+            entry = self._entries.get(key)
+            if entry is not None and entry.value is value:
+                entry.version = version
+                self._touch(key, entry)
+            else:
+                self._entries[key] = _Entry(value, version)
+                self._trim()
+
+    def discard(self, key: str) -> None:
+        """Forget a session (e.g. when its quest is deleted)."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _load(self, key: str, builder: Optional[Callable[[], Any]]) -> Tuple[Any, Optional[int]]:
+        if self._backend:
+            stored = self._backend.load(key)
+            if stored:
+                payload, version = stored
+                try:
+                    value = self._restore(payload)
+                    self.state_loads += 1
+                    return value, version
+                except Exception as e:
+                    print(f"Discarding unreadable analyzer state for {key}: {e}")
+        self.rebuilds += 1
+        value = builder() if builder else self._rebuild(key)
+        return value, None
+
+    def _touch(self, key: str, entry: _Entry) -> None:
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(key)
+
+    def _trim(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions_lru += 1
+
+    def _evict_expired(self) -> None:
+        """Drop idle sessions. Entries are kept in access order, so we stop at the first fresh one."""
+        if self.ttl_seconds <= 0:
+            return
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.last_access > deadline:
+                break
+            self._entries.popitem(last=False)
+            self.evictions_ttl += 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Occupancy, approximate memory and hit/eviction counters."""
+        with self._lock:
+            self._evict_expired()
+            values = [e.value for e in self._entries.values()]
+            stats = {
+                "sessions": len(values),
+                "max_sessions": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "state_backend": type(self._backend).__name__ if self._backend else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_reloads": self.stale_reloads,
+                "state_loads": self.state_loads,
+                "state_saves": self.state_saves,
+                "state_save_failures": self.state_save_failures,
+                "rebuilds": self.rebuilds,
+                "evictions_lru": self.evictions_lru,
+                "evictions_ttl": self.evictions_ttl,
+            }
+        stats["approx_bytes"] = sum(
+            v.approx_size() for v in values if hasattr(v, "approx_size")
+        )
+        return stats
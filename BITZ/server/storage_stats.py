@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Per-quest disk usage, kept in the quest_storage collection.
+
+Instead of walking history/ on every /dashboard/ request, the code that
+writes or deletes a quest's files records the change here:
+
+  images      uploads in history/images/<quest_id>/ (oaak.save_image*)
+  renditions  resized copies in history/cache/<res>/ (app.explore_images)
+              and vision renditions (image_handler.get_vision_base64_from_path)
+
+Each quest has one document with <kind>_bytes / <kind>_files counters and
+their totals, updated with a single $inc upsert per file. Accounting never
+fails the write it describes: errors are printed and the drift is left to
+the reconcile command, which walks the disk and sets the exact values:
+
+    python storage_stats.py reconcile [--quest ID] [--dry-run]
+    python storage_stats.py show [-n 20]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import db
+
+IMAGES = "images"
+RENDITIONS = "renditions"
+KINDS = (IMAGES, RENDITIONS)
+
+HISTORY_DIR = os.path.abspath("history")
+
+
+def rendition_path(base_dir: str, res: str, image_path: str) -> str:
+    """Cached resize of `image_path` (relative to <base_dir>/images) at resolution `res`."""
+    image_hash = hashlib.md5(image_path.encode()).hexdigest()
+    file_ext = os.path.splitext(image_path)[1].lower()
+    return os.path.join(base_dir, "cache", res, f"{image_hash}{file_ext}")
+
+
+def file_size(path: str) -> Optional[int]:
+    """Size of `path`, or None if it does not exist (call before overwriting a file)."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def quest_of_image(image_path: str) -> Optional[str]:
+    """Quest id of a file under <history>/images/<quest_id>/, else None."""
+    parent = os.path.dirname(os.path.abspath(image_path))
+    if os.path.basename(os.path.dirname(parent)) != "images":
+        return None
+    return os.path.basename(parent)
+
+
+def record(quest_id: str, kind: str, bytes_delta: int, files_delta: int) -> None:
+    """Add to the counters of a quest; never raises."""
+    if not quest_id or (bytes_delta == 0 and files_delta == 0):
+        return
+    try:
+        db.get_quest_storage_collection().update_one(
+            {"quest_id": quest_id},
+            {
+                "$inc": {
+                    f"{kind}_bytes": bytes_delta,
+                    f"{kind}_files": files_delta,
+                    "total_bytes": bytes_delta,
+                    "total_files": files_delta,
+                },
+                "$set": {"updated_at": datetime.now(timezone.utc)},
+            },
+            upsert=True,
+        )
+    except Exception as e:
+        print(f"Error recording storage of quest {quest_id}: {e}")
+
+
+def file_written(quest_id: str, kind: str, path: str, previous_size: Optional[int] = None) -> None:
+    """Record a file just written; `previous_size` is the size it replaced, if any."""
+    size = file_size(path)
+    if size is None:
+        return
+    if previous_size is None:
+        record(quest_id, kind, size, 1)
+    else:
+        record(quest_id, kind, size - previous_size, 0)
+
+
+# ---------------------------------------------------------------------------
+# Reads
+# ---------------------------------------------------------------------------
+
+def list_usage(sort: str = "quest_id", descending: bool = False, limit: int = 0) -> List[Dict[str, Any]]:
+    """One document per quest, as kept by the counters above."""
+    try:
+        return list(
+            db.get_quest_storage_collection()
+            .find({}, {"_id": 0})
+            .sort(sort, -1 if descending else 1)
+            .limit(limit)
+        )
+    except Exception as e:
+        print(f"Error listing quest storage: {e}")
+        return []
+
+
+# ---------------------------------------------------------------------------
+# Reconciliation
+# ---------------------------------------------------------------------------
+
+def _rendition_dirs(base_dir: str) -> List[str]:
+    cache_dir = os.path.join(base_dir, "cache")
+    if not os.path.isdir(cache_dir):
+        return []
+    vision_dir = os.path.abspath(_vision_cache_dir())
+    return sorted(
+        name for name in os.listdir(cache_dir)
+        if os.path.isdir(os.path.join(cache_dir, name))
+        and os.path.abspath(os.path.join(cache_dir, name)) != vision_dir
+    )
+
+
+def _vision_cache_dir() -> str:
+    import image_handler
+
+    return image_handler.VISION_CACHE_DIR
+
+
+def measure(quest_id: str, base_dir: str = HISTORY_DIR) -> Dict[str, int]:
+    """Exact counters of a quest, from the disk."""
+    import image_handler
+
+    usage = {f"{kind}_{unit}": 0 for kind in KINDS for unit in ("bytes", "files")}
+    images_dir = os.path.join(base_dir, "images", quest_id)
+    if os.path.isdir(images_dir):
+        res_dirs = _rendition_dirs(base_dir)
+        for name in os.listdir(images_dir):
+            path = os.path.join(images_dir, name)
+            size = file_size(path)
+            if size is None or not os.path.isfile(path):
+                continue
+            usage["images_bytes"] += size
+            usage["images_files"] += 1
+
+            renditions = [rendition_path(base_dir, res, f"{quest_id}/{name}") for res in res_dirs]
+            try:
+                # Only the rendition for the current vision settings is attributable
+                renditions.append(image_handler.vision_cache_path(path))
+            except OSError:
+                pass
+            for rendition in renditions:
+                rendition_size = file_size(rendition)
+                if rendition_size is not None:
+                    usage["renditions_bytes"] += rendition_size
+                    usage["renditions_files"] += 1
+
+    usage["total_bytes"] = usage["images_bytes"] + usage["renditions_bytes"]
+    usage["total_files"] = usage["images_files"] + usage["renditions_files"]
+    return usage
+
+
+def reconcile(quest_ids: Optional[List[str]] = None, base_dir: str = HISTORY_DIR,
+              dry_run: bool = False) -> List[Dict[str, Any]]:
+    """
+    Set the counters of every quest (or `quest_ids`) to what is on disk.
+    Returns the quests whose counters drifted, with the difference.
+    """
+    col = db.get_quest_storage_collection()
+    recorded = {doc["quest_id"]: doc for doc in col.find({}, {"_id": 0})}
+    known = set(db.get_all_quest_ids())
+
+    if quest_ids is None:
+        images_root = os.path.join(base_dir, "images")
+        on_disk = set(os.listdir(images_root)) if os.path.isdir(images_root) else set()
+        quest_ids = sorted(
+            {q for q in on_disk if not q.startswith(".") and os.path.isdir(os.path.join(images_root, q))}
+            | known
+            | set(recorded)
+        )
+
+    drifted = []
+    now = datetime.now(timezone.utc)
+    for quest_id in quest_ids:
+        usage = measure(quest_id, base_dir)
+        previous = recorded.get(quest_id, {})
+        diff = {key: value - previous.get(key, 0) for key, value in usage.items() if value != previous.get(key, 0)}
+        orphan = usage["total_files"] == 0 and quest_id not in known
+        if diff or (orphan and quest_id in recorded):
+            drifted.append({"quest_id": quest_id, "diff": diff, "orphan": orphan})
+        if dry_run:
+            continue
+        if orphan:
+            col.delete_one({"quest_id": quest_id})
+        else:
+            col.update_one(
+                {"quest_id": quest_id},
+                {
+                    "$set": {**usage, "reconciled_at": now},
+                    "$setOnInsert": {"updated_at": now},
+                },
+                upsert=True,
+            )
+    return drifted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-quest disk usage kept in MongoDB")
+    sub = parser.add_subparsers(dest="action", required=True)
+    rec = sub.add_parser("reconcile", help="Recompute the counters from the disk and fix any drift")
+    rec.add_argument("--quest", action="append", help="Only this quest (repeatable)")
+    rec.add_argument("--base-dir", default=HISTORY_DIR, help="History directory (default: ./history)")
+    rec.add_argument("--dry-run", action="store_true", help="Only report drift")
+    show = sub.add_parser("show", help="Largest quests")
+    show.add_argument("-n", type=int, default=20, help="Number of quests (default: 20)")
+    args = parser.parse_args()
+
+    try:
+        db.get_client()
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+
+    if args.action == "reconcile":
+        drifted = reconcile(args.quest, args.base_dir, args.dry_run)
+        for row in drifted:
+            if row["orphan"]:
+                print(f"{row['quest_id']}: no files and no quest, {'would remove' if args.dry_run else 'removed'}")
+            else:
+                changes = ", ".join(f"{key} {delta:+d}" for key, delta in sorted(row["diff"].items()))
+                print(f"{row['quest_id']}: {changes}")
+        print(f"{len(drifted)} quests {'drifted' if args.dry_run else 'fixed'}")
+    elif args.action == "show":
+        rows = list_usage("total_bytes", descending=True, limit=args.n)
+        print(f"{'total MB':>10} {'files':>7} {'images MB':>10} {'renditions MB':>14}  quest")
+        for row in rows:
+            print(f"{row.get('total_bytes', 0) / 1e6:>10.1f} {row.get('total_files', 0):>7} "
+                  f"{row.get('images_bytes', 0) / 1e6:>10.1f} {row.get('renditions_bytes', 0) / 1e6:>14.1f}  "
+                  f"{row['quest_id']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,217 @@
+#!/usr/bin/env python3
+"""
+Batch (re-)identification of species on quest images.
+
+Observations to identify come from MongoDB (db.get_observations_to_identify):
+image observations without any species row or, with --outdated, without
+rows from the current model and prompt version. Images are identified by
+--concurrency threads through oaak_classify.identify_and_populate, so every
+call goes through the shared LLM rate limiter at background priority and
+through the identification cache. Calls refused by the limiter are retried
+after the delay it asks for; the run stops once the daily budget is spent.
+
+Each identified image is appended to a checkpoint file with the model and
+prompt version used. A re-run skips those images, including the ones where
+no species was found, unless --no-resume is given.
+
+Usage (from BITZ/server):
+    python -m utils.remake_species                      # dry-run: list what would be identified
+    python -m utils.remake_species --apply
+    python -m utils.remake_species --apply --outdated --model gpt-5.2 --concurrency 8
+"""
+
+import argparse
+import json
 import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import db
+import map_data
 import oaak_classify
-import argparse
-from tqdm import tqdm
-
-def process_history(history_folder):
-    history_folder = os.path.abspath(history_folder)
-    
-    if not os.path.exists(history_folder):
-        print(f"Error: History folder '{history_folder}' does not exist.")
-        return
-    
-    # Get all subfolders in history_folder
-    subfolders = [f.path for f in os.scandir(history_folder) if f.is_dir()]
-    
-    for folder in tqdm(subfolders, desc="Processing folders", unit="folder"):
-        conversation_id = os.path.basename(folder)  # Use the folder name as conversation_id
-        csv_path = os.path.join(folder, "species_data_english.csv")
-        imgs_folder = os.path.join(folder, "imgs")
-        
-        print(f"Working on quest {folder}")
-        
-        if os.path.exists(csv_path):
-            print(f"Skipping {folder}, CSV already exists.")
-            continue
-        
-        if not os.path.exists(imgs_folder):
-            print(f"Skipping {folder}, no 'imgs' folder found.")
-            continue
-        
-        # Get list of images
-        images = [os.path.join(imgs_folder, img) for img in os.listdir(imgs_folder) if img.lower().endswith((".jpg", ".png", ".jpeg"))]
-        
-        if not images:
-            print(f"No images found in {imgs_folder}. Skipping.")
-            continue
-        
-        # Process images with tqdm for progress tracking
-        for img_path in tqdm(images, desc=f"Processing images in {folder}", unit="image"):
-            oaak_classify.identify_and_populate(img_path, conversation_id, history_folder)
-            
-        print(f"Finished processing images in {folder}.")
+import rate_limiter
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Process species images in history folders.")
-    parser.add_argument("history_folder", type=str, help="Path to the history folder")
+MAX_LIMIT_RETRIES = 10
+
+
+def load_checkpoint(path: str, model: str, prompt_version: str) -> Set[Tuple[str, str]]:
+    """(quest_id, image) pairs already identified with this model and prompt."""
+    done = set()
+    if not os.path.isfile(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # truncated last line of an interrupted run
+            if entry.get("model") == model and entry.get("prompt_version") == prompt_version:
+                done.add((entry["quest_id"], entry["image"]))
+    return done
+
+
+def image_coordinates(obs: Dict[str, Any]) -> str:
+    """"lat,lng" of an observation, as identify_and_populate expects, or ""."""
+    position = map_data.lat_lng(obs.get("image_location"))
+    return f"{position[0]},{position[1]}" if position else ""
+
+
+def identify(obs: Dict[str, Any], history_directory: str, replace: bool,
+             stop: threading.Event) -> Tuple[str, int]:
+    """
+    Identify one observation image. Returns (status, species count) where
+    status is "ok", "missing" (no file) or "budget" (daily budget spent).
+    """
+    quest_id, image = obs["quest_id"], obs["image_filename"]
+    image_path = os.path.join(history_directory, "images", quest_id, image)
+    if not os.path.isfile(image_path):
+        return "missing", 0
+
+    for _attempt in range(MAX_LIMIT_RETRIES):
+        if stop.is_set():
+            return "budget", 0
+        try:
+            count = oaak_classify.identify_and_populate(
+                image_path, quest_id, history_directory, image_coordinates(obs),
+                language=oaak_classify.IDENTIFY_LANGUAGE,
+            )
+            break
+        except rate_limiter.BudgetExceeded:
+            stop.set()
+            return "budget", 0
+        except rate_limiter.LimitExceeded as e:
+            # Interactive traffic comes first; wait as long as the limiter asks
+            stop.wait(e.retry_after)
+    else:
+        raise RuntimeError(f"still rate limited after {MAX_LIMIT_RETRIES} attempts")
+
+    if replace:
+        db.delete_outdated_species(quest_id, image, oaak_classify.IDENTIFY_MODEL, oaak_classify.PROMPT_VERSION)
+    return "ok", count
+
+
+def remake_species(
+    history_directory: str,
+    apply: bool = False,
+    outdated: bool = False,
+    quest_ids: Optional[List[str]] = None,
+    concurrency: int = 4,
+    limit: int = 0,
+    checkpoint_path: str = "remake_species_checkpoint.jsonl",
+    resume: bool = True,
+) -> int:
+    model, prompt_version = oaak_classify.IDENTIFY_MODEL, oaak_classify.PROMPT_VERSION
+    print(f"Model {model}, prompt version {prompt_version}")
+
+    pending = db.get_observations_to_identify(
+        quest_ids=quest_ids,
+        model=model if outdated else None,
+        prompt_version=prompt_version if outdated else None,
+    )
+    done = load_checkpoint(checkpoint_path, model, prompt_version) if resume else set()
+    pending = [obs for obs in pending if (obs["quest_id"], obs["image_filename"]) not in done]
+    if limit:
+        pending = pending[:limit]
+
+    per_quest = Counter(obs["quest_id"] for obs in pending)
+    print(f"{len(pending)} image(s) to identify in {len(per_quest)} quest(s)"
+          + (f" ({len(done)} already done per {checkpoint_path})" if done else ""))
+
+    if not apply:
+        for quest_id, count in sorted(per_quest.items()):
+            print(f"  {quest_id}: {count} image(s)")
+        if pending:
+            print(f"\nThis was a dry-run. Re-run with --apply to make {len(pending)} identification call(s) at most.")
+        return 0
+
+    ok = missing = failed = species = 0
+    stop = threading.Event()
+    started = time.monotonic()
+    with open(checkpoint_path, "a" if resume else "w", encoding="utf-8") as checkpoint, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(identify, obs, history_directory, outdated, stop): obs
+            for obs in pending
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            obs = futures[future]
+            label = f"{obs['quest_id']}/{obs['image_filename']}"
+            try:
+                status, count = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{i}/{len(pending)}] {label} ✗ {e}")
+                continue
+
+            if status == "budget":
+                continue
+            if status == "missing":
+                missing += 1
+                print(f"[{i}/{len(pending)}] {label} skipped, image file not found")
+                continue
+
+            ok += 1
+            species += count
+            elapsed = time.monotonic() - started
+            print(f"[{i}/{len(pending)}] {label} ✓ {count} species ({ok / elapsed:.2f} images/s)")
+            checkpoint.write(json.dumps({
+                "quest_id": obs["quest_id"],
+                "image": obs["image_filename"],
+                "model": model,
+                "prompt_version": prompt_version,
+                "species": count,
+            }) + "\n")
+            checkpoint.flush()
+
+    print(f"\n{'=' * 60}")
+    print(f"Identified     : {ok} image(s), {species} species row(s)")
+    print(f"Missing files  : {missing}")
+    print(f"Failed         : {failed}")
+    if stop.is_set():
+        print("\nDaily LLM budget reached — re-run tomorrow to continue from the checkpoint.")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Identify species on quest images that have none")
+    parser.add_argument("--history-dir", default="./history", help="History directory (default: ./history)")
+    parser.add_argument("--apply", action="store_true", help="Actually call the model (default is dry-run)")
+    parser.add_argument("--outdated", action="store_true",
+                        help="Also re-identify images whose species came from another model or prompt version")
+    parser.add_argument("--model", default=oaak_classify.IDENTIFY_MODEL,
+                        help=f"Identification model (default: {oaak_classify.IDENTIFY_MODEL})")
+    parser.add_argument("--quest", action="append", help="Only this quest (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Identifications in flight (default: 4)")
+    parser.add_argument("--limit", type=int, default=0, help="Identify at most N images")
+    parser.add_argument("--checkpoint", default="remake_species_checkpoint.jsonl",
+                        help="Progress file (default: remake_species_checkpoint.jsonl)")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore the checkpoint")
     args = parser.parse_args()
-    
-    process_history(args.history_folder)
+
+    try:
+        db.get_client()
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+
+    # Read at call time by oaak_classify, and recorded on the species rows
+    oaak_classify.IDENTIFY_MODEL = args.model
+
+    sys.exit(remake_species(
+        os.path.abspath(args.history_dir),
+        apply=args.apply,
+        outdated=args.outdated,
+        quest_ids=args.quest,
+        concurrency=args.concurrency,
+        limit=args.limit,
+        checkpoint_path=args.checkpoint,
+        resume=not args.no_resume,
+    ))
+
+
+if __name__ == "__main__":
+    main()